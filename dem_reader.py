@@ -0,0 +1,394 @@
+import glob
+import json
+import os
+from collections import OrderedDict
+import numpy as np
+import rasterio
+import shapely
+from affine import Affine
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+from shapely.strtree import STRtree
+
+class DEMSource:
+    """
+    Base class of the DEM readers: vectorized sampling of elevations at arrays of coordinates.
+    Subclasses provide transform, shape (height, width), nodata and _read_pixels.
+    """
+    transform = None
+    shape = None
+    nodata = None
+
+    @property
+    def bounds(self):
+        height, width = self.shape
+        west, south, east, north = rasterio.transform.array_bounds(height, width, self.transform)
+        return float(west), float(south), float(east), float(north)
+
+    def _read_pixels(self, rows, cols):
+        """Return the values of the pixels (rows, cols) as float64, NaN outside the raster or on nodata"""
+        raise NotImplementedError
+
+    def _fractional_rowcol(self, coords):
+        """Convert (N, 2) x/y coordinates to fractional row/col pixel coordinates"""
+        coords = np.asarray(coords, dtype="float64").reshape(-1, 2)
+        inverse = ~self.transform
+        cols = inverse.a * coords[:, 0] + inverse.b * coords[:, 1] + inverse.c
+        rows = inverse.d * coords[:, 0] + inverse.e * coords[:, 1] + inverse.f
+        return rows, cols
+
+    def _valid_pixels(self, rows, cols):
+        """Mask of the pixel indexes that fall inside the raster"""
+        height, width = self.shape
+        return (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width)
+
+    def sample(self, coords, method="nearest"):
+        """
+        Sample the DEM at an (N, 2) array of x/y coordinates in one operation.
+        method: "nearest" (value of the pixel containing the point, as rasterio.transform.rowcol)
+        or "bilinear" (interpolation between the 4 surrounding pixel centres, falling back to
+        nearest where one of them is missing).
+        Returns (values, valid): float64 elevations (NaN where invalid) and the boolean mask of valid
+        values, False outside the raster and on nodata.
+        """
+        rows_f, cols_f = self._fractional_rowcol(coords)
+        if len(rows_f) == 0:
+            return np.empty(0), np.zeros(0, dtype=bool)
+
+        rows = np.floor(rows_f).astype("int64")
+        cols = np.floor(cols_f).astype("int64")
+        values = self._read_pixels(rows, cols)
+
+        if method == "bilinear":
+            # Position relative to the pixel centres
+            row0 = np.floor(rows_f - 0.5).astype("int64")
+            col0 = np.floor(cols_f - 0.5).astype("int64")
+            row_weight = rows_f - 0.5 - row0
+            col_weight = cols_f - 0.5 - col0
+            v00 = self._read_pixels(row0, col0)
+            v01 = self._read_pixels(row0, col0 + 1)
+            v10 = self._read_pixels(row0 + 1, col0)
+            v11 = self._read_pixels(row0 + 1, col0 + 1)
+            interpolated = (
+                v00 * (1 - row_weight) * (1 - col_weight)
+                + v01 * (1 - row_weight) * col_weight
+                + v10 * row_weight * (1 - col_weight)
+                + v11 * row_weight * col_weight
+            )
+            values = np.where(np.isnan(interpolated), values, interpolated)
+        elif method != "nearest":
+            raise ValueError(f"Unknown sampling method: {method}")
+
+        return values, ~np.isnan(values)
+
+    def close(self):
+        """Release the open files of the reader, if any"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class ArrayDEM(DEMSource):
+    """DEM held in memory as a NumPy array"""
+    def __init__(self, array, transform, nodata=None):
+        self.array = array
+        self.transform = transform
+        self.shape = array.shape
+        self.nodata = nodata
+
+    @classmethod
+    def from_file(cls, path):
+        """Read the first band of a raster file"""
+        with rasterio.open(path) as src:
+            return cls(src.read(1), src.transform, src.nodata)
+
+    def _read_pixels(self, rows, cols):
+        inside = self._valid_pixels(rows, cols)
+        values = np.full(rows.shape, np.nan)
+        values[inside] = self.array[rows[inside], cols[inside]]
+        if self.nodata is not None:
+            values[values == self.nodata] = np.nan
+        return values
+
+class MemmapDEM(ArrayDEM):
+    """
+    DEM decoded once into a raw .npy file and memory-mapped read-only, so that the worker processes
+    of a pool share the pages of the OS cache instead of each holding a copy of the array.
+    The transform, nodata and modification time of the source are stored in a .json sidecar;
+    the cache is rebuilt when the source has changed. Pickling only carries the path of the cache,
+    and unpickling re-attaches the mapping, so sending it to a worker is near-instant.
+    """
+    def __init__(self, path, cache_dir=None):
+        self.path = path
+        base = os.path.splitext(os.path.basename(path))[0]
+        cache_dir = cache_dir or os.path.dirname(os.path.abspath(path))
+        self.array_path = os.path.join(cache_dir, f"{base}.npy")
+        self.meta_path = os.path.join(cache_dir, f"{base}.npy.json")
+        if not self._cache_is_valid():
+            self._build_cache()
+        self._attach()
+
+    def _cache_is_valid(self):
+        if not (os.path.exists(self.array_path) and os.path.exists(self.meta_path)):
+            return False
+        with open(self.meta_path) as f:
+            meta = json.load(f)
+        return meta.get("source_mtime") == os.path.getmtime(self.path)
+
+    def _build_cache(self):
+        """Decode the first band of the source to the .npy file, block by block"""
+        os.makedirs(os.path.dirname(self.array_path), exist_ok=True)
+        tmp_path = f"{self.array_path}.{os.getpid()}.tmp"
+        with rasterio.open(self.path) as src:
+            array = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=src.dtypes[0], shape=src.shape)
+            for _, window in src.block_windows(1):
+                array[window.toslices()] = src.read(1, window=window)
+            array.flush()
+            del array
+            meta = {
+                "transform": list(src.transform)[:6],
+                "nodata": src.nodata,
+                "source_mtime": os.path.getmtime(self.path)
+            }
+        os.replace(tmp_path, self.array_path)
+        with open(self.meta_path, "w") as f:
+            json.dump(meta, f, indent=1)
+        print(f"DEM cached to {self.array_path} ({os.path.getsize(self.array_path) / 1024 / 1024:.0f} MB, uncompressed)")
+
+    def _attach(self):
+        with open(self.meta_path) as f:
+            meta = json.load(f)
+        self.array = np.load(self.array_path, mmap_mode="r")
+        self.transform = Affine(*meta["transform"])
+        self.shape = self.array.shape
+        self.nodata = meta["nodata"]
+
+    def __getstate__(self):
+        # The mapping is re-attached by the receiving process instead of copying the array
+        state = self.__dict__.copy()
+        del state["array"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.array = np.load(self.array_path, mmap_mode="r")
+
+class BlockCachedDEM(DEMSource):
+    """
+    DEM read on demand by blocks, kept in an LRU cache bounded by a memory budget.
+    Only the blocks touched by the sampled points are read, so memory stays bounded whatever
+    the size of the raster. The internal tiling of the file is used when it has square-ish blocks;
+    striped files are read by windows of block_size x block_size pixels.
+    """
+    def __init__(self, path, cache_bytes=256 * 1024 * 1024, block_size=256):
+        self.path = path
+        self.cache_bytes = cache_bytes
+        self.block_size = block_size
+        self._src = None
+        self._blocks = OrderedDict()
+        self._cached_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        src = self._dataset()
+        self.transform = src.transform
+        self.shape = src.shape
+        self.nodata = src.nodata
+        block_height, block_width = src.block_shapes[0]
+        if min(block_height, block_width) < 64:
+            block_height = block_width = block_size
+        self.block_shape = (block_height, block_width)
+
+    def _dataset(self):
+        if self._src is None:
+            self._src = rasterio.open(self.path)
+        return self._src
+
+    def _block(self, block_row, block_col):
+        """Return a block from the cache, reading it from the file on a miss"""
+        key = (block_row, block_col)
+        block = self._blocks.get(key)
+        if block is not None:
+            self._blocks.move_to_end(key)
+            self.hits += 1
+            return block
+
+        self.misses += 1
+        block_height, block_width = self.block_shape
+        row_off = block_row * block_height
+        col_off = block_col * block_width
+        height, width = self.shape
+        # Blocks on the right and bottom edges are truncated to the raster
+        window = Window(col_off, row_off, min(block_width, width - col_off), min(block_height, height - row_off))
+        block = self._dataset().read(1, window=window).astype("float64")
+        if self.nodata is not None:
+            block[block == self.nodata] = np.nan
+
+        self._blocks[key] = block
+        self._cached_bytes += block.nbytes
+        while self._cached_bytes > self.cache_bytes and len(self._blocks) > 1:
+            _, evicted = self._blocks.popitem(last=False)
+            self._cached_bytes -= evicted.nbytes
+        return block
+
+    def _read_pixels(self, rows, cols):
+        values = np.full(rows.shape, np.nan)
+        inside = np.flatnonzero(self._valid_pixels(rows, cols))
+        if len(inside) == 0:
+            return values
+
+        block_height, block_width = self.block_shape
+        block_rows = rows[inside] // block_height
+        block_cols = cols[inside] // block_width
+        n_block_cols = -(-self.shape[1] // block_width)
+        block_ids = block_rows * n_block_cols + block_cols
+
+        # Group the points by block so that each block is looked up once per call
+        order = np.argsort(block_ids, kind="stable")
+        unique_ids, starts = np.unique(block_ids[order], return_index=True)
+        ends = np.append(starts[1:], len(order))
+        for block_id, start, end in zip(unique_ids, starts, ends):
+            block_row, block_col = divmod(int(block_id), n_block_cols)
+            block = self._block(block_row, block_col)
+            points = inside[order[start:end]]
+            values[points] = block[rows[points] - block_row * block_height, cols[points] - block_col * block_width]
+        return values
+
+    def close(self):
+        """Close the dataset handle and drop the cached blocks"""
+        if self._src is not None:
+            self._src.close()
+            self._src = None
+        self._blocks.clear()
+        self._cached_bytes = 0
+
+    def stats(self):
+        """Return the block cache counters"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "cached_blocks": len(self._blocks),
+            "cached_mb": self._cached_bytes / 1024 / 1024
+        }
+
+    def __getstate__(self):
+        # The dataset handle and the cached blocks are not shared with other processes
+        state = self.__dict__.copy()
+        state["_src"] = None
+        state["_blocks"] = OrderedDict()
+        state["_cached_bytes"] = 0
+        return state
+
+class MosaicDEM(DEMSource):
+    """
+    DEM made of many tiles (e.g. the 1 km tiles of RGE ALTI) without merging them beforehand.
+    The footprints of the tiles are indexed in an STRtree; a tile is only opened when a sampled point
+    falls in it, and at most max_open_files tiles are kept open (LRU). Pixels are addressed on a
+    global grid covering all the tiles, so bilinear samples straddling tile edges are seamless.
+    """
+    def __init__(self, tiles, max_open_files=16, cache_bytes=256 * 1024 * 1024):
+        if isinstance(tiles, str):
+            tiles = sorted(
+                path for pattern in ("*.tif", "*.tiff", "*.asc")
+                for path in glob.glob(os.path.join(tiles, pattern))
+            )
+        if not tiles:
+            raise ValueError("No DEM tile found")
+
+        self.paths = list(tiles)
+        self.max_open_files = max_open_files
+        self.tile_cache_bytes = cache_bytes // max_open_files
+        self._open_tiles = OrderedDict()
+
+        # Only the headers are read here
+        footprints = []
+        for path in self.paths:
+            with rasterio.open(path) as src:
+                footprints.append(shapely.box(*src.bounds))
+                if len(footprints) == 1:
+                    res_x, res_y = src.res
+                    self.nodata = src.nodata
+        self.footprints = np.array(footprints)
+        self.tree = STRtree(self.footprints)
+
+        minx, miny, maxx, maxy = shapely.total_bounds(self.footprints)
+        self.transform = from_origin(minx, maxy, res_x, res_y)
+        self.shape = (int(round((maxy - miny) / res_y)), int(round((maxx - minx) / res_x)))
+
+    def _tile(self, tile_index):
+        """Return the reader of a tile, opening it if needed and closing the least recently used one"""
+        reader = self._open_tiles.get(tile_index)
+        if reader is not None:
+            self._open_tiles.move_to_end(tile_index)
+            return reader
+
+        reader = BlockCachedDEM(self.paths[tile_index], cache_bytes=self.tile_cache_bytes)
+        self._open_tiles[tile_index] = reader
+        if len(self._open_tiles) > self.max_open_files:
+            _, evicted = self._open_tiles.popitem(last=False)
+            evicted.close()
+        return reader
+
+    def _read_pixels(self, rows, cols):
+        values = np.full(rows.shape, np.nan)
+        inside = np.flatnonzero(self._valid_pixels(rows, cols))
+        if len(inside) == 0:
+            return values
+
+        # Centres of the requested pixels of the global grid
+        x = self.transform.c + (cols[inside] + 0.5) * self.transform.a
+        y = self.transform.f + (rows[inside] + 0.5) * self.transform.e
+        point_indexes, tile_indexes = self.tree.query(shapely.points(x, y), predicate="intersects")
+        # A centre on a shared edge only happens with misaligned tiles: keep the first tile
+        point_indexes, first = np.unique(point_indexes, return_index=True)
+        tile_indexes = tile_indexes[first]
+
+        for tile_index in np.unique(tile_indexes):
+            points = point_indexes[tile_indexes == tile_index]
+            reader = self._tile(int(tile_index))
+            tile_rows, tile_cols = reader._fractional_rowcol(np.column_stack([x[points], y[points]]))
+            values[inside[points]] = reader._read_pixels(np.floor(tile_rows).astype("int64"), np.floor(tile_cols).astype("int64"))
+        return values
+
+    def close(self):
+        """Close the open tiles"""
+        for reader in self._open_tiles.values():
+            reader.close()
+        self._open_tiles.clear()
+
+    def stats(self):
+        """Return the counters of the open tiles"""
+        return {
+            "tiles": len(self.paths),
+            "open_tiles": len(self._open_tiles),
+            "hits": sum(reader.hits for reader in self._open_tiles.values()),
+            "misses": sum(reader.misses for reader in self._open_tiles.values())
+        }
+
+    def __getstate__(self):
+        # Open tiles are not shared with other processes
+        state = self.__dict__.copy()
+        state["_open_tiles"] = OrderedDict()
+        return state
+
+def open_dem(path, mode="memory", cache_bytes=256 * 1024 * 1024, cache_dir=None):
+    """
+    Open a DEM for sampling.
+    path: a raster file, or a directory or list of tiles (always read as a MosaicDEM)
+    mode: "memory" (whole band in memory), "blocks" (block-cached windowed reads)
+    or "memmap" (memory-mapped .npy cache shared by worker processes, written to cache_dir,
+    next to the DEM by default)
+    """
+    if isinstance(path, (list, tuple)) or os.path.isdir(path):
+        return MosaicDEM(path, cache_bytes=cache_bytes)
+    if mode == "memory":
+        return ArrayDEM.from_file(path)
+    if mode == "blocks":
+        return BlockCachedDEM(path, cache_bytes=cache_bytes)
+    if mode == "memmap":
+        return MemmapDEM(path, cache_dir=cache_dir)
+    raise ValueError(f"Unknown DEM mode: {mode}")
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+def request_key(params):
+    """
+    Key identifying a request by its parameters, whatever the host it is sent to.
+    Parameter names are case-insensitive for OGC services, so they are upper-cased.
+    """
+    normalized = sorted((str(name).upper(), str(value)) for name, value in (params or {}).items())
+    return hashlib.sha256(json.dumps(normalized).encode("utf-8")).hexdigest()
+
+class ResponseRecorder:
+    """
+    Record the responses received by a GeoplateformeClient to a directory, so that they can be
+    replayed offline by geoplateforme_stub. Each response is stored as <key>.body with a <key>.json
+    sidecar holding the URL, the parameters and the content type.
+    """
+    def __init__(self, directory="recordings"):
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+
+    def record(self, url, params, response):
+        key = request_key(params)
+        with open(os.path.join(self.directory, f"{key}.body"), "wb") as f:
+            f.write(response.content)
+        meta = {
+            "url": url,
+            "params": {str(name): str(value) for name, value in (params or {}).items()},
+            "status_code": response.status_code,
+            "content_type": response.headers.get("Content-Type", "application/octet-stream")
+        }
+        with open(os.path.join(self.directory, f"{key}.json"), "w") as f:
+            json.dump(meta, f, indent=1)
+
+class GeoplateformeClient:
+    """
+    Shared HTTP client for the Géoplateforme services (WFS and WMS).
+    One pooled keep-alive session, retries with exponential backoff on transient errors (429, 5xx),
+    a default timeout, an optional requests-per-second limit per endpoint and per-endpoint latency and byte counters.
+    Without a limit, the request rate is only bounded by the thread pools and by the backoff on 429 responses.
+    """
+    def __init__(self, max_retries=5, backoff_factor=1.0, requests_per_second=None, timeout=(10, 120), pool_size=16, recorder=None):
+        self.timeout = timeout  # (connect, read) in seconds
+        self.recorder = recorder  # ResponseRecorder capturing the successful responses, if set
+        self.requests_per_second = requests_per_second  # Default limit of each endpoint, None for no limit
+        self._rate_limits = {}  # Limits set for single endpoints with set_rate_limit
+
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,  # waits backoff_factor * 2^(n-1) s between attempts
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(["GET"]),
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._lock = threading.Lock()
+        self._next_request_time = defaultdict(float)
+        self._stats = defaultdict(lambda: {"requests": 0, "errors": 0, "latency": 0.0, "max_latency": 0.0, "bytes": 0})
+
+    def set_rate_limit(self, url, requests_per_second):
+        """Limit the requests sent to one endpoint (None removes the limit), independently of the other endpoints"""
+        with self._lock:
+            self._rate_limits[url] = requests_per_second
+
+    def _wait_for_slot(self, url):
+        """Block until the rate limit of the endpoint allows a new request"""
+        with self._lock:
+            requests_per_second = self._rate_limits.get(url, self.requests_per_second)
+            if not requests_per_second:
+                return
+            now = time.monotonic()
+            wait = self._next_request_time[url] - now
+            self._next_request_time[url] = max(now, self._next_request_time[url]) + 1.0 / requests_per_second
+        if wait > 0:
+            time.sleep(wait)
+
+    def get(self, url, params=None, **kwargs):
+        """Send a GET request through the shared session and record its latency and size"""
+        self._wait_for_slot(url)
+        kwargs.setdefault("timeout", self.timeout)
+
+        start = time.perf_counter()
+        try:
+            response = self.session.get(url, params=params, **kwargs)
+        except requests.RequestException:
+            with self._lock:
+                self._stats[url]["errors"] += 1
+            raise
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            endpoint_stats = self._stats[url]
+            endpoint_stats["requests"] += 1
+            endpoint_stats["latency"] += elapsed
+            endpoint_stats["max_latency"] = max(endpoint_stats["max_latency"], elapsed)
+            endpoint_stats["bytes"] += len(response.content)
+            if response.status_code != 200:
+                endpoint_stats["errors"] += 1
+
+        if self.recorder is not None and response.status_code == 200:
+            self.recorder.record(url, params, response)
+
+        return response
+
+    def stats(self):
+        """Return the counters of each endpoint, with the mean latency"""
+        with self._lock:
+            stats = {}
+            for url, endpoint_stats in self._stats.items():
+                stats[url] = dict(endpoint_stats)
+                n_requests = endpoint_stats["requests"]
+                stats[url]["mean_latency"] = endpoint_stats["latency"] / n_requests if n_requests else 0.0
+            return stats
+
+    def print_stats(self):
+        """Print a summary of the requests sent to each endpoint"""
+        for url, endpoint_stats in self.stats().items():
+            print(
+                f"{url}: {endpoint_stats['requests']} requests, {endpoint_stats['errors']} errors, "
+                f"mean latency {endpoint_stats['mean_latency']:.2f} s (max {endpoint_stats['max_latency']:.2f} s), "
+                f"{endpoint_stats['bytes'] / 1e6:.1f} MB"
+            )
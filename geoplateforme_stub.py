@@ -0,0 +1,208 @@
+import argparse
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+import geopandas as gpd
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.io import MemoryFile
+from rasterio.transform import from_bounds
+from rasterio.windows import from_bounds as window_from_bounds
+from shapely.geometry import box
+from geoplateforme_client import request_key
+
+class GeoplateformeStub:
+    """
+    Local stand-in for the Géoplateforme WFS and WMS endpoints, for offline benchmarks and regression runs.
+    Requests are answered, in order of preference:
+    - from responses recorded by geoplateforme_client.ResponseRecorder (recordings_dir),
+    - WFS GetFeature: from local layers (type name -> GeoDataFrame or vector file), with attribute='value'
+      and BBOX filters, SORTBY, STARTINDEX/COUNT paging and numberMatched,
+    - WMS GetMap: as a GeoTIFF resampled from a local DEM (dem_path) or, without one, from a synthetic terrain.
+    latency adds a fixed delay (in seconds) to every response, and transient_errors answers each distinct request
+    with that many 503 errors before serving it, to exercise the retries of the client.
+    Point get_data_functions to it with set_endpoints(stub.url + "/wfs/ows", stub.url + "/wms-r").
+    """
+    def __init__(self, host="127.0.0.1", port=8080, recordings_dir=None, layers=None, dem_path=None, latency=0.0, transient_errors=0):
+        self.host = host
+        self.port = port
+        self.recordings_dir = recordings_dir
+        self.dem_path = dem_path
+        self.latency = latency
+        self.transient_errors = transient_errors
+        self.request_counts = Counter()  # Requests received, by request_key of their parameters
+        self._counts_lock = threading.Lock()
+        self.layers = {}
+        for type_of_data, layer in (layers or {}).items():
+            self.layers[type_of_data] = gpd.read_file(layer) if isinstance(layer, str) else layer
+        self.server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def start(self):
+        """Start serving in a background thread and return the base URL"""
+        self.server = ThreadingHTTPServer((self.host, self.port), self._make_handler())
+        self.port = self.server.server_address[1]  # Actual port when port=0
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        print(f"Géoplateforme stub listening on {self.url}")
+        return self.url
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                params = dict(parse_qsl(urlparse(self.path).query, keep_blank_values=True))
+                if stub.latency:
+                    time.sleep(stub.latency)
+                with stub._counts_lock:
+                    key = request_key(params)
+                    stub.request_counts[key] += 1
+                    n_received = stub.request_counts[key]
+                try:
+                    if n_received <= stub.transient_errors:
+                        status, content_type, body = 503, "text/plain", b"Service temporarily unavailable"
+                    else:
+                        status, content_type, body = stub.handle(params)
+                except Exception as e:
+                    status, content_type, body = 500, "text/plain", f"Stub error: {e}".encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def handle(self, params):
+        """Return (status, content type, body) for the parameters of a request"""
+        recorded = self._recorded_response(params)
+        if recorded is not None:
+            return recorded
+
+        upper_params = {name.upper(): value for name, value in params.items()}
+        service = upper_params.get("SERVICE", "").upper()
+        request = upper_params.get("REQUEST", "")
+        if service == "WFS" and request == "GetFeature":
+            return self._get_feature(upper_params)
+        if service == "WMS" and request == "GetMap":
+            return self._get_map(upper_params)
+        return 400, "text/plain", f"Unsupported request {service} {request}".encode("utf-8")
+
+    def _recorded_response(self, params):
+        if not self.recordings_dir:
+            return None
+        key = request_key(params)
+        body_path = os.path.join(self.recordings_dir, f"{key}.body")
+        if not os.path.exists(body_path):
+            return None
+        with open(os.path.join(self.recordings_dir, f"{key}.json")) as f:
+            meta = json.load(f)
+        with open(body_path, "rb") as f:
+            return meta["status_code"], meta["content_type"], f.read()
+
+    def _get_feature(self, params):
+        type_of_data = params.get("TYPENAMES")
+        if type_of_data not in self.layers:
+            return 404, "text/plain", f"No recorded response and no local layer for {type_of_data}".encode("utf-8")
+        gdf = self.layers[type_of_data]
+
+        # Attribute filters: the attribute='value' equalities of the CQL filter, combined with AND
+        cql_filter = params.get("CQL_FILTER", "")
+        for attribute, value in re.findall(r"(\w+)\s*=\s*'([^']*)'", cql_filter):
+            if attribute in gdf.columns:
+                gdf = gdf[gdf[attribute].astype(str) == value]
+
+        # Spatial filter: BBOX predicate of the CQL filter or bbox parameter
+        bbox_match = re.search(r"BBOX\(\s*\w+\s*,\s*([-\d.eE]+)\s*,\s*([-\d.eE]+)\s*,\s*([-\d.eE]+)\s*,\s*([-\d.eE]+)", cql_filter)
+        if bbox_match:
+            bbox_values = [float(v) for v in bbox_match.groups()]
+        elif params.get("BBOX"):
+            bbox_values = [float(v) for v in params["BBOX"].split(",")[:4]]
+        else:
+            bbox_values = None
+        if bbox_values is not None:
+            gdf = gdf[gdf.intersects(box(*bbox_values))]
+
+        number_matched = len(gdf)
+        sort_by = params.get("SORTBY")
+        if sort_by and sort_by.split()[0] in gdf.columns:
+            gdf = gdf.sort_values(sort_by.split()[0], kind="stable")
+        start_index = int(params.get("STARTINDEX", 0))
+        count = params.get("COUNT")
+        gdf = gdf.iloc[start_index:start_index + int(count)] if count else gdf.iloc[start_index:]
+
+        content = json.loads(gdf.to_json(drop_id=True)) if not gdf.empty else {"type": "FeatureCollection", "features": []}
+        content["numberMatched"] = number_matched
+        content["numberReturned"] = len(gdf)
+        return 200, "application/json", json.dumps(content).encode("utf-8")
+
+    def _get_map(self, params):
+        minx, miny, maxx, maxy = [float(v) for v in params["BBOX"].split(",")]
+        width = int(params["WIDTH"])
+        height = int(params["HEIGHT"])
+        transform = from_bounds(minx, miny, maxx, maxy, width, height)
+        nodata = -99999.0
+
+        if self.dem_path:
+            with rasterio.open(self.dem_path) as src:
+                window = window_from_bounds(minx, miny, maxx, maxy, transform=src.transform)
+                data = src.read(1, window=window, out_shape=(height, width), boundless=True,
+                                fill_value=src.nodata if src.nodata is not None else nodata,
+                                resampling=Resampling.bilinear).astype("float32")
+                if src.nodata is not None:
+                    data[data == src.nodata] = nodata
+        else:
+            # Synthetic terrain: an inclined plane with gentle undulations, centred on the pixels
+            xs = minx + (np.arange(width) + 0.5) * (maxx - minx) / width
+            ys = maxy - (np.arange(height) + 0.5) * (maxy - miny) / height
+            x_grid, y_grid = np.meshgrid(xs, ys)
+            data = (100 + 0.001 * x_grid + 0.002 * y_grid + 5 * np.sin(x_grid / 200) * np.cos(y_grid / 300)).astype("float32")
+
+        with MemoryFile() as memfile:
+            with memfile.open(driver="GTiff", width=width, height=height, count=1, dtype="float32",
+                              crs="EPSG:2154", transform=transform, nodata=nodata) as dst:
+                dst.write(data, 1)
+            return 200, "image/geotiff", memfile.read()
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Géoplateforme WFS and WMS endpoints")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--recordings", help="Directory of responses recorded with ResponseRecorder")
+    parser.add_argument("--layer", action="append", default=[], help="TYPENAME=path of a vector file, e.g. BDTOPO_V3:troncon_de_route=troncons.gpkg")
+    parser.add_argument("--dem", help="DEM served by GetMap (synthetic terrain if omitted)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Delay added to every response, in seconds")
+    parser.add_argument("--transient-errors", type=int, default=0, help="Number of 503 errors returned for each request before answering it")
+    args = parser.parse_args()
+
+    layers = dict(layer.split("=", 1) for layer in args.layer)
+    stub = GeoplateformeStub(args.host, args.port, args.recordings, layers, args.dem, args.latency, args.transient_errors)
+    stub.start()
+    print(f"WFS: {stub.url}/wfs/ows  WMS: {stub.url}/wms-r")
+    try:
+        stub._thread.join()
+    except KeyboardInterrupt:
+        stub.stop()
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,57 @@
+import asyncio
+import math
+import os
+import time
 import requests
 import geopandas as gpd
-from shapely.geometry import shape, box
+import numpy as np
+import pandas as pd
+import rasterio
+import rasterio.shutil
+from rasterio.io import MemoryFile
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import shapely
+from shapely.geometry import box
+from shapely.ops import unary_union
+from tqdm import tqdm
+from geoplateforme_client import GeoplateformeClient
+from wfs_cache import WFSCache
 
-def get_data(filter, type_of_data, bbox):
+# Endpoints of the Géoplateforme, configurable to point to a local stand-in (see geoplateforme_stub)
+WFS_URL = os.environ.get("GEOPF_WFS_URL", "https://data.geopf.fr/wfs/ows")
+WMS_URL = os.environ.get("GEOPF_WMS_URL", "https://data.geopf.fr/wms-r")
+
+# HTTP client shared by all the calls to the Géoplateforme (connection pool, retry with backoff on 429/5xx).
+# No rate limit by default: a limit can be set per endpoint with the requests_per_second of fetch_features and get_mnt
+client = GeoplateformeClient()
+
+# Local cache of the WFS responses, shared by get_data and get_ponts
+wfs_cache = WFSCache()
+
+# Optional local GeoParquet store of the BD TOPO layers (layer_store.LayerStore), used by get_data and get_ponts when set
+layer_store = None
+
+def set_endpoints(wfs_url=None, wms_url=None):
+    """Change the WFS and/or WMS endpoint used by get_data, get_ponts and get_mnt"""
+    global WFS_URL, WMS_URL
+    if wfs_url is not None:
+        WFS_URL = wfs_url
+    if wms_url is not None:
+        WMS_URL = wms_url
+
+def fetch_features(type_of_data, filter=None, bbox=None, cache=None, page_size=None, max_workers=4, requests_per_second=None):
     """
-    Fetches data from the WFS service
+    Run a WFS GetFeature request and return the features as a GeoDataFrame.
+    Responses are looked up in (and stored to) the local cache before hitting the network.
+    If page_size is given, the features are downloaded page by page with STARTINDEX/COUNT
+    by a pool of max_workers threads (see fetch_features_paged).
+    requests_per_second: if given, limit of the requests sent to the WFS from now on (shared by all the threads)
     """
-    url = "https://data.geopf.fr/wfs/ows"
+    cache = cache if cache is not None else wfs_cache
+    if requests_per_second is not None:
+        client.set_rate_limit(WFS_URL, requests_per_second)
 
     params = {
         "SERVICE": "WFS",
@@ -14,130 +59,289 @@ def get_data(filter, type_of_data, bbox):
         "VERSION": "2.0.0",
         "TYPENAMES": type_of_data,
         "OUTPUTFORMAT": "application/json",
-        "CQL_FILTER": filter,
         "SRSNAME": "EPSG:2154"  # Lambert-93
     }
+    if filter is not None:
+        params["CQL_FILTER"] = filter
+    if bbox is not None:
+        minx, miny, maxx, maxy = [float(x) for x in bbox]
+        params["bbox"] = f"{minx}, {miny}, {maxx}, {maxy}, EPSG:2154"
+
+    key = cache.make_key(type_of_data, filter, bbox, params["SRSNAME"], url=WFS_URL)
+    gdf = cache.get(key)
+    if gdf is not None:
+        print(f"Cache hit for {type_of_data} ({cache.hits} hits, {cache.misses} misses)")
+        return gdf
+
+    if cache.cache_only:
+        print(f"Cache-only mode: no cached response for {type_of_data}, filter={filter}, bbox={bbox}")
+        return None
 
-    response = requests.get(url, params=params)
+    if page_size is not None:
+        gdf = fetch_features_paged(params, page_size, max_workers)
+        cache.put(key, gdf, params=params)
+        return gdf
+
+    try:
+        response = client.get(WFS_URL, params=params)
+    except requests.RequestException as e:
+        print(f"Request failed for {type_of_data}: {e}")
+        return None
+    print(f"{type_of_data} response status: {response.status_code}")
 
     if response.status_code == 200:
         try:
             content = response.json()
-            
+
             # Create GeoDataFrame from the GeoJSON
             gdf = gpd.GeoDataFrame.from_features(content['features'])
-            
+
             # Explicitly set the CRS to Lambert-93
             gdf.set_crs(epsg=2154, inplace=True)
 
+            cache.put(key, gdf, params=params)
+            return gdf
+
+        except requests.exceptions.JSONDecodeError as e:
+            print(f"Failed to parse JSON: {e}")
+        except Exception as e:
+            print(f"An error occurred: {e}")
+    else:
+        print(f"Request failed with status code: {response.status_code}")
+
+    return None
+
+def _fetch_page(params, start_index, page_size, sort_by="cleabs"):
+    """Fetch one page of a GetFeature request, sorted on sort_by, and parse it into a GeoDataFrame"""
+    page_params = dict(params, STARTINDEX=start_index, COUNT=page_size)
+    if sort_by:
+        page_params["SORTBY"] = sort_by
+    response = client.get(WFS_URL, params=page_params)
+    response.raise_for_status()
+    content = response.json()
+
+    # numberMatched is "unknown" when the server does not count the features
+    number_matched = content.get("numberMatched")
+    if not isinstance(number_matched, int):
+        number_matched = None
+
+    features = content['features']
+    if not features:
+        return None, 0, number_matched
+
+    gdf = gpd.GeoDataFrame.from_features(features)
+    gdf.set_crs(epsg=2154, inplace=True)
+    return gdf, len(features), number_matched
+
+def fetch_features_paged(params, page_size=1000, max_workers=4, sort_by="cleabs"):
+    """
+    Download the features of a GetFeature request page by page (STARTINDEX/COUNT).
+    Pages are fetched concurrently by a bounded thread pool and each one is parsed as soon as it
+    arrives, so only the GeoDataFrames and at most max_workers raw pages are held in memory.
+    Pages are assembled in STARTINDEX order.
+    The server only guarantees the same order across requests with SORTBY, hence the sort on the stable
+    identifier sort_by; features returned in two pages are then dropped on it.
+    """
+    try:
+        first_page, n_features, number_matched = _fetch_page(params, 0, page_size, sort_by)
+    except Exception as e:
+        print(f"Paged request failed for {params['TYPENAMES']}: {e}")
+        return None
+
+    pages = [first_page]
+    print(f"{params['TYPENAMES']}: {number_matched if number_matched is not None else 'unknown number of'} features, pages of {page_size}")
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            if number_matched is not None:
+                # The total is known: fetch all remaining pages in parallel
+                start_indexes = range(page_size, number_matched, page_size)
+                for page, _, _ in executor.map(lambda start: _fetch_page(params, start, page_size, sort_by), start_indexes):
+                    pages.append(page)
+            else:
+                # The total is unknown: fetch batches of max_workers pages until a page comes back incomplete
+                start_index = page_size
+                last_page_full = n_features == page_size
+                while last_page_full:
+                    start_indexes = [start_index + k * page_size for k in range(max_workers)]
+                    for page, n_features, _ in executor.map(lambda start: _fetch_page(params, start, page_size, sort_by), start_indexes):
+                        pages.append(page)
+                        last_page_full = last_page_full and n_features == page_size
+                    start_index += max_workers * page_size
+    except Exception as e:
+        print(f"Paged request failed for {params['TYPENAMES']}: {e}")
+        return None
+
+    pages = [page for page in pages if page is not None]
+    if not pages:
+        # An empty result is not a failure: the layer store records the tile as covered
+        print(f"No features returned for {params['TYPENAMES']}")
+        return gpd.GeoDataFrame(geometry=[], crs="EPSG:2154")
+
+    gdf = gpd.GeoDataFrame(pd.concat(pages, ignore_index=True), crs="EPSG:2154")
+    if sort_by and sort_by in gdf.columns:
+        gdf = gdf.drop_duplicates(subset=sort_by, ignore_index=True)
+    print(f"{params['TYPENAMES']}: {len(gdf)} features downloaded in {len(pages)} pages")
+    return gdf
+
+def shrink_bbox(bbox, margin=100):
+    """Shrink a bbox (minx, miny, maxx, maxy) by margin meters on each side"""
+    minx, miny, maxx, maxy = [float(x) for x in bbox]
+    return minx + margin, miny + margin, maxx - margin, maxy - margin
+
+def spatial_filter(filter, bbox, geometry_name="geometrie"):
+    """
+    Combine a CQL attribute filter with a BBOX predicate, so the spatial selection is done by the server.
+    The WFS does not accept the bbox parameter together with CQL_FILTER, hence the predicate in the CQL.
+    """
+    minx, miny, maxx, maxy = [float(x) for x in bbox]
+    bbox_predicate = f"BBOX({geometry_name}, {minx}, {miny}, {maxx}, {maxy}, 'EPSG:2154')"
+    if filter:
+        return f"({filter}) AND {bbox_predicate}"
+    return bbox_predicate
+
+def get_data(filter, type_of_data, bbox, page_size=None, max_workers=4, prefetched=None, debug=False):
+    """
+    Fetches data from the WFS service
+    If a bbox is given, only the features intersecting the bbox shrunk by 100 m are requested
+    (BBOX predicate added to the CQL filter) and they are then clipped to it.
+    If page_size is given, the features are downloaded in parallel pages of page_size features.
+    If prefetched is given (see prefetch_route_layers), no request is sent and only the bbox filtering is applied.
+    If the module-level layer_store is set, the features are read from it and only missing tiles are downloaded.
+    debug: save the bbox and the bounds of the result as bounding_box1.gpkg and bounding_box2.gpkg
+    """
+    if prefetched is not None:
+        gdf = prefetched.copy()
+    elif bbox and layer_store is not None:
+        # Tiles are always fetched page by page: a tile cut by the server's feature limit would stay truncated in the store
+        def fetch_tile(tile_filter, tile_bbox):
+            return fetch_features(type_of_data, filter=spatial_filter(tile_filter, tile_bbox), page_size=page_size or 1000, max_workers=max_workers)
+        gdf = layer_store.get_features(type_of_data, filter, shrink_bbox(bbox), fetch_tile)
+    else:
+        request_filter = spatial_filter(filter, shrink_bbox(bbox)) if bbox else filter
+        gdf = fetch_features(type_of_data, filter=request_filter, page_size=page_size, max_workers=max_workers)
+
+    if gdf is not None:
+        try:
             # Use bounding box to filter relevant sections
             print(f"Bounding box: {bbox}")
-            save_bbox_as_geopackage(bbox, "bounding_box1.gpkg")
+            if debug:
+                save_bbox_as_geopackage(bbox, "bounding_box1.gpkg")
             print(f"GeoDataFrame bounds: {gdf.total_bounds}")
             if bbox:
-                print(f"Bounding box: {bbox}")
-                minx, miny, maxx, maxy = bbox
-                minx += 100
-                miny += 100
-                maxx -= 100
-                maxy -= 100
-                bbox_geom = box(minx, miny, maxx, maxy)
+                bbox_geom = box(*shrink_bbox(bbox))
                 gdf = gpd.clip(gdf, bbox_geom)
                 print(f"Filtered GeoDataFrame bounds: {gdf.total_bounds}")
-                save_bbox_as_geopackage(gdf.total_bounds, "bounding_box2.gpkg")
+                if debug:
+                    save_bbox_as_geopackage(gdf.total_bounds, "bounding_box2.gpkg")
 
             return gdf
-            
-        except requests.exceptions.JSONDecodeError as e:
-            print(f"Failed to parse JSON: {e}")
+
         except Exception as e:
             print(f"An error occurred: {e}")
-    else:
-        print(f"Request failed with status code: {response.status_code}")
 
     return None
 
-def get_ponts(filter, type_of_data):
+def get_ponts(filter, type_of_data, road_gdf=None):
     """
     Fetch bridges from the WFS service
+    road_gdf: route_numerotee_ou_nommee features of the road, fetched with filter if not given
     """
-    url = "https://data.geopf.fr/wfs/ows"
-
     # Get road geometry
-    road_params = {
-        "SERVICE": "WFS",
-        "REQUEST": "GetFeature",
-        "VERSION": "2.0.0",
-        "TYPENAMES": "BDTOPO_V3:route_numerotee_ou_nommee",
-        "OUTPUTFORMAT": "application/json",
-        "CQL_FILTER": filter,
-        "SRSNAME": "EPSG:2154"
-    }
-
-    road_response = requests.get(url, params=road_params)
-    print(f"Road response status: {road_response.status_code}")
+    if road_gdf is None:
+        road_gdf = fetch_features("BDTOPO_V3:route_numerotee_ou_nommee", filter=filter)
 
-    if road_response.status_code == 200:
+    if road_gdf is not None:
         try:
             # Get first geometry and create buffer
-            road_content = road_response.json()
-            first_geometry = shape(road_content['features'][0]['geometry'])
+            first_geometry = road_gdf.geometry.iloc[0]
             buffer = first_geometry.buffer(1000)  # 1km buffer
             minx, miny, maxx, maxy = buffer.bounds
             print(f"Buffer bounds: minX={minx:.2f}, minY={miny:.2f}, maxX={maxx:.2f}, maxY={maxy:.2f}")
 
-            # Create correct polygon syntax for CQL filter
-            my_filter = f"{minx}, {miny}, {maxx}, {maxy}, EPSG:2154"
-
             # Search for bridges within buffer
-            bridge_params = {
-                "SERVICE": "WFS",
-                "REQUEST": "GetFeature",
-                "VERSION": "2.0.0",
-                "TYPENAMES": type_of_data,
-                "OUTPUTFORMAT": "application/json",
-                "bbox": my_filter,
-                "SRSNAME": "EPSG:2154"
-            }
-            
-            bridge_response = requests.get(url, params=bridge_params)
-            print(f"Bridge response status: {bridge_response.status_code}")
-            print(f"Bridge response URL: {bridge_response.url}")
-            
-            if bridge_response.status_code == 200:
-                try:
-                    content = bridge_response.json()
-                    
-                    # Create GeoDataFrame from the GeoJSON
-                    gdf = gpd.GeoDataFrame.from_features(content['features'])
-                    
-                    # Explicitly set the CRS to Lambert-93
-                    gdf.set_crs(epsg=2154, inplace=True)
-
-                    # Select the features with nature 'Pont'
-                    gdf = gdf[gdf['nature'] == 'Pont']
-
-                    return gdf
-            
-                except requests.exceptions.JSONDecodeError as e:
-                    print(f"Failed to parse JSON: {e}")
-                except Exception as e:
-                    print(f"An error occurred: {e}")
+            if layer_store is not None:
+                def fetch_tile(tile_filter, tile_bbox):
+                    return fetch_features(type_of_data, filter=spatial_filter(tile_filter, tile_bbox), page_size=1000)
+                gdf = layer_store.get_features(type_of_data, None, (minx, miny, maxx, maxy), fetch_tile)
             else:
-                print(f"Bridge request failed with status code: {bridge_response.status_code}")
-                    
-        except requests.exceptions.JSONDecodeError as e:
-            print(f"Failed to parse JSON: {e}")
+                gdf = fetch_features(type_of_data, bbox=(minx, miny, maxx, maxy))
+
+            if gdf is not None:
+                # Select the features with nature 'Pont'; an area without any feature in the layer store has no attribute column
+                if 'nature' not in gdf.columns:
+                    return gdf.iloc[0:0]
+                gdf = gdf[gdf['nature'] == 'Pont']
+
+                return gdf
+            else:
+                print(f"Bridge request failed for {type_of_data}")
+
         except Exception as e:
             print(f"An error occurred: {e}")
             print(f"Error type: {type(e)}")
     else:
-        print(f"Initial road request failed with status code: {road_response.status_code}")
+        print("Initial road request failed")
 
     return None
 
-def get_mnt(bbox_values, data_mnt):
-        url_raster = "https://data.geopf.fr/wms-r"
+def prefetch_route_layers(route_number, bbox=None):
+    """
+    Fetch concurrently all the vector layers the pipeline needs for a route.
+    bbox: area of interest (e.g. the DEM bounds); troncons and PR are then read with get_data, from the
+    layer store if it is set, or else filtered by the server.
+    Returns a dict layer name -> GeoDataFrame (None if the request failed), to be passed as
+    layers to ProfileAnalyzer, SegmentConstructor and OuvragesSelector.
+    """
+    start = time.perf_counter()
+    layers = asyncio.run(_prefetch_route_layers(route_number, bbox))
+    print(f"Prefetched {len(layers)} layers for {route_number} in {time.perf_counter() - start:.1f} s")
+    return layers
+
+async def _prefetch_route_layers(route_number, bbox=None):
+    """Run the WFS requests of a route concurrently; the bridge searches wait only for the road geometry"""
+    filter_road = f"numero='{route_number}'"
+    filter_troncons = f"cpx_numero='{route_number}'"
+    filter_PR = f"route='{route_number}'"
+
+    def fetch_layer(type_of_data, filter):
+        # With a bbox, get_data reads from layer_store when it is set and sends the bbox filter to the server otherwise
+        if bbox:
+            return asyncio.to_thread(get_data, filter, type_of_data, bbox)
+        return asyncio.to_thread(fetch_features, type_of_data, filter)
+
+    troncons = fetch_layer("BDTOPO_V3:troncon_de_route", filter_troncons)
+    points_de_repere = fetch_layer("BDTOPO_V3:point_de_repere", filter_PR)
+    road = asyncio.create_task(asyncio.to_thread(fetch_features, "BDTOPO_V3:route_numerotee_ou_nommee", filter_road))
+
+    async def ponts(type_of_data):
+        return await asyncio.to_thread(get_ponts, filter_road, type_of_data, await road)
+
+    results = await asyncio.gather(
+        troncons,
+        road,
+        points_de_repere,
+        ponts("BDTOPO_V3:construction_surfacique"),
+        ponts("BDTOPO_V3:construction_lineaire")
+    )
+    names = ["troncon_de_route", "route_numerotee_ou_nommee", "point_de_repere", "construction_surfacique", "construction_lineaire"]
+    return dict(zip(names, results))
+
+def get_mnt(bbox_values, data_mnt, resolution=None, tile_size=2048, max_workers=4, output_path="output_mnt.tif", cog=False, requests_per_second=None):
+        """
+        Fetch the DEM covering bbox_values from the WMS service and save it as a GeoTIFF.
+        Without resolution, the whole bbox is requested as a single image of at most 2048 px.
+        With a resolution (in m/px), the bbox is split into tiles of tile_size px that are
+        downloaded concurrently and assembled into a tiled GeoTIFF (see get_mnt_tiled).
+        With cog=True, the download is then rewritten as a Cloud-Optimized GeoTIFF, whose path is returned.
+        requests_per_second: if given, limit of the requests sent to the WMS from now on (shared by all the threads)
+        """
+        if requests_per_second is not None:
+            client.set_rate_limit(WMS_URL, requests_per_second)
+
+        if resolution is not None:
+            output_path = get_mnt_tiled(bbox_values, data_mnt, resolution, tile_size, max_workers, output_path)
+            return convert_to_cog(output_path) if cog and output_path else output_path
 
         # Calculate width and height maintaining aspect ratio
         minx, miny, maxx, maxy = [float(x) for x in bbox_values]
@@ -150,31 +354,226 @@ def get_mnt(bbox_values, data_mnt):
             target_height = 2048
             target_width = int((bbox_width / bbox_height) * target_height)
 
-        params_mnt = {
-            "SERVICE": "WMS",
-            "REQUEST": "GetMap",
-            "VERSION": "1.3.0",
-            "LAYERS": data_mnt,
-            "FORMAT": "image/geotiff",
-            "CRS": "EPSG:2154",  # Lambert-93
-            "BBOX": f"{minx},{miny},{maxx},{maxy}",
-            "WIDTH": target_width,
-            "HEIGHT": target_height,
-            "STYLES": ""  # Required empty parameter
-        }
+        params_mnt = _getmap_params(data_mnt, (minx, miny, maxx, maxy), target_width, target_height)
 
-        response_mnt = requests.get(url_raster, params=params_mnt)
+        try:
+            response_mnt = client.get(WMS_URL, params=params_mnt)
+        except requests.RequestException as e:
+            print(f"MNT request failed: {e}")
+            return None
         print(f"MNT response status: {response_mnt.status_code}")
         
         if response_mnt.status_code == 200:
             # Save the GeoTIFF file
-            with open("output_mnt.tif", "wb") as f:
+            with open(output_path, "wb") as f:
                 f.write(response_mnt.content)
-            print("Saved DEM to output_dem.tif")
+            print(f"Saved DEM to {output_path}")
+            return convert_to_cog(output_path) if cog else output_path
         else:
             print(f"MNT request failed with status code: {response_mnt.status_code}")
             print(f"Response content: {response_mnt.text}")
 
+        return None
+
+def _getmap_params(data_mnt, bbox_values, width, height):
+    """Build the parameters of a WMS GetMap request returning a GeoTIFF"""
+    minx, miny, maxx, maxy = bbox_values
+    return {
+        "SERVICE": "WMS",
+        "REQUEST": "GetMap",
+        "VERSION": "1.3.0",
+        "LAYERS": data_mnt,
+        "FORMAT": "image/geotiff",
+        "CRS": "EPSG:2154",  # Lambert-93
+        "BBOX": f"{minx},{miny},{maxx},{maxy}",
+        "WIDTH": width,
+        "HEIGHT": height,
+        "STYLES": ""  # Required empty parameter
+    }
+
+def _tile_grid(bbox_values, resolution, tile_size):
+    """
+    Split a bbox into tiles of at most tile_size x tile_size pixels at the given ground resolution.
+    The grid is anchored on the upper left corner of the bbox. Returns the tiles (pixel window and
+    ground bbox of each tile) and the width and height in pixels of the whole grid.
+    """
+    minx, miny, maxx, maxy = [float(x) for x in bbox_values]
+    width = math.ceil((maxx - minx) / resolution)
+    height = math.ceil((maxy - miny) / resolution)
+
+    tiles = []
+    for row_off in range(0, height, tile_size):
+        for col_off in range(0, width, tile_size):
+            tile_width = min(tile_size, width - col_off)
+            tile_height = min(tile_size, height - row_off)
+            tile_minx = minx + col_off * resolution
+            tile_maxy = maxy - row_off * resolution
+            tiles.append({
+                "window": Window(col_off, row_off, tile_width, tile_height),
+                "bbox": (tile_minx, tile_maxy - tile_height * resolution, tile_minx + tile_width * resolution, tile_maxy)
+            })
+
+    return tiles, width, height
+
+def _download_tile(data_mnt, tile, nodata, max_retries=2):
+    """
+    Download one DEM tile and return it as a float32 array, source nodata replaced by nodata.
+    Transient HTTP errors are already retried by the shared client; this loop also retries
+    connection failures and error documents returned in place of an image.
+    """
+    window = tile["window"]
+    params = _getmap_params(data_mnt, tile["bbox"], int(window.width), int(window.height))
+
+    for attempt in range(max_retries + 1):
+        try:
+            response = client.get(WMS_URL, params=params)
+            response.raise_for_status()
+            # The WMS answers errors with an XML document and a 200 status
+            if "tiff" not in response.headers.get("Content-Type", ""):
+                raise ValueError(f"unexpected content type {response.headers.get('Content-Type')}: {response.text[:200]}")
+
+            with MemoryFile(response.content) as memfile:
+                with memfile.open() as src:
+                    data = src.read(1).astype("float32")
+                    if src.nodata is not None:
+                        data[data == src.nodata] = nodata
+            return data
+
+        except Exception as e:
+            if attempt == max_retries:
+                raise
+            delay = 2 ** attempt
+            print(f"Tile {tile['bbox']} failed ({e}), retry in {delay} s")
+            time.sleep(delay)
+
+def get_mnt_tiled(bbox_values, data_mnt, resolution=1.0, tile_size=2048, max_workers=4, output_path="output_mnt.tif", nodata=-99999.0):
+    """
+    Download the DEM at its native resolution as a grid of tiles fetched concurrently.
+    Tiles are written as they arrive into a tiled, compressed GeoTIFF that ProfileAnalyzer can
+    open directly. Tiles that still fail after the retries are left as nodata.
+    """
+    tiles, width, height = _tile_grid(bbox_values, resolution, tile_size)
+    minx, _, _, maxy = [float(x) for x in bbox_values]
+    print(f"MNT: {width} x {height} px at {resolution} m, {len(tiles)} tiles of {tile_size} px")
+
+    transform = from_origin(minx, maxy, resolution, resolution)
+    return _write_mnt_tiles(tiles, width, height, transform, data_mnt, max_workers, output_path, nodata)
+
+def get_mnt_corridor(lines, data_mnt, buffer_distance=100, resolution=1.0, tile_size=512, max_workers=4, output_path="output_mnt.tif", nodata=-99999.0, requests_per_second=None):
+    """
+    Download the DEM only along a corridor around the route.
+    lines: troncons (GeoDataFrame or GeoSeries, Lambert-93) as returned by get_data
+    buffer_distance: half-width of the corridor in meters (the profiles are 120 m wide)
+    Only the tiles intersecting the buffered lines are fetched; the rest of the bounding box is
+    stored as nodata in a sparse GeoTIFF, so it takes (almost) no disk space.
+    requests_per_second: if given, limit of the requests sent to the WMS from now on
+    """
+    if requests_per_second is not None:
+        client.set_rate_limit(WMS_URL, requests_per_second)
+    corridor = unary_union(lines.geometry.buffer(buffer_distance))
+    tiles, width, height = _tile_grid(corridor.bounds, resolution, tile_size)
+    tile_boxes = [box(*tile["bbox"]) for tile in tiles]
+    selected_tiles = [tile for tile, intersects in zip(tiles, shapely.intersects(tile_boxes, corridor)) if intersects]
+    print(f"MNT corridor of {buffer_distance} m: {len(selected_tiles)}/{len(tiles)} tiles of {tile_size} px to download")
+
+    minx, _, _, maxy = corridor.bounds
+    transform = from_origin(minx, maxy, resolution, resolution)
+    return _write_mnt_tiles(selected_tiles, width, height, transform, data_mnt, max_workers, output_path, nodata, sparse=True)
+
+def _write_mnt_tiles(tiles, width, height, transform, data_mnt, max_workers, output_path, nodata, sparse=False):
+    """Download the tiles concurrently and write each one into its window of a tiled GeoTIFF"""
+    profile = {
+        "driver": "GTiff",
+        "width": width,
+        "height": height,
+        "count": 1,
+        "dtype": "float32",
+        "crs": "EPSG:2154",
+        "transform": transform,
+        "nodata": nodata,
+        "tiled": True,
+        "blockxsize": 256,
+        "blockysize": 256,
+        "compress": "deflate",
+        "BIGTIFF": "IF_SAFER"
+    }
+    if sparse:
+        # Blocks that are never written are not stored and read back as nodata
+        profile["SPARSE_OK"] = "TRUE"
+
+    failed_tiles = 0
+    with rasterio.open(output_path, "w", **profile) as dst:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(_download_tile, data_mnt, tile, nodata): tile for tile in tiles}
+            # Writes are done from this thread only, as rasterio datasets are not thread-safe
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Downloading MNT tiles"):
+                tile = futures[future]
+                try:
+                    dst.write(future.result(), 1, window=tile["window"])
+                except Exception as e:
+                    failed_tiles += 1
+                    print(f"Tile {tile['bbox']} could not be downloaded: {e}")
+
+    if failed_tiles:
+        print(f"{failed_tiles} tiles failed and are left as nodata")
+    print(f"Saved DEM to {output_path}")
+    return output_path
+
+def convert_to_cog(src_path, dst_path=None, nodata=-99999.0, block_size=512):
+    """
+    Rewrite a downloaded DEM as a Cloud-Optimized GeoTIFF: float32 with a proper nodata value,
+    internally tiled (block_size px), deflate-compressed with the floating point predictor, with overviews.
+    The default output is <name>_cog.tif next to the source. The rewrite is skipped when the output
+    already exists and was made from the current version of the source.
+    """
+    if dst_path is None:
+        dst_path = f"{os.path.splitext(src_path)[0]}_cog.tif"
+
+    src_mtime = str(os.path.getmtime(src_path))
+    if os.path.exists(dst_path):
+        with rasterio.open(dst_path) as existing:
+            if existing.tags().get("COG_SOURCE_MTIME") == src_mtime:
+                print(f"COG up to date: {dst_path}")
+                return dst_path
+
+    # Float32 copy with the target nodata, written block by block, then turned into a COG by GDAL
+    tmp_path = f"{dst_path}.{os.getpid()}.tmp.tif"
+    with rasterio.open(src_path) as src:
+        profile = {
+            "driver": "GTiff",
+            "width": src.width,
+            "height": src.height,
+            "count": 1,
+            "dtype": "float32",
+            "crs": src.crs,
+            "transform": src.transform,
+            "nodata": nodata,
+            "tiled": True,
+            "blockxsize": block_size,
+            "blockysize": block_size,
+            "BIGTIFF": "IF_SAFER"
+        }
+        with rasterio.open(tmp_path, "w", **profile) as tmp:
+            for _, window in tmp.block_windows(1):
+                data = src.read(1, window=window).astype("float32")
+                if src.nodata is not None:
+                    data[data == src.nodata] = nodata
+                data[np.isnan(data)] = nodata
+                tmp.write(data, 1, window=window)
+            tmp.update_tags(COG_SOURCE_MTIME=src_mtime)
+
+    try:
+        rasterio.shutil.copy(
+            tmp_path, dst_path, driver="COG",
+            BLOCKSIZE=block_size, COMPRESS="DEFLATE", PREDICTOR="FLOATING_POINT",
+            OVERVIEWS="IGNORE_EXISTING", OVERVIEW_RESAMPLING="AVERAGE", BIGTIFF="IF_SAFER"
+        )
+    finally:
+        os.remove(tmp_path)
+
+    print(f"Saved COG to {dst_path}")
+    return dst_path
+
 def save_bbox_as_geopackage(bbox, output_path):
     """
     Save the bounding box as a polygon in a GeoPackage.
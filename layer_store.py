@@ -0,0 +1,151 @@
+import hashlib
+import json
+import math
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+import geopandas as gpd
+import pandas as pd
+
+# Layers stored without attribute filter, so that all the routes of an area share the same tiles
+SHARED_LAYERS = (
+    "BDTOPO_V3:point_de_repere",
+    "BDTOPO_V3:construction_surfacique",
+    "BDTOPO_V3:construction_lineaire"
+)
+
+class LayerStore:
+    """
+    Local GeoParquet store of BD TOPO layers, partitioned by square spatial tiles.
+    Each tile holds the features intersecting it, written with a covering bbox column so that reads
+    can push the bbox predicate down to the Parquet row groups. A _coverage.json file per partition
+    records which tiles have been fetched (with their bbox), so only the missing tiles are downloaded.
+    Tiles fetched more than max_age_days ago are downloaded again (never if max_age_days is None).
+    """
+    def __init__(self, root="bdtopo_store", tile_size=5000, shared_layers=SHARED_LAYERS, max_workers=4, max_age_days=30):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ImportError("LayerStore requires pyarrow to read and write GeoParquet files")
+
+        self.root = root
+        self.tile_size = tile_size
+        self.shared_layers = shared_layers
+        self.max_workers = max_workers
+        self.max_age_seconds = max_age_days * 24 * 3600 if max_age_days is not None else None
+
+    def tiles_for_bbox(self, bbox):
+        """Return the (column, row) indexes of the tiles covering a bbox"""
+        minx, miny, maxx, maxy = [float(x) for x in bbox]
+        return [
+            (tx, ty)
+            for tx in range(math.floor(minx / self.tile_size), math.floor(maxx / self.tile_size) + 1)
+            for ty in range(math.floor(miny / self.tile_size), math.floor(maxy / self.tile_size) + 1)
+        ]
+
+    def tile_bbox(self, tile):
+        """Return the bbox of a tile"""
+        tx, ty = tile
+        return (tx * self.tile_size, ty * self.tile_size, (tx + 1) * self.tile_size, (ty + 1) * self.tile_size)
+
+    def _partition(self, type_of_data, filter):
+        """
+        Return the directory of a layer/filter partition, the filter to send to the server and the
+        (attribute, value) filter to apply when reading.
+        Shared layers are stored unfiltered when their filter is a simple attribute='value' equality.
+        """
+        layer_name = type_of_data.split(":")[-1]
+        match = re.fullmatch(r"\s*(\w+)\s*=\s*'([^']*)'\s*", filter) if filter else None
+
+        if type_of_data in self.shared_layers and (filter is None or match):
+            read_filter = match.groups() if match else None
+            return os.path.join(self.root, layer_name, "all"), None, read_filter
+
+        filter_hash = hashlib.sha256((filter or "").encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.root, layer_name, filter_hash), filter, None
+
+    def _load_coverage(self, partition_dir):
+        path = os.path.join(partition_dir, "_coverage.json")
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    def _save_coverage(self, partition_dir, coverage):
+        path = os.path.join(partition_dir, "_coverage.json")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(coverage, f, indent=1)
+        os.replace(tmp_path, path)
+
+    def _is_covered(self, coverage, tile):
+        """Whether a tile has been fetched, less than max_age_days ago"""
+        entry = coverage.get(f"{tile[0]}_{tile[1]}")
+        if entry is None:
+            return False
+        return self.max_age_seconds is None or time.time() - entry.get("fetched", 0) <= self.max_age_seconds
+
+    def _tile_path(self, partition_dir, tile):
+        return os.path.join(partition_dir, f"tile_{tile[0]}_{tile[1]}.parquet")
+
+    def get_features(self, type_of_data, filter, bbox, fetch):
+        """
+        Return the features of a layer intersecting bbox, answering from the store when the bbox is
+        fully covered and fetching only the missing tiles otherwise.
+        fetch(filter, bbox) must return the features matching filter within bbox (or None on failure).
+        """
+        partition_dir, fetch_filter, read_filter = self._partition(type_of_data, filter)
+        coverage = self._load_coverage(partition_dir)
+        tiles = self.tiles_for_bbox(bbox)
+        missing_tiles = [tile for tile in tiles if not self._is_covered(coverage, tile)]
+
+        if missing_tiles:
+            print(f"Layer store: {len(missing_tiles)}/{len(tiles)} tiles to fetch for {type_of_data}")
+            os.makedirs(partition_dir, exist_ok=True)
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                results = executor.map(lambda tile: fetch(fetch_filter, self.tile_bbox(tile)), missing_tiles)
+                for tile, gdf in zip(missing_tiles, results):
+                    if gdf is None:
+                        print(f"Layer store: tile {tile} of {type_of_data} could not be fetched")
+                        self._save_coverage(partition_dir, coverage)
+                        return None
+                    if not gdf.empty:
+                        gdf.to_parquet(self._tile_path(partition_dir, tile), write_covering_bbox=True)
+                    elif os.path.exists(self._tile_path(partition_dir, tile)):
+                        # Expired tile whose features have all disappeared
+                        os.remove(self._tile_path(partition_dir, tile))
+                    coverage[f"{tile[0]}_{tile[1]}"] = {
+                        "bbox": self.tile_bbox(tile),
+                        "n_features": len(gdf),
+                        "fetched": time.time()
+                    }
+            self._save_coverage(partition_dir, coverage)
+        else:
+            print(f"Layer store: {type_of_data} read from {len(tiles)} local tiles")
+
+        return self._read(partition_dir, tiles, bbox, read_filter)
+
+    def _read(self, partition_dir, tiles, bbox, read_filter):
+        """Read the tiles with bbox and attribute predicate pushdown, and drop features stored in several tiles"""
+        bbox = tuple(float(x) for x in bbox)
+        filters = [(read_filter[0], "==", read_filter[1])] if read_filter else None
+
+        frames = []
+        for tile in tiles:
+            path = self._tile_path(partition_dir, tile)
+            if os.path.exists(path):
+                gdf = gpd.read_parquet(path, bbox=bbox, filters=filters)
+                if not gdf.empty:
+                    frames.append(gdf.drop(columns="bbox", errors="ignore"))
+
+        if not frames:
+            return gpd.GeoDataFrame(geometry=[], crs="EPSG:2154")
+
+        gdf = gpd.GeoDataFrame(pd.concat(frames, ignore_index=True), crs="EPSG:2154")
+        # A feature crossing a tile edge is stored in each tile it intersects
+        if "cleabs" in gdf.columns:
+            gdf = gdf.drop_duplicates(subset="cleabs", ignore_index=True)
+        else:
+            gdf = gdf[~gdf.geometry.to_wkb().duplicated()].reset_index(drop=True)
+        return gdf
@@ -1,8 +1,21 @@
 from profile_analyzer_viz import ProfileAnalyzer
 from segments_constructor import SegmentConstructor
 from select_ouvrages import OuvragesSelector
+from get_data_functions import client, prefetch_route_layers
+from dem_reader import open_dem
+import argparse
+
+def main(dem_mode=None, dem_cache_dir=None, workers=None, segment_workers=None):
+    """
+    dem_mode: "memory" (MNT lu en mémoire), "blocks" (lecture par blocs avec un cache LRU) ou "memmap" (copie .npy
+    non compressée du MNT, écrite dans dem_cache_dir, partagée par les processus de l'analyse).
+    Par défaut "memmap" avec workers, "memory" sinon
+    workers: nombre de processus de l'analyse des profils (séquentielle si None)
+    segment_workers: nombre de processus de la construction des segments, répartie par parties de route (séquentielle si None)
+    """
+    if dem_mode is None:
+        dem_mode = "memmap" if workers else "memory"
 
-def main():
     route = input("Saisir le code de la route (ex. A33): ")
 
     output_folder = f"output_{route}"
@@ -10,31 +23,56 @@ def main():
     classification_threshold_remblai = 2
     classification_threshold_deblai = -2
 
+    mnt_path = "data/mnt.tif"  # Un GeoTIFF, ou un dossier de dalles RGE ALTI
+    with open_dem(mnt_path, mode="blocks") as dem:
+        bbox = dem.bounds
+
+    # Télécharger en parallèle toutes les couches vecteur nécessaires à la route, sur l'emprise du MNT
+    layers = prefetch_route_layers(route, bbox)
+
     analyzer = ProfileAnalyzer(
-        mnt_path = "data/mnt.tif",
+        mnt_path = mnt_path,
         output_folder = output_folder,
         classification_threshold_remblai = classification_threshold_remblai,
         classification_threshold_deblai = classification_threshold_deblai,
-        route_number = route
+        route_number = route,
+        layers = layers,
+        dem_mode = dem_mode,
+        dem_cache_dir = dem_cache_dir
     )
-    segments_gdf, calculation_points_gdf = analyzer.analyze_profile()
+    # Analyse des profils, répartie par tronçons de 2 km sur workers processus si demandé
+    segments_gdf, calculation_points_gdf = analyzer.analyze_profile(vectorized=True, workers=workers, chunk_length=2000)
     analyzer.save_output(segments_gdf, calculation_points_gdf)
 
     constructor = SegmentConstructor(
         classified_profiles = segments_gdf,
         output_folder = output_folder,
-        route_number = route
+        route_number = route,
+        layers = layers
     )
-    ouvrages_gdf = constructor.construct_segments()
+    # Segments construits par projection des profils sur la route (référencement linéaire)
+    ouvrages_gdf = constructor.construct_segments(linear_referencing=True, workers=segment_workers)
     constructor.save_output(ouvrages_gdf)
 
     selector = OuvragesSelector(
         ouvrages_gdf = ouvrages_gdf,
         output_folder = output_folder,
-        route_number = route
+        route_number = route,
+        layers = layers
     )
     selected_ouvrages = selector.select_ouvrages()
     selector.save_output(selected_ouvrages)
 
+    # Résumé des requêtes envoyées à la Géoplateforme
+    client.print_stats()
+
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Détection des ouvrages en remblai et en déblai le long d'une route")
+    parser.add_argument("--workers", type=int, help="Nombre de processus de l'analyse des profils (séquentielle par défaut)")
+    parser.add_argument("--segment-workers", type=int, help="Nombre de processus de la construction des segments (séquentielle par défaut)")
+    parser.add_argument("--dem-mode", choices=["memory", "blocks", "memmap"],
+                        help="Lecture du MNT : en mémoire, par blocs ou en copie .npy partagée par les processus (par défaut memmap avec --workers, memory sinon)")
+    parser.add_argument("--memmap", action="store_true", help="Équivalent de --dem-mode memmap")
+    parser.add_argument("--dem-cache-dir", help="Dossier de la copie .npy du MNT en mode memmap (par défaut, à côté du MNT)")
+    args = parser.parse_args()
+    main(dem_mode="memmap" if args.memmap else args.dem_mode, dem_cache_dir=args.dem_cache_dir, workers=args.workers, segment_workers=args.segment_workers)
@@ -6,9 +6,12 @@ from shapely.ops import linemerge, unary_union
 from centerline.geometry import Centerline
 import pygeoops
 from get_data_functions import get_data, get_mnt
+from dem_reader import BlockCachedDEM
+from stations import StationLine
+from pr_reference import PRReference
 from tqdm import tqdm
 import os
-import math
+import numpy as np
 import matplotlib.pyplot as plt
 
 def connect_segments(route, buffer_distance=5):
@@ -97,147 +100,42 @@ def connect_segments(route, buffer_distance=5):
         
     return centerline
 
-def calculate_angle(point1, point2):
-    """Calculate the angle between two points"""
-    dx = point2[0] - point1[0]
-    dy = point2[1] - point1[1]
-    angle_rad = math.atan2(dy, dx)
-    angle_deg = math.degrees(angle_rad)
-    return angle_deg
-
-def calculate_perpendicular_line(current_distance, line):
-        """Calculate the perpendicular line at a given distance along the route"""
-        current_point = line.interpolate(current_distance)
-
-        # Calculate angle
-        if current_distance <= 15:
-            next_point = line.interpolate(current_distance + 10)
-            angle = calculate_angle((current_point.x, current_point.y), (next_point.x, next_point.y))
-        else:
-            prev_point = line.interpolate(current_distance - 10)
-            angle = calculate_angle((prev_point.x, prev_point.y), (current_point.x, current_point.y))
-        
-        # Calculate perpendicular line endpoints
-        dx = 50 * math.cos(math.radians(angle + 90))
-        dy = 50 * math.sin(math.radians(angle + 90))
-        start_point = (current_point.x - dx, current_point.y - dy)
-        end_point = (current_point.x + dx, current_point.y + dy)
-
-        # Calculate perpendicular line of length 160 m
-        perpendicular_line = LineString([start_point, end_point])
+# DEM opened once and read by blocks, shared by get_raster_value and visualize_profile
+_dem = None
 
-        return perpendicular_line
+def get_dem(mnt_path="data/mnt.tif"):
+    """Return the block-cached reader of the DEM, opening it on first use"""
+    global _dem
+    if _dem is None:
+        _dem = BlockCachedDEM(mnt_path)
+        print(f"DEM bounds: {_dem.bounds}")
+        print(f"DEM shape: {_dem.shape}")
+    return _dem
 
 def get_raster_value(point):
         """Get the elevation value from the raster at a given point"""
-        with rasterio.open("data/mnt.tif") as src:
-            print(f"DEM bounds: {src.bounds}")
-            print(f"DEM shape: {src.shape}")
-            print(f"DEM resolution: {src.res}")
-            dem = src.read(1)
-            transform = src.transform
-        try:
-            row, col = rasterio.transform.rowcol(transform, point.x, point.y)
-            if 0 <= row < dem.shape[0] and 0 <= col < dem.shape[1]:
-                return dem[row, col]
-            else:
-                print(f"Point outside raster bounds: row={row}, col={col}")
-        except IndexError as e:
-            print(f"IndexError: {e}")
-        except Exception as e:
-            print(f"Other error: {e}")
+        values, valid = get_dem().sample([(point.x, point.y)])
+        if valid[0]:
+            return values[0]
         return None
 
-def find_closest_PR(point, PR_route):
+def visualize_profile(perpendicular_line, segment, current_distance, output_folder, route_number, PR_route, PR_reference=None):
     """
-    Find the closest PR point with the smallest PR number
+    Visualize the profile at a specific distance.
+    PR_reference: PR table of the segment (see pr_reference.PRReference), built from PR_route if not given.
+    The profile is located from the smallest-numbered of the 4 PR nearest to it; PR whose numero is not an
+    integer are left out before these 4 are picked (they used to be picked first and discarded afterwards).
     """
-    # Utiliser l'index spatial pour trouver rapidement les candidats les plus proches
-    spatial_index_PR = PR_route.sindex
-    try:
-        # Créer un buffer autour du point pour la recherche
-        buffer_dist = 1500  # métres
-        buffered_bounds = (
-            point.x - buffer_dist,
-            point.y - buffer_dist,
-            point.x + buffer_dist,
-            point.y + buffer_dist
-        )
-        
-        # Trouver les points dans ce buffer
-        possible_matches_index = list(spatial_index_PR.intersection(buffered_bounds))
-        print(f"Nombre de points de repère trouvés: {len(possible_matches_index)}")
-        
-        if not possible_matches_index:
-            return None
-            
-        possible_matches = PR_route.iloc[possible_matches_index]
-
-        # Filter possible_matches to keep only rows where 'numero' can be converted to an integer
-        #possible_matches = possible_matches[possible_matches['numero'].apply(PR_route.is_convertible_to_int)]
-        print(f"Points de repère restants après filtrage: {len(possible_matches)}")
-
-        if possible_matches.empty:
-            return None
-
-        # Chercher les 2 PR les plus proches du point
-        closest_two = possible_matches.distance(point).nsmallest(4).index
-        possible_matches = possible_matches.loc[closest_two]
-
-        print(f"Nombre dans possible matches: {len(possible_matches)}")
-
-        # Parmi ces candidats, trouver le minimal
-        candidates = []
-        for index, row in possible_matches.iterrows():
-            try:
-                # Extract PR number
-                pr_number = int(row['numero'])
-                candidates.append((row, pr_number))
-            except (IndexError, ValueError) as e:
-                print(f"Error extracting PR number")
-                continue
-    
-        if not candidates:
-            return None
-        else:
-            # Sort candidates by PR number
-            candidates.sort(key=lambda x: x[1])
-            minimal_PR = candidates[0][0]
-            
-            return minimal_PR
-        
-    except Exception as e:
-        print(f"Erreur lors de la recherche du PR de référence: {e}")
-        return None
-
-def visualize_profile(perpendicular_line, segment, current_distance, output_folder, route_number, PR_route):
-    """Visualize the profile at a specific distance."""
     # Create profiles subfolder
     profiles_folder = os.path.join(output_folder, "profiles")
     os.makedirs(profiles_folder, exist_ok=True)
 
-    intermediate_points = []
-    distances = []
-    elevations = []
-
-    # Open raster once
-    with rasterio.open("data/mnt.tif") as src:
-        dem = src.read(1)
-        transform = src.transform
-        
-        # Generate intermediate points along the perpendicular line
-        for i in range(0, int(perpendicular_line.length) + 1):
-            point = perpendicular_line.interpolate(i)
-            try:
-                row, col = rasterio.transform.rowcol(transform, point.x, point.y)
-                if 0 <= row < dem.shape[0] and 0 <= col < dem.shape[1]:
-                    elevation = dem[row, col]
-                    if elevation is not None:
-                        intermediate_points.append(point)
-                        distances.append(i)
-                        elevations.append(elevation)
-            except IndexError:
-                continue
+    # Generate intermediate points along the perpendicular line and sample them in one call
+    all_distances = np.arange(0, int(perpendicular_line.length) + 1)
+    points = shapely.line_interpolate_point(perpendicular_line, all_distances.astype("float64"))
+    all_elevations, valid = get_dem().sample(shapely.get_coordinates(points))
+    distances = all_distances[valid].tolist()
+    elevations = all_elevations[valid].tolist()
 
     if not elevations:  # Skip if no valid elevations found
         print(f"No valid elevations found for profile at distance {current_distance}m")
@@ -251,19 +149,20 @@ def visualize_profile(perpendicular_line, segment, current_distance, output_fold
     y_min = middle_value - 20
     y_max = middle_value + 20
 
+    if PR_reference is None:
+        PR_reference = PRReference(segment, PR_route, n_nearest=4)
+
     point_on_route = shapely.intersection(perpendicular_line, segment)
     print(f"Point on route: {point_on_route}")
-    PR_before = find_closest_PR(point_on_route, PR_route)
+    # PR of reference and distance to it along the segment, from the PR table
+    PR_before, abscisse = PR_reference.reference(segment.project(point_on_route))
+    if PR_before is None:
+        print(f"No PR found for profile at distance {current_distance}m")
+        plt.close()
+        return
     print(f"PR before: {PR_before['numero']}")
-    PR_before_on_route = shapely.ops.nearest_points(segment, PR_before.geometry)[0]
-    print(f"PR before on route: {PR_before_on_route}")
 
-    start_substring = segment.project(PR_before_on_route)
-    end_substring = segment.project(point_on_route)
-    substring_to_point = shapely.ops.substring(segment, start_substring, end_substring)
-    print(f"Substring to point: {substring_to_point}")
-
-    profile_location_m = round(shapely.length(substring_to_point)/10) * 10
+    profile_location_m = round(abs(abscisse)/10) * 10
 
     # Add labels and legend
     plt.title(f"Profile à la distance PR{PR_before['numero']} + {profile_location_m} m")
@@ -410,10 +309,8 @@ def main():
     else:
         espacement = 25
     distances = list(range(0, int(chosen_segment.length), espacement))
-    perpendicular_lines = []
-    for distance in distances:
-        perp_line = calculate_perpendicular_line(distance, chosen_segment)
-        perpendicular_lines.append(perp_line)
+    # Toutes les lignes perpendiculaires en une fois, de 2 x 50 m
+    perpendicular_lines = list(StationLine(chosen_segment).transect_lines(distances, half_width=50))
 
     # Create GeoDataFrame for perpendicular lines
     perp_lines_df = gpd.GeoDataFrame(
@@ -426,6 +323,9 @@ def main():
     perp_lines_df.to_file(output_perpendicular_lines, driver="GPKG")
     print(f"\nLignes perpendiculaires sauvegardées dans: {output_perpendicular_lines}")
 
+    # Table des PR le long du segment choisi, construite une fois pour tous les profils
+    PR_reference = PRReference(chosen_segment, PR_route, n_nearest=4)
+
     print("\nCréation des profils d'élévation...")
     with tqdm(total=len(perpendicular_lines), desc="Generating profiles") as pbar:
         for i, perp_line in enumerate(perpendicular_lines):
@@ -436,7 +336,8 @@ def main():
                 current_distance, 
                 output_folder, 
                 route_number, 
-                PR_route
+                PR_route,
+                PR_reference
             )
             pbar.update(1)
 
@@ -0,0 +1,104 @@
+import numpy as np
+import shapely
+
+def _to_int(value):
+    """PR number as an integer, or None when the numero is not an integer"""
+    try:
+        return int(str(value))
+    except ValueError:
+        return None
+
+class PRReference:
+    """
+    Points de repère (PR) of a route line as a linear reference table, built once: the PR with an integer number,
+    with their side (cote), label and measure along the line, sorted by measure.
+    The reference PR and the abscisse of any measure along the line are then found by binary search, singly or in batch,
+    with the rule used for the ouvrage names: among the PR within search_distance m (bounding box) of the point on
+    the line, the one with the smallest number among the n_nearest closest.
+    The candidates of a measure are the PR whose measure is within search_distance * sqrt(2) of it (the half diagonal
+    of the search box), found by binary search in the table, however many PR are close to the route. A PR of a part
+    of the route farther along the line is not a candidate, even where the route loops back within the search box.
+    """
+    def __init__(self, line, PR_points, search_distance=1500, n_nearest=2, max_candidates=2 ** 22):
+        self.line = line
+        self.search_distance = search_distance
+        self.n_nearest = n_nearest
+        self.max_candidates = max_candidates  # Size of the (measures x candidates) matrices of a batch of locate
+
+        numbers = PR_points['numero'].apply(_to_int)
+        table = PR_points[numbers.notna()].copy()
+        table['pr_number'] = numbers[numbers.notna()].astype("int64")
+        geometries = table.geometry.values
+        table['measure'] = shapely.line_locate_point(line, geometries)
+        self.table = table.sort_values('measure', kind="stable").reset_index(drop=True)
+
+        self._measures = self.table['measure'].to_numpy(dtype=float)
+        self._numbers = self.table['pr_number'].to_numpy()
+        coordinates = shapely.get_coordinates(self.table.geometry.values)
+        self._x = coordinates[:, 0]
+        self._y = coordinates[:, 1]
+
+    def locate(self, measures):
+        """Position in self.table of the reference PR of each measure along the line, -1 where none is found"""
+        measures = np.atleast_1d(np.asarray(measures, dtype=float))
+        n = len(self.table)
+        if n == 0 or len(measures) == 0:
+            return np.full(len(measures), -1)
+
+        # Candidates: the PR whose measure is within the half diagonal of the search box, as [first, last) in the table
+        radius = self.search_distance * np.sqrt(2)
+        first = np.searchsorted(self._measures, measures - radius, side="left")
+        last = np.searchsorted(self._measures, measures + radius, side="right")
+
+        # Batches of measures whose padded candidate matrices hold at most max_candidates values
+        positions = np.full(len(measures), -1)
+        n_candidates = last - first
+        batch_size = max(1, self.max_candidates // max(int(n_candidates.max()), 1))
+        for batch_start in range(0, len(measures), batch_size):
+            batch = slice(batch_start, batch_start + batch_size)
+            width = int(n_candidates[batch].max())
+            if width > 0:
+                positions[batch] = self._locate_batch(measures[batch], first[batch], last[batch], width)
+        return positions
+
+    def _locate_batch(self, measures, first, last, width):
+        """locate for a batch of measures, with the candidates [first, last) padded to width columns"""
+        points = shapely.get_coordinates(shapely.line_interpolate_point(self.line, measures))
+        candidates = first[:, None] + np.arange(width)[None, :]
+        inside = candidates < last[:, None]
+        candidates = np.minimum(candidates, len(self.table) - 1)
+
+        dx = self._x[candidates] - points[:, 0, None]
+        dy = self._y[candidates] - points[:, 1, None]
+        in_box = inside & (np.abs(dx) <= self.search_distance) & (np.abs(dy) <= self.search_distance)
+        distances = np.where(in_box, np.hypot(dx, dy), np.inf)
+
+        # The n_nearest closest candidates, then the smallest PR number among them
+        nearest = np.argsort(distances, axis=1, kind="stable")[:, :self.n_nearest]
+        nearest_distances = np.take_along_axis(distances, nearest, axis=1)
+        nearest_candidates = np.take_along_axis(candidates, nearest, axis=1)
+        numbers = np.where(np.isfinite(nearest_distances), self._numbers[nearest_candidates], np.iinfo(np.int64).max)
+        best = np.argmin(numbers, axis=1)
+
+        positions = nearest_candidates[np.arange(len(measures)), best]
+        positions[~np.isfinite(nearest_distances[:, 0])] = -1
+        return positions
+
+    def abscisses(self, measures):
+        """
+        Positions in self.table of the reference PR of the measures (-1 where none is found) and abscisses of the measures
+        from their PR, in m along the line (NaN where no PR is found)
+        """
+        measures = np.atleast_1d(np.asarray(measures, dtype=float))
+        positions = self.locate(measures)
+        if len(self.table) == 0:
+            return positions, np.full(len(measures), np.nan)
+        abscisses = np.where(positions >= 0, measures - self._measures[np.maximum(positions, 0)], np.nan)
+        return positions, abscisses
+
+    def reference(self, measure):
+        """Reference PR (row of self.table, or None) and abscisse of a single measure along the line"""
+        positions, abscisses = self.abscisses([measure])
+        if positions[0] < 0:
+            return None, None
+        return self.table.iloc[positions[0]], abscisses[0]
@@ -1,27 +1,61 @@
 import geopandas as gpd
-import rasterio
+import shapely
 from shapely.geometry import MultiLineString, LineString, Point, box
 import math
 import os
-from sklearn.linear_model import LinearRegression
 import numpy as np
+import pandas as pd
 import logging
+import itertools
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import matplotlib.pyplot as plt
 from get_data_functions import get_data, get_mnt
+from dem_reader import ArrayDEM, open_dem
+from rasterio.coords import BoundingBox
+from stations import StationLine, perpendicular_lines, perpendicular_transects
+from transect_engine import LinearFit, TRANSECT_POSITIONS, TRANSECT_HALF_WIDTH, fit_lines, sample_transects, band_mask, band_mean, natural_terrain_fit, deblai_attributes, remblai_attributes
+
+# Nullable height and ouvrage columns of the classified points, which can be entirely None in a batch
+# (the route attributes num_voies and largeur_route keep their source dtypes)
+STREAMED_FLOAT_COLUMNS = (
+    'height_difference_nat_terrain', 'average_height_route', 'interpolated_height_nat_terrain_route',
+    'max_height_difference',
+    'slope_ouvrage_total', 'slope_ouvrage_section', 'slope_ouvrage_middle'
+)
+
+# Terrain columns interpolated between the analyzed stations of analyze_line_adaptive
+INTERPOLATED_COLUMNS = (
+    'height_difference_nat_terrain', 'average_height_route', 'interpolated_height_nat_terrain_route'
+)
+
+# Ouvrage attributes, only known at the analyzed stations of analyze_line_adaptive
+OUVRAGE_COLUMNS = (
+    'max_height_difference', 'slope_ouvrage_total', 'slope_ouvrage_section', 'slope_ouvrage_middle'
+)
 
 class ProfileAnalyzer:
     """
     Class to analyze profiles along a route and classify them as remblai, deblai or rasant
     """
-    def __init__(self, mnt_path, output_folder, classification_threshold_remblai, classification_threshold_deblai, route_number):
+    def __init__(self, mnt_path, output_folder, classification_threshold_remblai, classification_threshold_deblai, route_number, layers=None, dem_mode="memory", dem_cache_mb=256, dem_cache_dir=None):
+        # mnt_path: a GeoTIFF, or a directory or list of DEM tiles read as a mosaic
         self.mnt_path = mnt_path
-        self.dem, self.transform, self.boundingbox = self._read_dem()
+        # dem_mode: "memory" reads the whole DEM, "blocks" reads only the blocks touched by the profiles (LRU cache of dem_cache_mb),
+        # "memmap" maps a .npy copy of the DEM shared by the worker processes, written to dem_cache_dir (next to the DEM by default)
+        self.dem_mode = dem_mode
+        self.dem_cache_mb = dem_cache_mb
+        self.dem_cache_dir = dem_cache_dir
+        self.dem_source, self.transform, self.boundingbox = self._read_dem()
         self.output_folder = output_folder
         self.classification_threshold_remblai = classification_threshold_remblai
         self.classification_threshold_deblai = classification_threshold_deblai
         self.route_number = route_number
         self.filter_route = f"cpx_numero='{route_number}'"
-        self.lines_selected = get_data(self.filter_route, "BDTOPO_V3:troncon_de_route", self.boundingbox)
+        # layers: vector layers already fetched by prefetch_route_layers, if any
+        prefetched = layers.get("troncon_de_route") if layers else None
+        self.lines_selected = get_data(self.filter_route, "BDTOPO_V3:troncon_de_route", self.boundingbox, prefetched=prefetched)
         self.lines_selected = self.lines_selected[self.lines_selected['nature'] == 'Type autoroutier']
         
         # Save lines_selected to check its contents
@@ -44,44 +78,43 @@ class ProfileAnalyzer:
         self.r2_scores = []  # Add this line to store R² scores
 
     def _read_dem(self):
-        """Read the DEM file and return the elevation data and transform"""
-        with rasterio.open(self.mnt_path) as src:
-            print(f"DEM bounds: {src.bounds}")
-            print(f"DEM shape: {src.shape}")
-            print(f"DEM resolution: {src.res}")
-            return src.read(1), src.transform, src.bounds
+        """Open the DEM (file, directory or list of tiles) and return the source used to sample it, its transform and bounds"""
+        source = open_dem(self.mnt_path, mode=self.dem_mode, cache_bytes=self.dem_cache_mb * 1024 * 1024, cache_dir=self.dem_cache_dir)
+        bounds = BoundingBox(*source.bounds)
+        print(f"DEM bounds: {bounds}")
+        print(f"DEM shape: {source.shape}")
+        print(f"DEM resolution: {(source.transform.a, -source.transform.e)}")
+        return source, source.transform, bounds
 
     def get_raster_value(self, point):
         """Get the elevation value from the raster at a given point"""
-        try:
-            row, col = rasterio.transform.rowcol(self.transform, point.x, point.y)
-            if 0 <= row < self.dem.shape[0] and 0 <= col < self.dem.shape[1]:
-                return self.dem[row, col]
-            else:
-                print(f"Point outside raster bounds: row={row}, col={col}")
-        except IndexError as e:
-            print(f"IndexError: {e}")
-        except Exception as e:
-            print(f"Other error: {e}")
+        values, valid = self.get_raster_values([(point.x, point.y)])
+        if valid[0]:
+            return values[0]
         return None
-    
-    def calculate_angle(self, point1, point2):
-        """Calculate the angle between two points"""
-        dx = point2[0] - point1[0]
-        dy = point2[1] - point1[1]
-        angle_rad = math.atan2(dy, dx)
-        angle_deg = math.degrees(angle_rad)
-        return angle_deg
 
+    def get_raster_values(self, coords, method="nearest"):
+        """
+        Get the elevation values from the raster at an (N, 2) array of coordinates in one operation.
+        Returns the elevations (NaN where invalid) and the mask of valid values (inside the raster and not nodata).
+        """
+        return self.dem_source.sample(coords, method=method)
+
+    def get_line_values(self, line, distances, method="nearest"):
+        """Sample the raster at the given distances along a line. Returns the coordinates, elevations and valid mask"""
+        coords = shapely.get_coordinates(shapely.line_interpolate_point(line, np.asarray(distances, dtype="float64")))
+        values, valid = self.get_raster_values(coords, method=method)
+        return coords, values, valid
+    
     def calculate_distance(self, point1, point2):
         """Calculate the distance between two points"""
         return math.sqrt((point2.x - point1.x)**2 + (point2.y - point1.y)**2)
     
     def calculate_slope(self, point1, point2):
-        Z1 = self.get_raster_value(point1)
-        Z2 = self.get_raster_value(point2)
-        if Z1 is None or Z2 is None:
+        values, valid = self.get_raster_values([(point1.x, point1.y), (point2.x, point2.y)])
+        if not valid.all():
             return None
+        Z1, Z2 = values
         deltaZ = Z2 - Z1
 
         dist = self.calculate_distance(point1, point2)
@@ -92,51 +125,17 @@ class ProfileAnalyzer:
         return slope
     
     def calculate_perpendicular_line(self, current_distance, line):
-        """Calculate the perpendicular line at a given distance along the route"""
-        current_point = line.interpolate(current_distance)
-
-        # Calculate angle
-        if current_distance <= 15:
-            next_point = line.interpolate(current_distance + 10)
-            angle = self.calculate_angle((current_point.x, current_point.y), (next_point.x, next_point.y))
-        else:
-            prev_point = line.interpolate(current_distance - 10)
-            angle = self.calculate_angle((prev_point.x, prev_point.y), (current_point.x, current_point.y))
-        
-        # Calculate perpendicular line endpoints
-        dx = 60 * math.cos(math.radians(angle + 90))
-        dy = 60 * math.sin(math.radians(angle + 90))
-        start_point = (current_point.x - dx, current_point.y - dy)
-        end_point = (current_point.x + dx, current_point.y + dy)
-
-        # Calculate perpendicular line of length 160 m
-        perpendicular_line = LineString([start_point, end_point])
-
-        return perpendicular_line
+        """Calculate the perpendicular line of 2 x 60 m at a given distance along the route (see stations.StationLine)"""
+        return perpendicular_lines(line, [current_distance], TRANSECT_HALF_WIDTH)[0]
 
     def calculate_average_height(self, perpendicular_line, startpoint, endpoint):
         """Calculate the average height between 2 points on the perpendicular line"""
-        # Create intermediate points
-        intermediate_points = []
-        i = startpoint
-        
         print(f"\nCalculating average height:")
         print(f"Perpendicular line length: {perpendicular_line.length}")
-        
-        while i <= endpoint:
-            intermediate_point = perpendicular_line.interpolate(i)
-            intermediate_points.append(intermediate_point)
-            i += 1
-        
-        sum_elevations = 0
-        valid_points = 0
 
-        for point in intermediate_points:
-            elevation = self.get_raster_value(point)
-            print(f"Point coordinates: ({point.x}, {point.y}), Elevation: {elevation}")
-            if elevation is not None:
-                sum_elevations += elevation
-                valid_points += 1
+        # Intermediate points every meter from startpoint to endpoint
+        _, elevations, valid = self.get_line_values(perpendicular_line, np.arange(startpoint, endpoint + 1e-9, 1))
+        valid_points = int(valid.sum())
 
         print(f"Valid points found: {valid_points}")
         
@@ -144,31 +143,13 @@ class ProfileAnalyzer:
             print("No valid points found!")
             return None
 
-        average_height = sum_elevations / valid_points
+        average_height = elevations[valid].sum() / valid_points
         return average_height
     
     def calculate_minmax_height(self, perpendicular_line, startpoint, endpoint):
         """Calculate the minimum and maximum height along the perpendicular line"""
-        intermediate_points = []
-        i = startpoint
-        while i <= endpoint:
-            intermediate_point = perpendicular_line.interpolate(i)
-            intermediate_points.append(intermediate_point)
-            i += 1
-
-        max_height = 0
-        min_height = 1000
-        valid_points = 0
-
-        for point in intermediate_points:
-            elevation = self.get_raster_value(point)
-            print(f"Point coordinates: ({point.x}, {point.y}), Elevation: {elevation}")
-            if elevation is not None:
-                if elevation > max_height:
-                    max_height = elevation
-                if elevation < min_height:
-                    min_height = elevation
-                valid_points += 1
+        _, elevations, valid = self.get_line_values(perpendicular_line, np.arange(startpoint, endpoint + 1e-9, 1))
+        valid_points = int(valid.sum())
 
         print(f"Valid points found: {valid_points}")
         
@@ -176,6 +157,9 @@ class ProfileAnalyzer:
             print("No valid points found!")
             return None, None
 
+        max_height = max(0, elevations[valid].max())
+        min_height = min(1000, elevations[valid].min())
+
         return max_height, min_height
 
     def calculate_height_difference(self, height1, height2):
@@ -187,40 +171,21 @@ class ProfileAnalyzer:
     
     def calculate_natural_slope(self, perpendicular_line, startpoint1, endpoint1, startpoint2, endpoint2):
         """Determines a linear regression fonction describing the altitude and slope of the natural terrain"""
-        intermediate_points = []
-        distance = []
-        altitude = []
-
-        i = startpoint1
-        j = startpoint2
-        startpoint_line = perpendicular_line.interpolate(0)
-
-        while i <= endpoint1:
-            intermediate_point = perpendicular_line.interpolate(i)
-            intermediate_points.append(intermediate_point)
-            i += 1
-        while j <= endpoint2:
-            intermediate_point = perpendicular_line.interpolate(j)
-            intermediate_points.append(intermediate_point)
-            j += 1
-
-        for point in intermediate_points:
-            dist = self.calculate_distance(startpoint_line, point)
-            alt = self.get_raster_value(point)
-            if alt is not None:
-                distance.append(dist)
-                altitude.append(alt)
-
-        if not distance or not altitude:
+        # Intermediate points every meter on both sides of the route
+        distances = np.concatenate([np.arange(startpoint1, endpoint1 + 1e-9, 1), np.arange(startpoint2, endpoint2 + 1e-9, 1)])
+        coords, altitude, valid = self.get_line_values(perpendicular_line, distances)
+        startpoint_line = shapely.get_coordinates(perpendicular_line)[0]
+        distance = np.hypot(coords[:, 0] - startpoint_line[0], coords[:, 1] - startpoint_line[1])
+
+        if not valid.any():
             print("No valid elevation data found for natural slope calculation")
             return None
 
-        dist_arr = np.array(distance).reshape(-1, 1)
-        alt_arr = np.array(altitude).reshape(-1, 1)
-
         try:
-            reg = LinearRegression().fit(dist_arr, alt_arr)
-            r2_score = reg.score(dist_arr, alt_arr)
+            # Closed-form least squares on the valid points, as a batch of one profile
+            coefs, intercepts, r2_scores = fit_lines(distance[None, :], altitude[None, :], valid[None, :])
+            reg = LinearFit(coefs[0], intercepts[0], r2_scores[0])
+            r2_score = r2_scores[0]
             self.logger.info(f"R² score: {r2_score}")
             
             # Store R² score with distance information
@@ -247,237 +212,38 @@ class ProfileAnalyzer:
         return altitude[0][0]
 
     def calculate_attributes_deblai(self, perpendicular_line, reg, coef):
-        """Calculate attributes for deblai profile"""
-        # Find the minimum to determine starting point
-        alt_min = 1000
-        dist_min = 60
-        calculation_points = []  # Store points used for calculation
-
-        for i in range(60, 45, -1):
-            point = perpendicular_line.interpolate(i)
-            altitude = self.get_raster_value(point)
-            if altitude is None:
-                continue
-            if altitude < alt_min:
-                alt_min = altitude
-                dist_min = i
-
-        j = dist_min
-        natural_slope = coef
-
-        self.logger.info(f"\nNatural slope: {natural_slope}")
-
-        # Calculate initial interpolated altitude
-        #interpolated_natural_altitude = self.calculate_interpolated_altitude(j, reg)
-
-        # Initialize variables to track intersection
-        prev_difference = None
-
-        # Iterate over points to find the end of the ouvrage
-        while j > 30:
-            # Calculate current slope
-            point1 = perpendicular_line.interpolate(j+0.5)
-            point2 = perpendicular_line.interpolate(j-0.5)
-            current_slope = self.calculate_slope(point1, point2)
-
-            # Get real altitude current point
-            point = perpendicular_line.interpolate(j)
-            current_altitude = self.get_raster_value(point)
-
-            # Calculate interpolated altitude at current distance
-            interpolated_altitude = self.calculate_interpolated_altitude(j, reg)
-
-            # Calculate difference between actual and interpolated altitude
-            if current_altitude is None or interpolated_altitude is None:
-                j -= 0.5
-                self.logger.warning(f"No elevation data at distance {j}, skipping")
-                continue
-            current_difference = current_altitude - interpolated_altitude
-
-            # Store points and their data for visualization
-            calculation_points.append({
-                'point': point,
-                'elevation': current_altitude,
-                'slope': current_slope,
-                'distance': j
-            })
-
-            self.logger.info(f"\nAt distance {j}:")
-            self.logger.info(f"Point 1 elevation: {current_altitude}")
-            self.logger.info(f"Point 2 elevation: {self.get_raster_value(point2)}")
-            self.logger.info(f"Calculated slope: {current_slope}")
-            self.logger.info(f"Natural slope range: {natural_slope - 0.05} to {natural_slope + 0.05}")
-
-            # Check for intersection (sign change)
-            if prev_difference is not None:
-                if (prev_difference * current_difference <= 0):  # Sign change occurred
-                    self.logger.info(f"Intersection found at distance {j}")
-                    break
-
-            prev_difference = current_difference
-            j -= 0.5
-        
-        # Calculate properties of ouvrage
-        alt_max = current_altitude
-        dist_max = j
-        distance = abs(dist_min - j)
-        height_difference = None
-        slope_ouvrage_total = None
-        if alt_max is not None and alt_min is not None:
-            height_difference = alt_max - alt_min
-            slope_ouvrage_total = height_difference / distance
-
-        # Slopes at the top and bottom of an ouvrage are not relaible, so we calculate the slope based on the middle section, if possible
-        slope_ouvrage_section = None
-        safety_margin = 1.5
-        if distance > (safety_margin * 2):
-            point_min = perpendicular_line.interpolate(dist_min+2)
-            point_max = perpendicular_line.interpolate(dist_max-2)
-            slope_ouvrage_section = self.calculate_slope(point_min, point_max)
-
-        # Slopes of the middle section are more reliable
-        slope_ouvrage_middle = None
-        section_length = 3
-        if distance > section_length:
-            point_middle_min = perpendicular_line.interpolate(dist_min + (distance / 2) - (section_length / 2))
-            point_middle_max = perpendicular_line.interpolate(dist_min + (distance / 2) + (section_length / 2))
-            slope_ouvrage_middle = self.calculate_slope(point_middle_min, point_middle_max)
-
-        self.logger.info(f"\nFound significant slope change:")
-        self.logger.info(f"Final slope: {slope_ouvrage_total}")
-        self.logger.info(f"Height difference: {height_difference}")
-
-        return slope_ouvrage_total, slope_ouvrage_section, slope_ouvrage_middle, height_difference, calculation_points
+        """Calculate attributes for deblai profile (deblai_attributes on this transect)"""
+        return self.calculate_transect_attributes(deblai_attributes, perpendicular_line, reg, coef)
 
     def calculate_attributes_remblai(self, perpendicular_line, reg, coef):
-        """Calculate attributes for remblai profile"""
-        # Find the maximum to determine starting point
-        alt_max = 0
-        i = 60
-        slope = 0
-        calculation_points = []
-
-        self.logger.info("Starting calculate_attributes_remblai")
-        
-        # Find initial slope
-        while slope < 0.08 and i > 30:
-            point1 = perpendicular_line.interpolate(i+1)
-            point2 = perpendicular_line.interpolate(i-0.5)
-            slope = abs(self.calculate_slope(point1, point2))
-            i -= 0.5
-            
-        alt_max = self.get_raster_value(point1)
-        dist_max = i
-
-        self.logger.info(f"Found starting point: dist_max={dist_max}, alt_max={alt_max}")
-
-        j = dist_max
-        natural_slope = coef
-        max_iterations = 60
-        iteration_count = 0
-
-        self.logger.info(f"Natural slope: {natural_slope}")
-        prev_difference = None
-        current_altitude = self.get_raster_value(perpendicular_line.interpolate(i))
-
-        while j > 30 and iteration_count < max_iterations:
-            iteration_count += 1
-            
-            # Calculate current slope
-            point1 = perpendicular_line.interpolate(j+0.5)
-            point2 = perpendicular_line.interpolate(j-0.5)
-            current_slope = self.calculate_slope(point1, point2)
-
-            # Get real altitude current point
-            point = perpendicular_line.interpolate(j)
-            current_altitude = self.get_raster_value(point)
-            
-            if current_altitude is None:
-                self.logger.warning(f"No elevation data at distance {j}")
-                j -= 0.5
-                continue
-
-            # Calculate interpolated altitude
-            interpolated_altitude = self.calculate_interpolated_altitude(j, reg)
-            if interpolated_altitude is None:
-                self.logger.warning(f"Could not interpolate altitude at distance {j}")
-                j -= 0.5
-                continue
+        """Calculate attributes for remblai profile (remblai_attributes on this transect)"""
+        return self.calculate_transect_attributes(remblai_attributes, perpendicular_line, reg, coef)
+
+    def calculate_transect_attributes(self, calculate_attributes, perpendicular_line, reg, coef):
+        """
+        Run an attribute search of transect_engine on a single perpendicular line and return the total, section
+        and middle slopes and the height difference (None when missing), and the calculation points
+        """
+        if reg is None:
+            return None, None, None, None, []
 
-            # Calculate difference
-            if current_altitude is None or interpolated_altitude is None:
-                j -= 0.5
-                self.logger.warning(f"No elevation data at distance {j}, skipping")
-                continue
-            current_difference = current_altitude - interpolated_altitude
+        coords = shapely.get_coordinates(perpendicular_line)
+        slope_ouvrage_total, slope_ouvrage_section, slope_ouvrage_middle, height_difference, points = calculate_attributes(
+            self.dem_source, coords[:1], coords[-1:], np.array([coef], dtype="float64"), np.array([reg.intercept_[0]], dtype="float64")
+        )
+        attributes = [None if np.isnan(values[0]) else float(values[0]) for values in (slope_ouvrage_total, slope_ouvrage_section, slope_ouvrage_middle, height_difference)]
 
-            # Store points
+        calculation_points = []
+        for n in range(len(points["station"])):
             calculation_points.append({
-                'point': point,
-                'elevation': current_altitude,
-                'slope': current_slope,
-                'distance': j
+                'point': Point(points["x"][n], points["y"][n]),
+                'elevation': points["elevation"][n],
+                'slope': None if np.isnan(points["slope"][n]) else points["slope"][n],
+                'distance': points["distance"][n]
             })
 
-            # Fixed logging statement with proper None handling
-            current_diff_str = f"{current_difference:.2f}" if current_difference is not None else "None"
-            prev_diff_str = f"{prev_difference:.2f}" if prev_difference is not None else "None"
-            self.logger.info(f"Distance {j}: current_diff={current_diff_str}, prev_diff={prev_diff_str}")
-
-            # Check for intersection
-            if prev_difference is not None and current_difference is not None:
-                if (prev_difference * current_difference <= 0):
-                    self.logger.info(f"Intersection found at distance {j}")
-                    break
-
-            prev_difference = current_difference
-            j -= 0.5
-
-        # Check if we hit the iteration limit
-        if iteration_count >= max_iterations:
-            self.logger.warning("Max iterations reached without finding intersection")
-            return None, None, None, None, calculation_points
-
-        # Calculate final attributes
-        alt_min = current_altitude
-        dist_min = j + 0.5
-        distance = abs(dist_max - dist_min)
-
-        if distance == 0:
-            self.logger.warning("Zero distance found, cannot calculate slope")
-            return None, None, None, None, calculation_points
-
-        height_difference = None
-        if alt_max is not None and alt_min is not None:
-            height_difference = alt_max - alt_min
-
-        if height_difference > 50:
-            height_difference = None
-        
-        slope_ouvrage_total = None
-        if height_difference is not None and distance is not None:
-            slope_ouvrage_total = height_difference / distance
-
-        # Slopes at the top and bottom of an ouvrage are not relaible, so we calculate the slope based on the middle section, if possible
-        slope_ouvrage_section = None
-        safety_margin = 1.5
-        if distance > (safety_margin * 2):
-            point_min = perpendicular_line.interpolate(dist_min+2)
-            point_max = perpendicular_line.interpolate(dist_max-2)
-            slope_ouvrage_section = self.calculate_slope(point_min, point_max)
-
-        # Slopes of the middle section are more reliable
-        slope_ouvrage_middle = None
-        section_length = 3
-        if distance > section_length:
-            point_middle_min = perpendicular_line.interpolate(dist_min + (distance / 2) - (section_length / 2))
-            point_middle_max = perpendicular_line.interpolate(dist_min + (distance / 2) + (section_length / 2))
-            slope_ouvrage_middle = self.calculate_slope(point_middle_min, point_middle_max)
-
-        if height_difference is not None and slope_ouvrage_total is not None:
-            self.logger.info(f"Final calculations: height_diff={height_difference:.2f}, slope={slope_ouvrage_total:.2f}")
-
-        return slope_ouvrage_total, slope_ouvrage_section, slope_ouvrage_middle, height_difference, calculation_points
+        self.logger.info(f"Ouvrage attributes: slope={attributes[0]}, height difference={attributes[3]}")
+        return (*attributes, calculation_points)
 
     def classify_point(self, height_difference):
         """Classify point as zone de remblai, zone de deblai ou en profil rasant"""
@@ -533,18 +299,11 @@ class ProfileAnalyzer:
 
     def visualize_profile(self, i, perpendicular_line, reg, coef, current_distance, output_folder):
         """Visualize the profile and regression line at a specific distance."""
-        intermediate_points = []
-        distances = []
-        elevations = []
-
         # Generate intermediate points along the perpendicular line
-        for i in range(0, int(perpendicular_line.length) + 1):
-            point = perpendicular_line.interpolate(i)
-            elevation = self.get_raster_value(point)
-            if elevation is not None:
-                intermediate_points.append(point)
-                distances.append(i)
-                elevations.append(elevation)
+        all_distances = np.arange(0, int(perpendicular_line.length) + 1)
+        _, all_elevations, valid = self.get_line_values(perpendicular_line, all_distances)
+        distances = all_distances[valid].tolist()
+        elevations = all_elevations[valid].tolist()
 
         # Plot the profile
         plt.figure(figsize=(10, 6))
@@ -577,24 +336,349 @@ class ProfileAnalyzer:
 
         self.logger.info(f"Profile visualization saved: {output_file}")
 
-    def analyze_profile(self):
-        """Analyze the profile and classify it"""
+    def classify_stations(self, i, line, distances):
+        """
+        Classify the stations at the given distances along a line at once: the perpendicular transects are
+        sampled in a single DEM read, and the route height, natural terrain fit and classification are computed
+        on the (stations x positions) elevation matrix. Returns a dict of arrays indexed by station.
+        line: LineString, or StationLine to reuse its cumulative distances across calls
+        """
+        ref_route_start, ref_route_end, ref_terrain_start, ref_terrain_end, ref_minmax_start, ref_minmax_end, ref_slope_start, ref_slope_end, ref_terrain_start1, ref_terrain_end1, ref_terrain_start2, ref_terrain_end2 = self.determine_routewidth(i)
+
+        distances = np.asarray(distances, dtype="float64")
+        centres, starts, ends = perpendicular_transects(line, distances, TRANSECT_HALF_WIDTH)
+        coords, elevations, valid = sample_transects(self.dem_source, starts, ends, TRANSECT_POSITIONS)
+
+        average_height_route = band_mean(elevations, valid, band_mask(TRANSECT_POSITIONS, ref_route_start, ref_route_end))
+        terrain_mask = band_mask(TRANSECT_POSITIONS, ref_terrain_start1, ref_terrain_end1) | band_mask(TRANSECT_POSITIONS, ref_terrain_start2, ref_terrain_end2)
+        coefs, intercepts, r2 = natural_terrain_fit(coords, elevations, valid, terrain_mask)
+        interpolated_height = 60 * coefs + intercepts
+        height_difference = average_height_route - interpolated_height
+        profile_types = [self.classify_point(None if np.isnan(difference) else float(difference)) for difference in height_difference]
+
+        return {
+            "distance": distances,
+            "centre": centres,
+            "start": starts,
+            "end": ends,
+            "average_height_route": average_height_route,
+            "coef": coefs,
+            "intercept": intercepts,
+            "r2": r2,
+            "interpolated_height": interpolated_height,
+            "height_difference": height_difference,
+            "classification": np.array(profile_types, dtype=object)
+        }
+
+    def describe_stations(self, i, stations):
+        """
+        Record the R² scores of stations classified by classify_stations, search the ouvrage attributes of all
+        their deblai and remblai stations at once (deblai_attributes and remblai_attributes), and return their
+        points and calculation points.
+        """
+        line_attributes = self.lines_selected.iloc[i]
+        starts = stations["start"]
+        ends = stations["end"]
+        coefs = stations["coef"]
+        intercepts = stations["intercept"]
+        profile_types = stations["classification"]
+
+        # R² scores, with the distance of each transect start to the first selected line as in calculate_natural_slope
+        start_distances = shapely.distance(shapely.points(starts), self.lines_selected.iloc[0].geometry)
+        fitted = ~np.isnan(coefs)
+        for k in np.flatnonzero(fitted):
+            self.r2_scores.append({
+                'distance': start_distances[k],
+                'r2_score': stations["r2"][k],
+                'coefficients': coefs[k],
+                'intercept': intercepts[k]
+            })
+
+        # Ouvrage attributes of all the deblai and remblai stations
+        attributes = {}
+        station_calculation_points = []
+        for profile_type, calculate_attributes in (("deblai", deblai_attributes), ("remblai", remblai_attributes)):
+            selected = np.flatnonzero(profile_types == profile_type)
+            if len(selected) == 0:
+                continue
+            slopes_total, slopes_section, slopes_middle, height_differences, station_points = calculate_attributes(self.dem_source, starts[selected], ends[selected], coefs[selected], intercepts[selected])
+            for n, k in enumerate(selected):
+                attributes[k] = [None if np.isnan(value) else float(value) for value in (slopes_total[n], slopes_section[n], slopes_middle[n], height_differences[n])]
+            station_points["station"] = selected[station_points["station"]]
+            station_calculation_points.append(station_points)
+
+        # Calculation points in the order of the stations, as in the station by station loop
+        calculation_points = []
+        if station_calculation_points:
+            merged = {key: np.concatenate([station_points[key] for station_points in station_calculation_points]) for key in station_calculation_points[0]}
+            order = np.argsort(merged["station"], kind="stable")
+            geometries = shapely.points(merged["x"], merged["y"])
+            for n in order:
+                calculation_points.append({
+                    'point': geometries[n],
+                    'elevation': merged["elevation"][n],
+                    'slope': None if np.isnan(merged["slope"][n]) else merged["slope"][n],
+                    'distance': merged["distance"][n]
+                })
+
+        points = []
+        for k in range(len(stations["distance"])):
+            difference = stations["height_difference"][k]
+            average_height_route = stations["average_height_route"][k]
+            interpolated_height = stations["interpolated_height"][k]
+            slope_ouvrage_total, slope_ouvrage_section, slope_ouvrage_middle, max_height_difference = attributes.get(k, (None, None, None, None))
+
+            points.append({
+                'geometry': Point(stations["centre"][k]),
+                'classification': profile_types[k],
+                'height_difference_nat_terrain': None if np.isnan(difference) else float(difference),
+                'average_height_route': None if np.isnan(average_height_route) else float(average_height_route),
+                'interpolated_height_nat_terrain_route': None if np.isnan(interpolated_height) else float(interpolated_height),
+                'num_voies': line_attributes['nombre_de_voies'],
+                'largeur_route': line_attributes['largeur_de_chaussee'],
+                'num_route': line_attributes['cpx_numero'],
+                'max_height_difference': max_height_difference,
+                'slope_ouvrage_total': slope_ouvrage_total,
+                'slope_ouvrage_section': slope_ouvrage_section,
+                'slope_ouvrage_middle': slope_ouvrage_middle,
+                'interpolated': False
+            })
+
+        self.logger.info(f"{len(points)} stations analyzed, {int((~fitted).sum())} without natural terrain data")
+        return points, calculation_points
+
+    def analyze_line_vectorized(self, i, line, start=0, end=None):
+        """
+        Analyze all the 1 m stations of a line (or only those in [start, end) m) at once with classify_stations
+        and describe_stations. Returns the same points and calculation points as the station by station loop
+        of analyze_profile.
+        """
+        n_stations = math.floor(line.length) + 1
+        distances = np.arange(start, n_stations if end is None else min(end, n_stations), dtype="float64")
+        return self.describe_stations(i, self.classify_stations(i, StationLine(line), distances))
+
+    def analyze_line_adaptive(self, i, line, start=0, end=None, coarse_step=25, height_tolerance=0.5):
+        """
+        Analyze the 1 m stations of a line (or of [start, end) m) with adaptive spacing: a first pass every
+        coarse_step m, then every station of the intervals with a remblai or deblai (or unknown) end station, and
+        recursive bisection down to 1 m of the rasant intervals whose end stations differ in classification or in
+        height_difference_nat_terrain by more than height_tolerance m.
+        Every station of a remblai or deblai run, and the stations next to it, are thus analyzed with their ouvrage
+        attributes. Only the stations inside rasant runs are skipped: their points take the rasant classification
+        of the two analyzed stations around them and a linear interpolation of their terrain heights, so the output
+        still has a point every meter. These points are flagged as interpolated and, as the analyzed rasant
+        stations, have no ouvrage attributes.
+        Calculation points and R² scores are those of the analyzed stations.
+        """
+        station_line = StationLine(line)
+        n_stations = math.floor(line.length) + 1
+        last = (n_stations if end is None else min(end, n_stations)) - 1
+        stations = self.classify_stations(i, station_line, np.unique(np.append(np.arange(start, last + 1, coarse_step), last)))
+
+        while True:
+            distances = stations["distance"]
+            classifications = stations["classification"]
+            with np.errstate(invalid="ignore"):
+                changed = (classifications[1:] != classifications[:-1]) | ~(np.abs(np.diff(stations["height_difference"])) <= height_tolerance)
+            gaps = np.diff(distances) > 1
+            # Ouvrage attributes are only measured by analyzing the station: no interpolation next to a remblai or deblai station
+            not_rasant = classifications != "rasant"
+            fill = gaps & (not_rasant[:-1] | not_rasant[1:])
+            split = gaps & changed & ~fill
+            if not (fill.any() or split.any()):
+                break
+            midpoints = np.floor((distances[:-1][split] + distances[1:][split]) / 2)
+            filled = [np.arange(distances[k] + 1, distances[k + 1]) for k in np.flatnonzero(fill)]
+            new_distances = np.concatenate([midpoints, *filled])
+            refined = self.classify_stations(i, station_line, new_distances)
+            order = np.argsort(np.concatenate([distances, new_distances]), kind="stable")
+            stations = {key: np.concatenate([stations[key], refined[key]])[order] for key in stations}
+
+        analyzed_points, calculation_points = self.describe_stations(i, stations)
+
+        # Points of the stations between two analyzed stations, interpolated from them
+        distances = stations["distance"]
+        points = []
+        for k, point in enumerate(analyzed_points):
+            points.append(point)
+            if k + 1 == len(analyzed_points) or distances[k + 1] - distances[k] <= 1:
+                continue
+            next_point = analyzed_points[k + 1]
+            gap = np.arange(distances[k] + 1, distances[k + 1])
+            weights = (gap - distances[k]) / (distances[k + 1] - distances[k])
+            for weight, geometry in zip(weights, shapely.points(station_line.points(gap))):
+                interpolated = dict(point, geometry=geometry, interpolated=True)
+                for key in OUVRAGE_COLUMNS:
+                    interpolated[key] = None
+                for key in INTERPOLATED_COLUMNS:
+                    if point[key] is not None and next_point[key] is not None:
+                        interpolated[key] = point[key] + weight * (next_point[key] - point[key])
+                points.append(interpolated)
+
+        self.logger.info(f"Adaptive spacing: {len(analyzed_points)} of {len(points)} stations analyzed")
+        return points, calculation_points
+
+    def get_line(self, i):
+        """Return the line analyzed for a selected troncon (the first part of a MultiLineString), or None"""
+        geometry = self.lines_selected.iloc[i].geometry
+
+        # Handle both LineString and MultiLineString
+        if isinstance(geometry, MultiLineString):
+            return geometry.geoms[0]
+        elif isinstance(geometry, LineString):
+            return geometry
+        self.logger.warning(f"Unsupported geometry type: {type(geometry)}")
+        return None
+
+    def chunk_tasks(self, chunk_length=2000):
+        """Split the selected lines into (line index, start, end) chunks of chunk_length m of stations (whole lines if None)"""
+        tasks = []
+        for i in range(len(self.lines_selected)):
+            line = self.get_line(i)
+            if line is None:
+                continue
+            n_stations = math.floor(line.length) + 1
+            step = chunk_length or n_stations
+            tasks.extend((i, start, start + step) for start in range(0, n_stations, step))
+        return tasks
+
+    def analyze_chunk(self, i, start, end, coarse_step=None, height_tolerance=0.5):
+        """Analyze the stations [start, end) of a line, with adaptive spacing (analyze_line_adaptive) when coarse_step is set"""
+        line = self.get_line(i)
+        if coarse_step:
+            return self.analyze_line_adaptive(i, line, start, end, coarse_step, height_tolerance)
+        return self.analyze_line_vectorized(i, line, start, end)
+
+    def iter_profile_batches(self, chunk_length=2000, workers=None, coarse_step=None, height_tolerance=0.5):
+        """
+        Analyze the selected lines chunk by chunk with analyze_chunk and yield the
+        (points_gdf, calculation_points_gdf) of each chunk, in the order of the lines and chunks.
+        With workers, the chunks are analyzed in a process pool; at most 2 chunks per worker are in
+        flight, so memory stays bounded by the chunk size even when the consumer is slower than the workers.
+        The analyzer is sent once to each worker: a DEM read in memory is first switched to dem_mode "memmap"
+        (see share_dem_with_workers) so that the workers share it instead of each receiving a copy of the array.
+        """
+        tasks = [(i, start, end, coarse_step, height_tolerance) for i, start, end in self.chunk_tasks(chunk_length)]
+        print(f"Analyzing {len(self.lines_selected)} lines in {len(tasks)} chunks" + (f" with {workers} workers" if workers else ""))
+
+        if not workers:
+            for task in tasks:
+                points, calculation_points = self.analyze_chunk(*task)
+                yield self.build_output(points, calculation_points)
+            return
+
+        self.share_dem_with_workers()
+
+        # Workers send GeoDataFrames back, much faster to pickle than lists of dicts of shapely objects
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(self,)) as executor:
+            pending = deque()
+            tasks = iter(tasks)
+            for task in itertools.islice(tasks, 2 * workers):
+                pending.append(executor.submit(_analyze_chunk, task))
+            while pending:
+                points_gdf, calculation_points_gdf, r2_scores = pending.popleft().result()
+                for task in itertools.islice(tasks, 1):
+                    pending.append(executor.submit(_analyze_chunk, task))
+                self.r2_scores.extend(r2_scores)
+                yield points_gdf, calculation_points_gdf
+
+    def share_dem_with_workers(self):
+        """
+        Reopen a DEM read in memory (dem_mode "memory") as a memory-mapped .npy copy (dem_mode "memmap"),
+        which is pickled by path and mapped once by the worker processes instead of being copied to each of them
+        """
+        if not isinstance(self.dem_source, ArrayDEM):
+            return
+        message = "dem_mode 'memory' with worker processes: switching to 'memmap' so that the workers share the DEM"
+        print(message)
+        self.logger.warning(message)
+        self.dem_source.close()
+        self.dem_mode = "memmap"
+        self.dem_source, self.transform, self.boundingbox = self._read_dem()
+
+    def analyze_parallel(self, workers, chunk_length=2000, coarse_step=None, height_tolerance=0.5):
+        """
+        Analyze the selected lines in a process pool (in this process when workers is None, see
+        iter_profile_batches) and gather the chunks; the output is the same as a sequential run.
+        """
+        points_gdfs = []
+        calculation_points_gdfs = []
+        for points_gdf, calculation_points_gdf in self.iter_profile_batches(chunk_length, workers, coarse_step, height_tolerance):
+            points_gdfs.append(points_gdf)
+            if calculation_points_gdf is not None:
+                calculation_points_gdfs.append(calculation_points_gdf)
+
+        # Columns without any value in a chunk are of object type: infer_objects restores the types of a sequential run
+        points_gdf = gpd.GeoDataFrame(pd.concat(points_gdfs, ignore_index=True).infer_objects(), crs=self.lines_selected.crs)
+        calculation_points_gdf = None
+        if calculation_points_gdfs:
+            calculation_points_gdf = gpd.GeoDataFrame(pd.concat(calculation_points_gdfs, ignore_index=True).infer_objects(), crs=self.lines_selected.crs)
+        return points_gdf, calculation_points_gdf
+
+    def analyze_profile_streaming(self, chunk_length=2000, workers=None, coarse_step=None, height_tolerance=0.5):
+        """
+        Analyze the profile chunk by chunk and append each batch to the 'points' and 'calculation_points'
+        layers of classified_profiles.gpkg as soon as it is computed, so that memory is bounded by the
+        chunk size instead of the length of the route. The R² scores are appended to the CSV of save_output
+        in the same way. Returns the path of the GeoPackage.
+        """
+        self.logger.info("Starting streaming profile analysis")
+        os.makedirs(self.output_folder, exist_ok=True)
+        output_file = os.path.join(self.output_folder, "classified_profiles.gpkg")
+        r2_output_file = os.path.join(self.output_folder, f"r2_scores_{self.route_number}.csv")
+        for path in (output_file, r2_output_file):
+            if os.path.exists(path):
+                os.remove(path)
+
+        n_points = 0
+        n_calculation_points = 0
+        for points_gdf, calculation_points_gdf in self.iter_profile_batches(chunk_length, workers, coarse_step, height_tolerance):
+            # The layer schema is set by the first batch: numeric columns are written as floats even when a batch has no value
+            points_gdf = points_gdf.astype({column: "float64" for column in STREAMED_FLOAT_COLUMNS})
+            points_gdf.to_file(output_file, driver='GPKG', layer='points', mode="a")
+            n_points += len(points_gdf)
+            if calculation_points_gdf is not None:
+                calculation_points_gdf = calculation_points_gdf.astype({"elevation": "float64", "slope": "float64", "distance": "float64"})
+                calculation_points_gdf.to_file(output_file, driver='GPKG', layer='calculation_points', mode="a")
+                n_calculation_points += len(calculation_points_gdf)
+            if self.r2_scores:
+                pd.DataFrame(self.r2_scores).to_csv(r2_output_file, mode="a", header=not os.path.exists(r2_output_file), index=False)
+                self.r2_scores.clear()
+            self.logger.info(f"{n_points} points and {n_calculation_points} calculation points written")
+
+        print(f"R² scores saved to: {r2_output_file}")
+        print(f"Classified profiles saved as: {output_file} ({n_points} points, {n_calculation_points} calculation points)")
+        self.logger.info("\nAnalysis completed successfully")
+        return output_file
+
+    def analyze_profile(self, vectorized=False, workers=None, chunk_length=2000, coarse_step=None, height_tolerance=0.5):
+        """
+        Analyze the profile and classify it.
+        vectorized: process all the stations of a line at once with analyze_line_vectorized
+        workers: number of processes analyzing the lines in chunks of chunk_length m (see analyze_parallel)
+        coarse_step: adaptive station spacing (see analyze_line_adaptive), first pass every coarse_step m and
+        refinement where the classification or the height difference changes by more than height_tolerance m
+        """
         self.logger.info("Starting profile analysis")
         self.logger.info(f"Number of selected lines: {len(self.lines_selected)}")
         all_segments = []  # List to store all segments
         all_calculation_points = []  # Store all calculation points for visualization
 
+        if workers or coarse_step:
+            points_gdf, calculation_points_gdf = self.analyze_parallel(workers, chunk_length, coarse_step, height_tolerance)
+            self.logger.info("\nAnalysis completed successfully")
+            return points_gdf, calculation_points_gdf
+
         for i in range(len(self.lines_selected)):
             self.logger.info(f"\nProcessing line {i+1}/{len(self.lines_selected)}")
-            geometry = self.lines_selected.iloc[i].geometry
-        
-            # Handle both LineString and MultiLineString
-            if isinstance(geometry, MultiLineString):
-                line = geometry.geoms[0]
-            elif isinstance(geometry, LineString):  # Assume it's a LineString
-                line = geometry
-            else:
-                self.logger.warning(f"Unsupported geometry type: {type(geometry)}")
+            line = self.get_line(i)
+            if line is None:
+                continue
+
+            if vectorized:
+                points, calculation_points = self.analyze_line_vectorized(i, line)
+                all_segments.extend(points)
+                all_calculation_points.extend(calculation_points)
                 continue
 
             length = line.length
@@ -624,6 +708,7 @@ class ProfileAnalyzer:
                 max_height_difference = None
                 slope_ouvrage_total = None
                 slope_ouvrage_section = None
+                slope_ouvrage_middle = None
                 calculation_points = None
 
                 if profile_type == "deblai":
@@ -649,7 +734,8 @@ class ProfileAnalyzer:
                     'max_height_difference': max_height_difference,
                     'slope_ouvrage_total': slope_ouvrage_total,
                     'slope_ouvrage_section': slope_ouvrage_section,
-                    'slope_ouvrage_middle': slope_ouvrage_middle
+                    'slope_ouvrage_middle': slope_ouvrage_middle,
+                    'interpolated': False
                 })
 
                 # Visualize the profile every 100 meters
@@ -661,6 +747,17 @@ class ProfileAnalyzer:
 
             all_segments.extend(points)
 
+        points_gdf, calculation_points_gdf = self.build_output(all_segments, all_calculation_points)
+
+        if hasattr(self.dem_source, "stats"):
+            self.logger.info(f"DEM block cache: {self.dem_source.stats()}")
+            print(f"DEM block cache: {self.dem_source.stats()}")
+
+        self.logger.info("\nAnalysis completed successfully")
+        return points_gdf, calculation_points_gdf
+
+    def build_output(self, all_segments, all_calculation_points):
+        """Build the GeoDataFrames of the classified points and of the calculation points"""
         # Create GeoDataFrames for visualization
         points_gdf = gpd.GeoDataFrame(all_segments, crs=self.lines_selected.crs)
         
@@ -678,7 +775,6 @@ class ProfileAnalyzer:
         else:
             calculation_points_gdf = None
 
-        self.logger.info("\nAnalysis completed successfully")
         return points_gdf, calculation_points_gdf
 
     def save_output(self, points_gdf, calculation_points_gdf):
@@ -702,3 +798,23 @@ class ProfileAnalyzer:
         
         print(f"Classified profiles saved as: {output_file}")
         print("Layers created: 'points' and 'calculation_points'")
+
+# Analyzer of the worker processes of ProfileAnalyzer.analyze_parallel
+_worker_analyzer = None
+
+def _init_worker(analyzer):
+    global _worker_analyzer
+    _worker_analyzer = analyzer
+
+def _analyze_chunk(task):
+    """Analyze a chunk of a line in a worker (see ProfileAnalyzer.analyze_chunk). Returns the points, calculation points and R² scores"""
+    i, start = task[:2]
+    analyzer = _worker_analyzer
+    t0 = time.time()
+    n_r2_scores = len(analyzer.r2_scores)
+    points, calculation_points = analyzer.analyze_chunk(*task)
+    r2_scores = analyzer.r2_scores[n_r2_scores:]
+    del analyzer.r2_scores[n_r2_scores:]
+    print(f"[worker {os.getpid()}] line {i+1}, {start}-{start + len(points)} m: {len(points)} profiles in {time.time() - t0:.1f} s", flush=True)
+    points_gdf, calculation_points_gdf = analyzer.build_output(points, calculation_points)
+    return points_gdf, calculation_points_gdf, r2_scores
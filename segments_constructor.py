@@ -1,28 +1,46 @@
 from shapely.geometry import LineString, Point, MultiLineString
+from shapely.ops import substring
 import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
 import os
 import math
 from tqdm import tqdm
 import time
+from concurrent.futures import ProcessPoolExecutor
 from get_data_functions import get_data
+from pr_reference import PRReference
 
 class SegmentConstructor:
-    def __init__(self, classified_profiles, output_folder, route_number):
+    def __init__(self, classified_profiles, output_folder, route_number, layers=None):
         self.classified_profiles = classified_profiles
         self.current_crs = classified_profiles.crs
         self.current_bounds = tuple(classified_profiles.total_bounds)
         self.output_folder = output_folder
         self.route_number = route_number
         self.filter_route = f"numero='{route_number}'"
-        self.route = get_data(self.filter_route, "BDTOPO_V3:route_numerotee_ou_nommee", self.current_bounds)
+        # layers: couches déjà téléchargées par prefetch_route_layers, le cas échéant
+        layers = layers or {}
+        self.route = get_data(self.filter_route, "BDTOPO_V3:route_numerotee_ou_nommee", self.current_bounds, prefetched=layers.get("route_numerotee_ou_nommee"))
         self.filter_PR = f"route='{route_number}'"
-        self.PR_route = get_data(self.filter_PR, "BDTOPO_V3:point_de_repere", self.current_bounds)
+        self.PR_route = get_data(self.filter_PR, "BDTOPO_V3:point_de_repere", self.current_bounds, prefetched=layers.get("point_de_repere"))
         
         # Créer un index spatial pour accélérer la recherche de points
         print("Création de l'index spatial...")
         self.spatial_index = self.classified_profiles.sindex
         print("Index spatial créé")
 
+    def __getstate__(self):
+        # L'index spatial n'est pas transmis aux autres processus, qui le reconstruisent
+        state = self.__dict__.copy()
+        del state["spatial_index"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.spatial_index = self.classified_profiles.sindex
+
     def calculate_distance(self, point1, point2):
         """Calculate the distance between two points"""
         return math.sqrt((point2.x - point1.x)**2 + (point2.y - point1.y)**2)
@@ -64,77 +82,311 @@ class SegmentConstructor:
             print(f"Erreur lors de la recherche du point le plus proche: {e}")
             return None, float('inf')
         
-    def is_convertible_to_int(self, x):
-        try:
-            int(str(x))
-            return True
-        except ValueError:
-            return False
+    def route_parts(self):
+        """Liste des parties LineString des géométries de la route, avec l'indice de la géométrie et de la partie"""
+        parts = []
+        for index, geom in enumerate(self.route.geometry):
+            if geom.geom_type == "MultiLineString":
+                for line_idx, line in enumerate(geom.geoms):
+                    parts.append((index, line_idx, line))
+            elif geom.geom_type == "LineString":
+                parts.append((index, 0, geom))
+            else:
+                print(f"Géométrie à l'index {index} n'est pas une LineString, mais {geom.geom_type}")
+        return parts
 
-    def find_closest_PR(self, point, PR_current):
+    def line_runs(self, line, max_distance=1.5, max_gap=2.0):
         """
-        Find the closest PR point with the smallest PR number
+        Projette en une fois sur la ligne tous les profils classifiés à moins de max_distance m de celle-ci,
+        les trie par abscisse curviligne et découpe la suite en plages de même classification.
+        Une plage s'interrompt aussi lorsque deux profils consécutifs sont espacés de plus de max_gap m.
+        Retourne les positions des profils triés, leurs abscisses curvilignes et les bornes [début, fin) des plages.
         """
-        # Utiliser l'index spatial pour trouver rapidement les candidats les plus proches
-        spatial_index_PR = PR_current.sindex
-        try:
-            # Créer un buffer autour du point pour la recherche
-            buffer_dist = 1500  # métres
-            buffered_bounds = (
-                point.x - buffer_dist,
-                point.y - buffer_dist,
-                point.x + buffer_dist,
-                point.y + buffer_dist
-            )
-            
-            # Trouver les points dans ce buffer
-            possible_matches_index = list(spatial_index_PR.intersection(buffered_bounds))
-            print(f"Nombre de points de repère trouvés: {len(possible_matches_index)}")
-            
-            if not possible_matches_index:
-                return None
-                
-            possible_matches = PR_current.iloc[possible_matches_index]
-
-            # Filter possible_matches to keep only rows where 'numero' can be converted to an integer
-            possible_matches = possible_matches[possible_matches['numero'].apply(self.is_convertible_to_int)]
-            print(f"Points de repère restants après filtrage: {len(possible_matches)}")
-
-            if possible_matches.empty:
-                return None
-
-            # Chercher les 2 PR les plus proches du point
-            closest_two = possible_matches.distance(point).nsmallest(2).index
-            possible_matches = possible_matches.loc[closest_two]
-
-            print(f"Nombre dans possible matches: {len(possible_matches)}")
+        candidates = np.sort(self.spatial_index.query(line, predicate="dwithin", distance=max_distance))
+        if len(candidates) == 0:
+            empty = np.array([], dtype=int)
+            return empty, np.array([], dtype=float), empty, empty
+
+        measures = shapely.line_locate_point(line, self.classified_profiles.geometry.values[candidates])
+        order = np.argsort(measures, kind="stable")
+        candidates = candidates[order]
+        measures = measures[order]
+
+        # Encodage par plages : rupture à chaque changement de classification ou trou dans les profils
+        classes = self.classified_profiles['classification'].to_numpy()[candidates]
+        breaks = np.flatnonzero((classes[1:] != classes[:-1]) | (np.diff(measures) > max_gap)) + 1
+        run_starts = np.concatenate([[0], breaks])
+        run_ends = np.concatenate([breaks, [len(candidates)]])
+        return candidates, measures, run_starts, run_ends
+
+    def segment_statistics(self, profile_positions, segment_ids, n_segments, quantiles=(0.5, 0.9)):
+        """
+        Statistiques de hauteur et de pente des segments, calculées en une seule agrégation groupée
+        sur l'identifiant de segment (0 à n_segments - 1) de chaque profil retenu.
+        La pente d'un profil est slope_ouvrage_section, ou slope_ouvrage_total à défaut ; les valeurs manquantes
+        sont ignorées, et max, moyenne et percentiles sont NaN pour un segment sans valeur (nb_hauteurs, nb_pentes à 0).
+        Les profils interpolés par l'espacement adaptatif (colonne interpolated) n'ont pas été mesurés :
+        ils sont exclus des statistiques et des comptages.
+        """
+        profiles = self.classified_profiles.iloc[profile_positions]
+        segment_ids = np.asarray(segment_ids, dtype=int)
+        if 'interpolated' in profiles.columns:
+            measured = ~profiles['interpolated'].fillna(False).to_numpy(dtype=bool)
+            profiles = profiles[measured]
+            segment_ids = segment_ids[measured]
+        slopes_section = profiles['slope_ouvrage_section'].to_numpy(dtype=float, na_value=np.nan)
+        slopes_total = profiles['slope_ouvrage_total'].to_numpy(dtype=float, na_value=np.nan)
+        values = pd.DataFrame({
+            'segment': segment_ids,
+            'hauteur': profiles['max_height_difference'].to_numpy(dtype=float, na_value=np.nan),
+            'pente': np.where(np.isnan(slopes_section), slopes_total, slopes_section)
+        })
+        grouped = values.groupby('segment')[['hauteur', 'pente']]
+        aggregated = grouped.agg(['max', 'mean', 'count'])
+        percentiles = grouped.quantile(list(quantiles)).unstack()
+
+        stats = pd.DataFrame(index=pd.RangeIndex(n_segments))
+        stats['hauteur_max'] = aggregated[('hauteur', 'max')]
+        stats['pente_max'] = aggregated[('pente', 'max')]
+        stats['hauteur_moyenne'] = aggregated[('hauteur', 'mean')]
+        stats['pente_moyenne'] = aggregated[('pente', 'mean')]
+        for name in ('hauteur', 'pente'):
+            for q in quantiles:
+                stats[f'{name}_p{int(round(q * 100))}'] = percentiles[(name, q)]
+        stats['nb_profils'] = grouped.size().reindex(stats.index, fill_value=0)
+        stats['nb_hauteurs'] = aggregated[('hauteur', 'count')].reindex(stats.index, fill_value=0)
+        stats['nb_pentes'] = aggregated[('pente', 'count')].reindex(stats.index, fill_value=0)
+        return stats
+
+    def add_segment_statistics(self, ouvrages_gdf, profile_positions, segment_ids):
+        """Ajoute aux segments, après la colonne classification, les statistiques de segment_statistics"""
+        stats = self.segment_statistics(profile_positions, segment_ids, len(ouvrages_gdf))
+        position = ouvrages_gdf.columns.get_loc('classification') + 1
+        for offset, column in enumerate(stats.columns):
+            ouvrages_gdf.insert(position + offset, column, stats[column].to_numpy())
+        return ouvrages_gdf
 
-            # Parmi ces candidats, trouver le minimal
-            candidates = []
-            for index, row in possible_matches.iterrows():
-                try:
-                    # Extract PR number
-                    pr_number = int(row['numero'])
-                    candidates.append((row, pr_number))
-                except (IndexError, ValueError) as e:
-                    print(f"Error extracting PR number")
+    def linear_line_segments(self, index, line_idx, line, max_distance=1.5, max_gap=2.0):
+        """
+        Segments d'une partie de la route par référencement linéaire : les profils sont projetés sur la ligne et
+        les segments sont les plages de profils consécutifs de même classification (voir line_runs).
+        Retourne la liste des ouvrages, les positions des profils de chaque segment et le numéro du segment
+        (dans la liste) de chacun de ces profils.
+        """
+        ouvrages = []
+        profile_positions = [np.array([], dtype=int)]
+        segment_ids = [np.array([], dtype=int)]
+        classifications = self.classified_profiles['classification'].to_numpy()
+
+        line_buffer = line.buffer(1)
+        PR_current = self.PR_route[self.PR_route.geometry.intersects(line_buffer)]
+
+        PR_reference = PRReference(line, PR_current)
+
+        candidates, measures, run_starts, run_ends = self.line_runs(line, max_distance, max_gap)
+        print(f"Ligne {index+1}.{line_idx+1} - Longueur: {line.length:.2f} m, profils projetés: {len(candidates)}, plages: {len(run_starts)}")
+
+        # Il faut au moins 2 profils pour créer un segment
+        keep = (run_ends - run_starts >= 2) & (measures[run_ends - 1] > measures[run_starts])
+        run_starts = run_starts[keep]
+        run_ends = run_ends[keep]
+
+        # PR de référence et abscisses des extrémités de tous les segments de la ligne, en une fois
+        PR_start_positions, abcisses_start = PR_reference.abscisses(measures[run_starts])
+        PR_end_positions, abcisses_end = PR_reference.abscisses(measures[run_ends - 1])
+
+        for k, (run_start, run_end) in enumerate(zip(run_starts, run_ends)):
+            if PR_start_positions[k] < 0 or PR_end_positions[k] < 0:
+                print(f"Aucun point de repère trouvé pour le segment à {measures[run_start]:.2f} m")
+                continue
+
+            rows = candidates[run_start:run_end]
+            measure_start = measures[run_start]
+            measure_end = measures[run_end - 1]
+            profile_type = classifications[rows[0]]
+            try:
+                segment = substring(line, measure_start, measure_end)
+
+                PR_start = PR_reference.table.iloc[PR_start_positions[k]]
+                PR_end = PR_reference.table.iloc[PR_end_positions[k]]
+                abcisse_start = abcisses_start[k]
+                abcisse_end = abcisses_end[k]
+
+                segment_name = f"{self.route_number}_PR{PR_start['numero']}-{int(round(abcisse_start, -1))}_{PR_start['cote']}"
+
+                profile_positions.append(rows)
+                segment_ids.append(np.full(len(rows), len(ouvrages)))
+                ouvrages.append({
+                    'geometry': segment,
+                    # Nombre de mètres couverts, comme le pas de 1 m de construct_segments
+                    'length': int(round(measure_end - measure_start)) + 1,
+                    'classification': profile_type,
+                    'PR_start': PR_start['libelle'],
+                    'PR_end': PR_end['libelle'],
+                    'abcisse_start': round(abcisse_start, -1),
+                    'abcisse_end': round(abcisse_end, -1),
+                    'nom': segment_name,
+                    'route': self.route_number
+                })
+            except Exception as e:
+                print(f"Erreur lors de la création du segment: {e}")
+
+        return ouvrages, np.concatenate(profile_positions), np.concatenate(segment_ids)
+
+    def loop_line_segments(self, index, line_idx, line, start_time):
+        """
+        Segments d'une partie de la route, en cherchant le profil le plus proche de chaque mètre de la ligne.
+        Retourne, comme linear_line_segments, les ouvrages, les positions de leurs profils et leurs numéros de segment.
+        """
+        ouvrages = []
+        # Profils de chaque segment (index de classified_profiles), pour l'agrégation des statistiques
+        profile_labels = []
+        segment_ids = []
+
+        i = 0
+        # Utiliser simplement la longueur de la ligne au lieu du calcul géodésique
+        length_line = line.length
+        print(f"Traitement de la ligne {index+1}.{line_idx+1} - Longueur: {length_line:.2f} m")
+
+        line_buffer = line.buffer(1)  # Create 1-meter buffer around the line
+        PR_current = self.PR_route[self.PR_route.geometry.intersects(line_buffer)]
+        print(f"Nombre de points de repère dans la ligne {index+1}.{line_idx+1}: {len(PR_current)}")
+        PR_reference = PRReference(line, PR_current)
+
+        with tqdm(total=int(length_line), desc=f"Processing Line {index+1}.{line_idx+1}") as pbar:
+            while i < length_line:
+                if time.time() - start_time > 3600:  # Timeout après 1 heure
+                    print("Timeout atteint. Arrêt du traitement.")
+                    break
+
+                pointi_geo = line.interpolate(i)
+
+                # Log périodique
+                if i % 100 == 0:
+                    print(f"Position actuelle: {i:.2f}/{length_line:.2f} m")
+
+                closest_row, min_distance = self.determine_closest_point(pointi_geo)
+
+                if closest_row is None:
+                    i += 1
+                    pbar.update(1)
                     continue
-        
-            if not candidates:
-                return None
-            else:
-                # Sort candidates by PR number
-                candidates.sort(key=lambda x: x[1])
-                minimal_PR = candidates[0][0]
-                
-                return minimal_PR
-            
-        except Exception as e:
-            print(f"Erreur lors de la recherche du PR de référence: {e}")
-            return None
 
-    def construct_segments(self):
+                if min_distance < 5:
+                    print(f"Point proche trouvé à {i:.2f} m - Distance: {min_distance:.2f} m")
+
+                    profile_type = closest_row['classification']
+
+                    list_points = [pointi_geo]
+                    j = i + 1
+                    max_search = min(i + 1000, length_line)  # Limiter la recherche pour éviter les boucles infinies
+
+                    # Collecter les points pour créer un segment avec limite d'itérations
+                    iteration_count = 0
+                    max_iterations = 1000
+
+                    segment_profiles = []
+
+                    while j < max_search and iteration_count < max_iterations:
+                        pointj_geo = line.interpolate(j)
+                        closest_row_j, min_distance_j = self.determine_closest_point(pointj_geo)
+
+                        if closest_row_j is None or min_distance_j > 1.5:
+                            break
+
+                        # Vérifier que le type de profil est le même pour continuer le segment
+                        if closest_row_j['classification'] != profile_type:
+                            i += 1
+                            pbar.update(1)
+                            break
+
+                        segment_profiles.append(closest_row_j.name)
+                        list_points.append(pointj_geo)
+                        j += 1
+                        iteration_count += 1
+
+                    # Si on a interrompu à cause du max d'itérations
+                    if iteration_count >= max_iterations:
+                        print(f"Arrêt après {max_iterations} itérations à la distance {i}")
+
+                    # Vérifier qu'il y a au moins 2 points avant de créer la LineString
+                    if len(list_points) >= 2:
+                        try:
+                            segment = LineString(list_points)
+
+                            segment_startpoint = segment.interpolate(0)
+                            segment_endpoint = segment.interpolate(-1)
+
+                            # PR de référence et abscisses, par recherche dans la table des PR de la ligne
+                            PR_start, abcisse_start = PR_reference.reference(line.project(segment_startpoint))
+                            PR_end, abcisse_end = PR_reference.reference(line.project(segment_endpoint))
+
+                            if PR_start is None or PR_end is None:
+                                # Segment ignoré, comme dans linear_line_segments ; la recherche reprend après lui
+                                print(f"Aucun point de repère trouvé pour le segment à {i:.2f} m")
+                                pbar.update(j - i)
+                                i = j
+                                continue
+
+                            segment_name = f"{self.route_number}_PR{PR_start['numero']}-{int(round(abcisse_start, -1))}_{PR_start['cote']}"
+
+                            profile_labels.extend(segment_profiles)
+                            segment_ids.extend([len(ouvrages)] * len(segment_profiles))
+                            ouvrages.append({
+                                'geometry': segment,
+                                'length': j - i,
+                                'classification': profile_type,
+                                'PR_start': PR_start['libelle'],
+                                'PR_end': PR_end['libelle'],
+                                'abcisse_start': round(abcisse_start, -1),
+                                'abcisse_end': round(abcisse_end, -1),
+                                'nom': segment_name,
+                                'route': self.route_number
+                            })
+
+                            delta = j - i
+                            pbar.update(delta)
+                            i = j
+                            print(f"Segment créé: {delta:.2f} m, Type: {profile_type}")
+                        except Exception as e:
+                            print(f"Erreur lors de la création du segment: {e}")
+                            i += 1
+                            pbar.update(1)
+                    else:
+                        print(f"Pas assez de points pour créer un segment à la distance {i}")
+                        i += 1
+                        pbar.update(1)
+                else:
+                    i += 1
+                    pbar.update(1)
+
+        profile_positions = self.classified_profiles.index.get_indexer(profile_labels)
+        return ouvrages, profile_positions, np.array(segment_ids, dtype=int)
+
+    def line_segments(self, part, linear_referencing=False, max_distance=1.5, max_gap=2.0, start_time=None):
+        """Segments d'une partie (index, line_idx, line) de la route, par l'une ou l'autre des méthodes"""
+        index, line_idx, line = part
+        if linear_referencing:
+            return self.linear_line_segments(index, line_idx, line, max_distance, max_gap)
+        return self.loop_line_segments(index, line_idx, line, start_time if start_time is not None else time.time())
+
+    def construct_segments_linear(self, max_distance=1.5, max_gap=2.0, workers=None):
+        """
+        Variante de construct_segments par référencement linéaire : au lieu de chercher le profil le plus proche
+        de chaque mètre de la route, les profils sont projetés sur chaque ligne et les segments sont les plages
+        de profils consécutifs de même classification (voir line_runs).
+        """
+        return self.construct_segments(linear_referencing=True, max_distance=max_distance, max_gap=max_gap, workers=workers)
+
+    def construct_segments(self, linear_referencing=False, max_distance=1.5, max_gap=2.0, workers=None):
+        """
+        Construit les segments de même classification le long de toutes les parties de la route.
+        workers: nombre de processus entre lesquels répartir les parties de la route (séquentiel si None ou 1) ;
+        les ouvrages sont fusionnés dans l'ordre des parties, quel que soit l'ordre de fin des processus.
+        """
         all_ouvrages = []
+        profile_positions = []
+        segment_ids = []
         start_time = time.time()
 
         print("Début de construct_segments()")
@@ -146,157 +398,29 @@ class SegmentConstructor:
             print("classified_profiles est vide. Aucun segment ne sera généré.")
             return gpd.GeoDataFrame(columns=["geometry", "startpoint", "endpoint", "length", "classification"], crs=self.current_crs)
 
-        for index, geom in enumerate(self.route.geometry):
-            if geom.geom_type == "MultiLineString":
-                for line_idx, line in enumerate(geom.geoms):
-                    if isinstance(line, LineString):
-                        i = 0
-                        # Utiliser simplement la longueur de la ligne au lieu du calcul géodésique
-                        length_line = line.length
-                        print(f"Traitement de la ligne {index+1}.{line_idx+1} - Longueur: {length_line:.2f} m")
-
-                        line_buffer = line.buffer(1)  # Create 1-meter buffer around the line
-                        PR_current = self.PR_route[self.PR_route.geometry.intersects(line_buffer)]
-                        print(f"Nombre de points de repère dans la ligne {index+1}.{line_idx+1}: {len(PR_current)}")
-
-                        with tqdm(total=int(length_line), desc=f"Processing Line {index+1}.{line_idx+1}") as pbar:
-                            while i < length_line:
-                                if time.time() - start_time > 3600:  # Timeout après 1 heure
-                                    print("Timeout atteint. Arrêt du traitement.")
-                                    break
-                                    
-                                pointi_geo = line.interpolate(i)
-                                
-                                # Log périodique
-                                if i % 100 == 0:
-                                    print(f"Position actuelle: {i:.2f}/{length_line:.2f} m")
-                                
-                                closest_row, min_distance = self.determine_closest_point(pointi_geo)
-                                
-                                if closest_row is None:
-                                    i += 1
-                                    pbar.update(1)
-                                    continue
-
-                                if min_distance < 5:
-                                    print(f"Point proche trouvé à {i:.2f} m - Distance: {min_distance:.2f} m")
-
-                                    profile_type = closest_row['classification']
-
-                                    list_points = [pointi_geo]
-                                    j = i + 1
-                                    max_search = min(i + 1000, length_line)  # Limiter la recherche pour éviter les boucles infinies
-                                    
-                                    # Collecter les points pour créer un segment avec limite d'itérations
-                                    iteration_count = 0
-                                    max_iterations = 1000
-
-                                    hauteur_max = 0
-                                    pente_max = 0
-                                    hauteurs = []
-                                    pentes = []
-                                    
-                                    while j < max_search and iteration_count < max_iterations:
-                                        pointj_geo = line.interpolate(j)
-                                        closest_row_j, min_distance_j = self.determine_closest_point(pointj_geo)
-                                        
-                                        if closest_row_j is None or min_distance_j > 1.5:
-                                            break
-                                        
-                                        # Vérifier que le type de profil est le même pour continuer le segment
-                                        if closest_row_j['classification'] != profile_type:
-                                            i += 1
-                                            pbar.update(1)
-                                            break
-
-                                        hauteur = closest_row_j['max_height_difference']
-                                        hauteurs.append(hauteur)
-                                        hauteur_max = max(hauteur_max, hauteur)
-
-                                        if closest_row_j['slope_ouvrage_section'] is not None:
-                                            pente = closest_row_j['slope_ouvrage_section']
-                                        else:
-                                            pente = closest_row_j['slope_ouvrage_total']
-                                        pentes.append(pente)
-                                        pente_max = max(pente_max, pente)
-
-                                        list_points.append(pointj_geo)
-                                        j += 1
-                                        iteration_count += 1
-                                    
-                                    hauteur_max = max(hauteurs) if hauteurs else 0
-                                    hauteur_moyenne = sum(hauteurs) / len(hauteurs) if hauteurs else 0
-                                    pente_max = max(pentes) if pentes else 0
-                                    pente_moyenne = sum(pentes) / len(pentes) if pentes else 0
-
-                                    # Si on a interrompu à cause du max d'itérations
-                                    if iteration_count >= max_iterations:
-                                        print(f"Arrêt après {max_iterations} itérations à la distance {i}")
-                                    
-                                    # Vérifier qu'il y a au moins 2 points avant de créer la LineString
-                                    if len(list_points) >= 2:
-                                        try:
-                                            segment = LineString(list_points)
-
-                                            segment_startpoint = segment.interpolate(0)
-                                            segment_endpoint = segment.interpolate(-1)
-
-                                            PR_start = self.find_closest_PR(segment_startpoint, PR_current)
-                                            PR_end = self.find_closest_PR(segment_endpoint, PR_current)
-
-                                            closest_point_on_line_PR_start = line.interpolate(line.project(PR_start.geometry))
-                                            closest_point_on_line_PR_end = line.interpolate(line.project(PR_end.geometry))
-
-                                            abcisse_start = line.project(segment_startpoint) - line.project(closest_point_on_line_PR_start)
-                                            abcisse_end = line.project(segment_endpoint) - line.project(closest_point_on_line_PR_end)
-
-                                            segment_name = f"{self.route_number}_PR{PR_start['numero']}-{int(round(abcisse_start, -1))}_{PR_start['cote']}"
-                                            
-                                            all_ouvrages.append({
-                                                'geometry': segment,
-                                                'length': j - i,
-                                                'classification': profile_type,
-                                                'hauteur_max': hauteur_max,
-                                                'pente_max': pente_max,
-                                                'hauteur_moyenne': hauteur_moyenne,
-                                                'pente_moyenne': pente_moyenne,
-                                                'PR_start': PR_start['libelle'],
-                                                'PR_end': PR_end['libelle'],
-                                                'abcisse_start': round(abcisse_start, -1),
-                                                'abcisse_end': round(abcisse_end, -1),
-                                                'nom': segment_name,
-                                                'route': self.route_number
-                                            })
-                                            
-                                            delta = j - i
-                                            pbar.update(delta)
-                                            i = j
-                                            print(f"Segment créé: {delta:.2f} m, Type: {profile_type}")
-                                        except Exception as e:
-                                            print(f"Erreur lors de la création du segment: {e}")
-                                            i += 1
-                                            pbar.update(1)
-                                    else:
-                                        print(f"Pas assez de points pour créer un segment à la distance {i}")
-                                        i += 1
-                                        pbar.update(1)
-                                else:
-                                    i += 1
-                                    pbar.update(1)
-                    else:
-                        print(f"Géométrie à l'index {index} n'est pas une LineString, mais {type(line)}")
-            else:
-                print(f"Géométrie à l'index {index} n'est pas une MultiLineString, mais {geom.geom_type}")
+        parts = self.route_parts()
+        tasks = [(part, linear_referencing, max_distance, max_gap, start_time) for part in parts]
+        if workers and workers > 1 and len(parts) > 1:
+            print(f"Construction des segments de {len(parts)} parties de route sur {min(workers, len(parts))} processus")
+            with ProcessPoolExecutor(max_workers=min(workers, len(parts)), initializer=_init_worker, initargs=(self,)) as executor:
+                results = list(executor.map(_line_segments, tasks))
+        else:
+            results = [self.line_segments(*task) for task in tasks]
+
+        # Fusion dans l'ordre des parties, en décalant les numéros de segment
+        for ouvrages, positions, ids in results:
+            profile_positions.append(positions)
+            segment_ids.append(ids + len(all_ouvrages))
+            all_ouvrages.extend(ouvrages)
 
         if not all_ouvrages:
             print("all_ouvrages est vide après traitement.")
             return gpd.GeoDataFrame(columns=["geometry", "startpoint", "endpoint", "length", "classification", "hauteur_max", "pente_max"], crs=self.current_crs)
 
-        print(f"Segments générés: {len(all_ouvrages)}")
+        print(f"Segments générés: {len(all_ouvrages)} en {time.time() - start_time:.1f} s")
 
         ouvrages_gdf = gpd.GeoDataFrame(all_ouvrages, crs=self.current_crs, geometry="geometry")
-
-        return ouvrages_gdf
+        return self.add_segment_statistics(ouvrages_gdf, np.concatenate(profile_positions), np.concatenate(segment_ids))
 
     def save_output(self, ouvrages_gdf):
         # Create output folder if it doesn't exist
@@ -307,4 +431,19 @@ class SegmentConstructor:
         # Save segments
         ouvrages_gdf.to_file(output_file, driver='GPKG', layer='segments')
         
-        print(f"Ouvrage segments saved as: {output_file}")
\ No newline at end of file
+        print(f"Ouvrage segments saved as: {output_file}")
+
+# Constructeur reçu par chaque processus de construct_segments(workers=...)
+_worker_constructor = None
+
+def _init_worker(constructor):
+    global _worker_constructor
+    _worker_constructor = constructor
+
+def _line_segments(task):
+    """Segments d'une partie de la route dans un processus (voir SegmentConstructor.line_segments)"""
+    part = task[0]
+    t0 = time.time()
+    result = _worker_constructor.line_segments(*task)
+    print(f"[worker {os.getpid()}] ligne {part[0]+1}.{part[1]+1}: {len(result[0])} segments en {time.time() - t0:.1f} s", flush=True)
+    return result
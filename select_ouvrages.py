@@ -4,12 +4,17 @@ import pandas as pd
 from get_data_functions import get_ponts
 
 class OuvragesSelector:
-    def __init__(self, ouvrages_gdf, output_folder, route_number):
+    def __init__(self, ouvrages_gdf, output_folder, route_number, layers=None):
         self.ouvrages_gdf = ouvrages_gdf
         self.output_folder = output_folder
         self.filter_route = f"numero='{route_number}'"
-        self.ponts_gdf = get_ponts(self.filter_route, "BDTOPO_V3:construction_surfacique")
-        self.ponts2_gdf = get_ponts(self.filter_route, "BDTOPO_V3:construction_lineaire")
+        # layers: couches déjà téléchargées par prefetch_route_layers, le cas échéant
+        if layers and layers.get("construction_surfacique") is not None and layers.get("construction_lineaire") is not None:
+            self.ponts_gdf = layers["construction_surfacique"]
+            self.ponts2_gdf = layers["construction_lineaire"]
+        else:
+            self.ponts_gdf = get_ponts(self.filter_route, "BDTOPO_V3:construction_surfacique")
+            self.ponts2_gdf = get_ponts(self.filter_route, "BDTOPO_V3:construction_lineaire")
 
     def merge_close_segments(self, gdf):
             if len(gdf) <= 1:
@@ -0,0 +1,77 @@
+import numpy as np
+import shapely
+
+class StationLine:
+    """
+    Route line prepared for placing stations and perpendicular transects along it.
+    The cumulative distances of the vertices are computed once; points at any array of distances are then
+    found by binary search, with the same arithmetic as LineString.interpolate.
+    """
+    def __init__(self, line):
+        self.line = line
+        self.coords = shapely.get_coordinates(line)
+        deltas = np.diff(self.coords, axis=0)
+        self.segment_lengths = np.sqrt(deltas[:, 0] * deltas[:, 0] + deltas[:, 1] * deltas[:, 1])
+        self.cumulative = np.concatenate([[0.0], np.cumsum(self.segment_lengths)])
+        self.length = self.cumulative[-1]
+
+    def points(self, distances):
+        """
+        (N, 2) coordinates of the points at the given distances along the line. As LineString.interpolate,
+        negative distances are measured from the end and distances are clamped to the line.
+        """
+        distances = np.asarray(distances, dtype="float64")
+        distances = np.where(distances < 0, distances + self.length, distances)
+        distances = np.clip(distances, 0, self.length)
+
+        # Segment of each distance: the last vertex at or before it (zero-length segments are skipped)
+        segments = np.searchsorted(self.cumulative, distances, side="right") - 1
+        at_end = segments >= len(self.segment_lengths)
+        segments = np.minimum(segments, len(self.segment_lengths) - 1)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            fractions = (distances - self.cumulative[segments]) / self.segment_lengths[segments]
+        fractions = np.where(at_end, 1.0, np.clip(fractions, 0, 1))
+        start = self.coords[segments]
+        end = self.coords[segments + 1]
+        return (end - start) * fractions[:, None] + start
+
+    def angles(self, distances, lookahead=10, forward_limit=15):
+        """
+        Direction of the route at the given distances, in degrees: measured over the next lookahead m
+        up to forward_limit m from the start of the line, and over the previous lookahead m elsewhere.
+        """
+        distances = np.asarray(distances, dtype="float64")
+        forward = distances <= forward_limit
+        from_points = self.points(np.where(forward, distances, distances - lookahead))
+        to_points = self.points(np.where(forward, distances + lookahead, distances))
+        return np.degrees(np.arctan2(to_points[:, 1] - from_points[:, 1], to_points[:, 0] - from_points[:, 0]))
+
+    def transects(self, distances, half_width=60):
+        """
+        Perpendicular transects of 2 x half_width m at the given distances, running from the right to the left
+        of the route. Returns the (N, 2) arrays of the station points, transect start points and transect end points.
+        """
+        distances = np.asarray(distances, dtype="float64")
+        centres = self.points(distances)
+        angle = self.angles(distances)
+        offsets = np.column_stack([
+            half_width * np.cos(np.radians(angle + 90)),
+            half_width * np.sin(np.radians(angle + 90))
+        ])
+        return centres, centres - offsets, centres + offsets
+
+    def transect_lines(self, distances, half_width=60):
+        """Perpendicular transects at the given distances as an array of LineStrings"""
+        _, starts, ends = self.transects(distances, half_width)
+        return shapely.linestrings(np.stack([starts, ends], axis=1))
+
+def perpendicular_transects(line, distances, half_width=60):
+    """Station points, transect start points and transect end points at the given distances along a line (LineString or StationLine)"""
+    station_line = line if isinstance(line, StationLine) else StationLine(line)
+    return station_line.transects(distances, half_width)
+
+def perpendicular_lines(line, distances, half_width=60):
+    """Perpendicular transects at the given distances along a line (LineString or StationLine), as LineStrings"""
+    station_line = line if isinstance(line, StationLine) else StationLine(line)
+    return station_line.transect_lines(distances, half_width)
@@ -0,0 +1,150 @@
+import logging
+import os
+import sys
+
+# The modules of the repository are flat top-level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import geopandas as gpd
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+from shapely.geometry import LineString, MultiLineString, Point, box
+
+X0 = 700000.0
+Y0 = 6600000.0
+
+def write_dem(path, width=900, height=900, res=1.0, nodata=-99999.0, seed=1, **profile):
+    """
+    Synthetic DEM with its upper left corner at (X0, Y0): a tilted wavy terrain with an embankment along
+    row == col, a cutting along row + col == 900 and a nodata hole in the bottom-right corner
+    """
+    rng = np.random.default_rng(seed)
+    rows, cols = np.mgrid[0:height, 0:width]
+    z = 100 + 0.01 * cols + 0.02 * rows + 8 * np.sin(cols / 70.0) * np.cos(rows / 90.0) + rng.normal(0, 0.05, (height, width))
+    z += 4 * np.exp(-((cols - rows) / 25.0) ** 2)
+    z -= 5 * np.exp(-((cols + rows - 900) / 30.0) ** 2)
+    z = z.astype("float32")
+    z[800:840, 800:860] = nodata
+    with rasterio.open(path, "w", driver="GTiff", width=width, height=height, count=1, dtype="float32",
+                       crs="EPSG:2154", transform=from_origin(X0, Y0, res, res), nodata=nodata, **profile) as dst:
+        dst.write(z, 1)
+    return str(path)
+
+@pytest.fixture(scope="session")
+def dem_path(tmp_path_factory):
+    return write_dem(tmp_path_factory.mktemp("dem") / "mnt.tif")
+
+def make_stub_layers(n_PR=2500, seed=0):
+    """BD TOPO layers of a synthetic A1 route, served by the GeoplateformeStub of the wfs_stub fixture"""
+    rng = np.random.default_rng(seed)
+    route = LineString([(X0 + 100, Y0 + 100), (X0 + 2500, Y0 + 1500), (X0 + 4900, Y0 + 4900)])
+    measures = rng.uniform(0, route.length, n_PR)
+    PR_points = [Point(route.interpolate(m).x + rng.normal(0, 20), route.interpolate(m).y + rng.normal(0, 20)) for m in measures]
+    constructions = [box(X0 + x, Y0 + y, X0 + x + 30, Y0 + y + 15) for x, y in rng.uniform(0, 4900, (40, 2))]
+    return {
+        "BDTOPO_V3:point_de_repere": gpd.GeoDataFrame(
+            {
+                "cleabs": [f"PR{k:05d}" for k in range(n_PR)],
+                "route": rng.choice(["A1", "A6"], n_PR),
+                "numero": [str(k) for k in range(n_PR)],
+                "cote": rng.choice(["D", "G"], n_PR),
+                "libelle": [f"PR{k}" for k in range(n_PR)]
+            },
+            geometry=PR_points,
+            crs=2154
+        ),
+        "BDTOPO_V3:troncon_de_route": gpd.GeoDataFrame(
+            {
+                "cleabs": ["TRONROUT1", "TRONROUT2", "TRONROUT3"],
+                "cpx_numero": ["A1", "A1", "A6"],
+                "nature": ["Type autoroutier", "Type autoroutier", "Type autoroutier"],
+                "nombre_de_voies": [2, 3, 2],
+                "largeur_de_chaussee": [7.0, 10.5, 7.0]
+            },
+            geometry=[
+                LineString(route.coords[:2]),
+                LineString(route.coords[1:]),
+                LineString([(X0 + 100, Y0 + 4000), (X0 + 4900, Y0 + 4000)])
+            ],
+            crs=2154
+        ),
+        "BDTOPO_V3:route_numerotee_ou_nommee": gpd.GeoDataFrame(
+            {"cleabs": ["ROUTNOMM1", "ROUTNOMM2"], "numero": ["A1", "A6"]},
+            geometry=[route, LineString([(X0 + 100, Y0 + 4000), (X0 + 4900, Y0 + 4000)])],
+            crs=2154
+        ),
+        "BDTOPO_V3:construction_surfacique": gpd.GeoDataFrame(
+            {"cleabs": [f"CONSSURF{k}" for k in range(40)], "nature": rng.choice(["Pont", "Barrage"], 40)},
+            geometry=constructions,
+            crs=2154
+        ),
+        "BDTOPO_V3:construction_lineaire": gpd.GeoDataFrame(
+            {"cleabs": ["CONSLINE1", "CONSLINE2"], "nature": ["Pont", "Mur"]},
+            geometry=[LineString([(X0 + 2400, Y0 + 1400), (X0 + 2600, Y0 + 1600)]), LineString([(X0 + 200, Y0 + 3000), (X0 + 300, Y0 + 3000)])],
+            crs=2154
+        )
+    }
+
+@pytest.fixture
+def wfs_stub(monkeypatch, tmp_path):
+    """
+    GeoplateformeStub serving make_stub_layers, with get_data_functions pointed to it
+    and an empty WFS cache in tmp_path
+    """
+    import get_data_functions
+    from geoplateforme_stub import GeoplateformeStub
+    from wfs_cache import WFSCache
+
+    stub = GeoplateformeStub(port=0, layers=make_stub_layers())
+    stub.start()
+    monkeypatch.setattr(get_data_functions, "WFS_URL", f"{stub.url}/wfs/ows")
+    monkeypatch.setattr(get_data_functions, "WMS_URL", f"{stub.url}/wms-r")
+    monkeypatch.setattr(get_data_functions, "wfs_cache", WFSCache(cache_dir=str(tmp_path / "wfs_cache")))
+    monkeypatch.setattr(get_data_functions, "layer_store", None)
+    yield stub
+    stub.stop()
+
+@pytest.fixture
+def wms_stub(monkeypatch, dem_path):
+    """GeoplateformeStub answering GetMap from the synthetic DEM, with get_data_functions pointed to it"""
+    import get_data_functions
+    from geoplateforme_stub import GeoplateformeStub
+
+    stub = GeoplateformeStub(port=0, dem_path=dem_path)
+    stub.start()
+    monkeypatch.setattr(get_data_functions, "WMS_URL", f"{stub.url}/wms-r")
+    yield stub
+    stub.stop()
+
+@pytest.fixture
+def make_analyzer(dem_path, tmp_path):
+    """ProfileAnalyzer on the synthetic DEM and three troncons starting on the embankment or the cutting, without WFS requests"""
+    import profile_analyzer_viz
+
+    def make():
+        analyzer = profile_analyzer_viz.ProfileAnalyzer.__new__(profile_analyzer_viz.ProfileAnalyzer)
+        analyzer.mnt_path = dem_path
+        analyzer.dem_mode = "memory"
+        analyzer.dem_cache_mb = 64
+        analyzer.dem_cache_dir = None
+        analyzer.dem_source, analyzer.transform, analyzer.boundingbox = analyzer._read_dem()
+        analyzer.logger = logging.getLogger("tests")
+        analyzer.r2_scores = []
+        analyzer.lines_selected = gpd.GeoDataFrame(
+            {"nombre_de_voies": [2, 3, 2], "largeur_de_chaussee": [7.0, 10.0, 7.0], "cpx_numero": ["A1"] * 3},
+            geometry=[
+                LineString([(X0 + 300, Y0 - 300), (X0 + 650, Y0 - 300)]),
+                MultiLineString([[(X0 + 500, Y0 - 400), (X0 + 650, Y0 - 420), (X0 + 750, Y0 - 400)]]),
+                LineString([(X0 + 450, Y0 - 450), (X0 + 380, Y0 - 150)])
+            ],
+            crs=2154
+        )
+        analyzer.route_number = "A1"
+        analyzer.classification_threshold_remblai = 2
+        analyzer.classification_threshold_deblai = -2
+        analyzer.output_folder = str(tmp_path / "output")
+        return analyzer
+
+    return make
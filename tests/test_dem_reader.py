@@ -0,0 +1,159 @@
+import os
+import pickle
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.windows import Window
+
+from conftest import X0, Y0, write_dem
+from dem_reader import ArrayDEM, BlockCachedDEM, MemmapDEM, MosaicDEM, open_dem
+
+def sample_coords(seed=0, n=5000):
+    """Points over the DEM and around it, with some on the nodata hole and some on pixel edges"""
+    rng = np.random.default_rng(seed)
+    coords = np.column_stack([rng.uniform(X0 - 50, X0 + 950, n), rng.uniform(Y0 - 950, Y0 + 50, n)])
+    coords[:200] = np.column_stack([rng.uniform(X0 + 800, X0 + 860, 200), rng.uniform(Y0 - 840, Y0 - 800, 200)])
+    coords[200:400] = np.round(coords[200:400])
+    return coords
+
+def rasterio_nearest(path, coords):
+    """Elevations of the pixels containing the points with rasterio rowcol, NaN outside the raster or on nodata"""
+    with rasterio.open(path) as src:
+        array = src.read(1)
+        rows, cols = rasterio.transform.rowcol(src.transform, coords[:, 0], coords[:, 1])
+        rows, cols = np.asarray(rows), np.asarray(cols)
+        inside = (rows >= 0) & (rows < src.height) & (cols >= 0) & (cols < src.width)
+        values = np.full(len(coords), np.nan)
+        values[inside] = array[rows[inside], cols[inside]]
+        values[values == src.nodata] = np.nan
+    return values
+
+def write_tiles(path, directory, tile_size=300):
+    """Split a raster into tiles of tile_size pixels, written to directory"""
+    directory.mkdir(exist_ok=True)
+    paths = []
+    with rasterio.open(path) as src:
+        for row in range(0, src.height, tile_size):
+            for col in range(0, src.width, tile_size):
+                window = Window(col, row, tile_size, tile_size)
+                profile = src.profile.copy()
+                profile.update(width=tile_size, height=tile_size, transform=src.window_transform(window))
+                tile_path = directory / f"tile_{row}_{col}.tif"
+                with rasterio.open(tile_path, "w", **profile) as dst:
+                    dst.write(src.read(1, window=window), 1)
+                paths.append(str(tile_path))
+    return paths
+
+@pytest.fixture(scope="module")
+def readers(dem_path, tmp_path_factory):
+    directory = tmp_path_factory.mktemp("readers")
+    tiled_path = write_dem(directory / "tiled.tif", tiled=True, blockxsize=128, blockysize=128)
+    readers = {
+        "array": ArrayDEM.from_file(dem_path),
+        "memmap": MemmapDEM(dem_path, cache_dir=str(directory)),
+        "blocks_striped": BlockCachedDEM(dem_path, cache_bytes=1024 * 1024, block_size=128),
+        "blocks_tiled": BlockCachedDEM(tiled_path, cache_bytes=1024 * 1024),
+        "mosaic": MosaicDEM(write_tiles(dem_path, directory), max_open_files=4),
+        "mosaic_directory": MosaicDEM(os.path.dirname(write_tiles(dem_path, directory / "tiles", tile_size=450)[0]))
+    }
+    yield readers
+    for reader in readers.values():
+        reader.close()
+
+@pytest.mark.parametrize("name", ["array", "memmap", "blocks_striped", "blocks_tiled", "mosaic", "mosaic_directory"])
+def test_nearest_matches_rasterio_rowcol(readers, dem_path, name):
+    coords = sample_coords()
+
+    values, valid = readers[name].sample(coords)
+
+    expected = rasterio_nearest(dem_path, coords)
+    assert np.array_equal(valid, ~np.isnan(expected))
+    assert np.array_equal(values[valid], expected[valid])
+    assert not valid[:200].any()
+
+def test_nearest_matches_rasterio_sample(readers, dem_path):
+    coords = sample_coords(seed=1)
+    with rasterio.open(dem_path) as src:
+        inside = (
+            (coords[:, 0] > src.bounds.left) & (coords[:, 0] < src.bounds.right)
+            & (coords[:, 1] > src.bounds.bottom) & (coords[:, 1] < src.bounds.top)
+        )
+        expected = np.array([value[0] for value in src.sample(coords[inside])], dtype="float64")
+        expected[expected == src.nodata] = np.nan
+
+    values, _ = readers["array"].sample(coords[inside])
+
+    np.testing.assert_array_equal(values, expected)
+
+@pytest.mark.parametrize("name", ["memmap", "blocks_striped", "blocks_tiled", "mosaic", "mosaic_directory"])
+def test_bilinear_matches_array(readers, name):
+    coords = sample_coords(seed=2)
+
+    expected, expected_valid = readers["array"].sample(coords, method="bilinear")
+    values, valid = readers[name].sample(coords, method="bilinear")
+
+    assert np.array_equal(valid, expected_valid)
+    np.testing.assert_allclose(values[valid], expected[valid], rtol=0, atol=1e-9)
+
+def test_bilinear_interpolates_between_pixel_centres(readers):
+    reader = readers["array"]
+    # Centres of the pixels (row 10, col 20) and (row 10, col 21), and the middle of the two
+    coords = np.array([[X0 + 20.5, Y0 - 10.5], [X0 + 21.5, Y0 - 10.5], [X0 + 21.0, Y0 - 10.5]])
+
+    values, _ = reader.sample(coords, method="bilinear")
+
+    assert values[0] == pytest.approx(reader.array[10, 20])
+    assert values[1] == pytest.approx(reader.array[10, 21])
+    assert values[2] == pytest.approx((float(reader.array[10, 20]) + float(reader.array[10, 21])) / 2)
+
+def test_empty_and_unknown_method(readers):
+    values, valid = readers["array"].sample(np.empty((0, 2)))
+    assert len(values) == 0 and len(valid) == 0
+    with pytest.raises(ValueError):
+        readers["array"].sample(np.array([[X0, Y0]]), method="cubic")
+
+def test_bounds(readers, dem_path):
+    with rasterio.open(dem_path) as src:
+        expected = tuple(src.bounds)
+    for reader in readers.values():
+        assert reader.bounds == pytest.approx(expected)
+
+def test_memmap_pickle_round_trip(readers):
+    reader = readers["memmap"]
+    coords = sample_coords(seed=3)
+
+    restored = pickle.loads(pickle.dumps(reader))
+
+    assert len(pickle.dumps(reader)) < 10000
+    assert np.array_equal(restored.sample(coords)[0], reader.sample(coords)[0], equal_nan=True)
+
+def test_memmap_cache_reused(dem_path, tmp_path):
+    MemmapDEM(dem_path, cache_dir=str(tmp_path))
+    array_path = tmp_path / "mnt.npy"
+    modified = array_path.stat().st_mtime_ns
+
+    MemmapDEM(dem_path, cache_dir=str(tmp_path))
+
+    assert array_path.stat().st_mtime_ns == modified
+
+def test_block_cache_bounded(dem_path):
+    with BlockCachedDEM(dem_path, cache_bytes=2 * 128 * 128 * 8, block_size=128) as reader:
+        reader.sample(sample_coords(seed=4))
+        stats = reader.stats()
+        assert stats["misses"] > 0
+        assert 0 < reader._cached_bytes <= reader.cache_bytes
+    assert reader._src is None
+
+def test_mosaic_close_releases_tiles(dem_path, tmp_path):
+    with MosaicDEM(write_tiles(dem_path, tmp_path), max_open_files=2) as reader:
+        reader.sample(sample_coords(seed=5))
+        assert len(reader._open_tiles) == 2
+    assert len(reader._open_tiles) == 0
+
+@pytest.mark.parametrize("mode, reader_class", [("memory", ArrayDEM), ("blocks", BlockCachedDEM), ("memmap", MemmapDEM)])
+def test_open_dem_modes(dem_path, tmp_path, mode, reader_class):
+    with open_dem(dem_path, mode=mode, cache_dir=str(tmp_path)) as reader:
+        assert isinstance(reader, reader_class)
+    with pytest.raises(ValueError):
+        open_dem(dem_path, mode="tiles")
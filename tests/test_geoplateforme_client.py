@@ -0,0 +1,98 @@
+import threading
+import time
+
+import pytest
+
+from conftest import make_stub_layers
+from geoplateforme_client import GeoplateformeClient, ResponseRecorder
+from geoplateforme_stub import GeoplateformeStub
+
+PARAMS = {"SERVICE": "WFS", "REQUEST": "GetFeature", "TYPENAMES": "BDTOPO_V3:route_numerotee_ou_nommee", "OUTPUTFORMAT": "application/json"}
+
+@pytest.fixture
+def flaky_stub():
+    stub = GeoplateformeStub(port=0, layers=make_stub_layers(n_PR=10), transient_errors=2)
+    stub.start()
+    yield stub
+    stub.stop()
+
+@pytest.fixture
+def stub():
+    stub = GeoplateformeStub(port=0)
+    stub.start()
+    yield stub
+    stub.stop()
+
+def test_transient_errors_are_retried(flaky_stub):
+    client = GeoplateformeClient(backoff_factor=0)
+    url = f"{flaky_stub.url}/wfs/ows"
+
+    response = client.get(url, params=PARAMS)
+
+    assert response.status_code == 200
+    assert len(response.json()["features"]) == 2
+    assert sum(flaky_stub.request_counts.values()) == 3
+    assert client.stats()[url]["requests"] == 1 and client.stats()[url]["errors"] == 0
+
+def test_retries_exhausted(flaky_stub):
+    client = GeoplateformeClient(max_retries=1, backoff_factor=0)
+    url = f"{flaky_stub.url}/wfs/ows"
+
+    response = client.get(url, params=PARAMS)
+
+    assert response.status_code == 503
+    assert client.stats()[url]["errors"] == 1
+
+def timed_requests(client, urls, n_requests):
+    """Send n_requests to each url from one thread per url, and return the elapsed time"""
+    def send(url):
+        for _ in range(n_requests):
+            client.get(url, params={"SERVICE": "WMS", "REQUEST": "GetCapabilities"})
+
+    threads = [threading.Thread(target=send, args=(url,)) for url in urls]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+def test_rate_limit_per_endpoint(stub):
+    wfs_url = f"{stub.url}/wfs/ows"
+    wms_url = f"{stub.url}/wms-r"
+    client = GeoplateformeClient(requests_per_second=10)
+
+    elapsed = timed_requests(client, [wfs_url, wms_url], 6)
+
+    # 6 requests per endpoint at 10 per second each: 0.5 s, against 1.1 s for a limit shared by the endpoints
+    assert 0.45 < elapsed < 0.9
+
+def test_rate_limit_set_for_one_endpoint(stub):
+    wfs_url = f"{stub.url}/wfs/ows"
+    wms_url = f"{stub.url}/wms-r"
+    client = GeoplateformeClient()
+    client.set_rate_limit(wfs_url, 10)
+
+    assert timed_requests(client, [wms_url], 6) < 0.3
+    assert timed_requests(client, [wfs_url], 6) > 0.45
+
+def test_recorded_responses_replayed(stub, tmp_path):
+    recordings_dir = str(tmp_path / "recordings")
+    client = GeoplateformeClient(recorder=ResponseRecorder(recordings_dir))
+    map_params = {"SERVICE": "WMS", "REQUEST": "GetMap", "LAYERS": "ELEVATION.ELEVATIONGRIDCOVERAGE.HIGHRES", "FORMAT": "image/geotiff",
+                  "CRS": "EPSG:2154", "BBOX": "700000,6600000,700100,6600100", "WIDTH": "100", "HEIGHT": "100"}
+    recorded = client.get(f"{stub.url}/wms-r", params=map_params)
+
+    # A stub without DEM nor layers answers from the recordings only, whatever the case of the parameter names
+    replay_stub = GeoplateformeStub(port=0, recordings_dir=recordings_dir)
+    replay_stub.start()
+    try:
+        replayed = client.get(f"{replay_stub.url}/wms-r", params={name.lower(): value for name, value in map_params.items()})
+        missing = client.get(f"{replay_stub.url}/wfs/ows", params=PARAMS)
+    finally:
+        replay_stub.stop()
+
+    assert recorded.status_code == replayed.status_code == 200
+    assert replayed.content == recorded.content
+    assert replayed.headers["Content-Type"] == "image/geotiff"
+    assert missing.status_code == 404
@@ -0,0 +1,190 @@
+import geopandas as gpd
+import numpy as np
+import pytest
+import rasterio
+import shapely
+from rasterio.transform import from_origin
+from rasterio.windows import from_bounds
+from shapely.geometry import LineString, box
+
+import get_data_functions
+from conftest import X0, Y0, make_stub_layers
+
+PR_LAYER = "BDTOPO_V3:point_de_repere"
+
+def test_paged_download_matches_single_request(wfs_stub):
+    single = get_data_functions.fetch_features(PR_LAYER, filter="route='A1'")
+    get_data_functions.wfs_cache.clear()
+    paged = get_data_functions.fetch_features(PR_LAYER, filter="route='A1'", page_size=300, max_workers=3)
+
+    expected = make_stub_layers()[PR_LAYER]
+    expected = expected[expected['route'] == 'A1']
+    assert len(paged) == len(single) == len(expected) > 600
+    assert paged['cleabs'].is_unique
+    assert list(paged['cleabs']) == sorted(expected['cleabs'])
+    assert set(paged['cleabs']) == set(single['cleabs'])
+
+def test_paged_download_single_page(wfs_stub):
+    paged = get_data_functions.fetch_features(PR_LAYER, filter="route='A1'", page_size=5000)
+    assert paged['cleabs'].is_unique and len(paged) > 600
+
+def test_paged_download_failure(wfs_stub):
+    assert get_data_functions.fetch_features("BDTOPO_V3:unknown_layer", page_size=300) is None
+
+def wms_requests():
+    return get_data_functions.client.stats().get(get_data_functions.WMS_URL, {}).get("requests", 0)
+
+def read_dem_window(path, bbox):
+    with rasterio.open(path) as src:
+        window = from_bounds(*bbox, transform=src.transform)
+        data = src.read(1, window=window, boundless=True, fill_value=src.nodata)
+        data[data == src.nodata] = np.nan
+    return data
+
+def test_tiled_mnt_matches_source(wms_stub, dem_path, tmp_path):
+    bbox = (X0 + 100, Y0 - 612, X0 + 612, Y0 - 100)
+    before = wms_requests()
+
+    output_path = get_data_functions.get_mnt(bbox, "ELEVATION.ELEVATIONGRIDCOVERAGE.HIGHRES", resolution=1.0, tile_size=128,
+                                             max_workers=4, output_path=str(tmp_path / "mnt.tif"))
+
+    assert wms_requests() - before == 16
+    with rasterio.open(output_path) as src:
+        assert (src.width, src.height) == (512, 512)
+        assert src.transform == from_origin(X0 + 100, Y0 - 100, 1.0, 1.0)
+        assert src.profile["tiled"] and src.nodata == -99999.0
+        data = src.read(1)
+    np.testing.assert_array_equal(data, read_dem_window(dem_path, bbox))
+
+def test_tiled_mnt_outside_source_is_nodata(wms_stub, dem_path, tmp_path):
+    bbox = (X0 + 700, Y0 - 1000, X0 + 1000, Y0 - 700)
+
+    output_path = get_data_functions.get_mnt(bbox, "ELEVATION.ELEVATIONGRIDCOVERAGE.HIGHRES", resolution=1.0, tile_size=100,
+                                             output_path=str(tmp_path / "mnt.tif"))
+
+    with rasterio.open(output_path) as src:
+        data = src.read(1, masked=True)
+    expected = read_dem_window(dem_path, bbox)
+    np.testing.assert_array_equal(data.mask, np.isnan(expected))
+    np.testing.assert_array_equal(data.data[~data.mask], expected[~np.isnan(expected)])
+    assert data.mask[200:, :].all() and data.mask[100:140, 100:160].all()
+
+def test_corridor_mnt_only_fetches_tiles_along_the_route(wms_stub, dem_path, tmp_path):
+    lines = gpd.GeoSeries([LineString([(X0 + 100, Y0 - 100), (X0 + 700, Y0 - 700)])], crs=2154)
+    before = wms_requests()
+
+    output_path = get_data_functions.get_mnt_corridor(lines, "ELEVATION.ELEVATIONGRIDCOVERAGE.HIGHRES", buffer_distance=60,
+                                                      tile_size=64, output_path=str(tmp_path / "mnt.tif"))
+
+    with rasterio.open(output_path) as src:
+        bbox = tuple(src.bounds)
+        data = src.read(1)
+        data[data == src.nodata] = np.nan
+        # Centres of the pixels within the corridor
+        rows, cols = np.mgrid[0:src.height, 0:src.width]
+        xs, ys = rasterio.transform.xy(src.transform, rows.ravel(), cols.ravel())
+    distances = shapely.distance(shapely.points(xs, ys), lines.iloc[0]).reshape(data.shape)
+
+    n_tiles = np.ceil(data.shape[0] / 64) * np.ceil(data.shape[1] / 64)
+    assert 0 < wms_requests() - before < n_tiles / 2
+    assert bbox == pytest.approx((X0 + 40, Y0 - 760, X0 + 760, Y0 - 40))
+    expected = read_dem_window(dem_path, bbox)
+    np.testing.assert_array_equal(data[distances <= 60], expected[distances <= 60])
+    assert np.isnan(data[distances > 200]).all()
+
+def test_prefetch_route_layers(wfs_stub):
+    stub_layers = make_stub_layers()
+    road = stub_layers["BDTOPO_V3:route_numerotee_ou_nommee"].geometry.iloc[0]
+
+    layers = get_data_functions.prefetch_route_layers("A1")
+
+    assert list(layers) == ["troncon_de_route", "route_numerotee_ou_nommee", "point_de_repere", "construction_surfacique", "construction_lineaire"]
+    assert sorted(layers["troncon_de_route"]["cleabs"]) == ["TRONROUT1", "TRONROUT2"]
+    assert list(layers["route_numerotee_ou_nommee"]["numero"]) == ["A1"]
+    PR = stub_layers["BDTOPO_V3:point_de_repere"]
+    assert sorted(layers["point_de_repere"]["cleabs"]) == sorted(PR.loc[PR["route"] == "A1", "cleabs"])
+    assert list(layers["construction_lineaire"]["cleabs"]) == ["CONSLINE1"]
+    # Bridges: the 'Pont' constructions within the bounds of the 1 km buffer of the road
+    constructions = stub_layers["BDTOPO_V3:construction_surfacique"]
+    expected = constructions[(constructions["nature"] == "Pont") & constructions.intersects(box(*road.buffer(1000).bounds))]
+    assert sorted(layers["construction_surfacique"]["cleabs"]) == sorted(expected["cleabs"])
+
+def test_prefetch_route_layers_in_bbox(wfs_stub):
+    bbox = (X0, Y0, X0 + 2000, Y0 + 2000)
+
+    layers = get_data_functions.prefetch_route_layers("A1", bbox)
+
+    assert sorted(layers["troncon_de_route"]["cleabs"]) == ["TRONROUT1"]
+    PR = make_stub_layers()["BDTOPO_V3:point_de_repere"]
+    inside = PR[(PR["route"] == "A1") & PR.intersects(box(*get_data_functions.shrink_bbox(bbox)))]
+    assert 0 < len(layers["point_de_repere"]) < (PR["route"] == "A1").sum()
+    assert sorted(layers["point_de_repere"]["cleabs"]) == sorted(inside["cleabs"])
+
+def test_get_data_filters_on_the_server(wfs_stub):
+    bbox = (X0, Y0, X0 + 2000, Y0 + 2000)
+    wfs_url = get_data_functions.WFS_URL
+    before = get_data_functions.client.stats().get(wfs_url, {}).get("bytes", 0)
+
+    gdf = get_data_functions.get_data("route='A1'", PR_LAYER, bbox)
+
+    sent = get_data_functions.client.stats()[wfs_url]["bytes"] - before
+    PR = make_stub_layers()[PR_LAYER]
+    inside = PR[(PR["route"] == "A1") & PR.intersects(box(*get_data_functions.shrink_bbox(bbox)))]
+    assert sorted(gdf["cleabs"]) == sorted(inside["cleabs"])
+    # Only the features in the bbox were sent: about 200 bytes per point feature
+    assert 0 < len(inside) < len(PR) / 4
+    assert sent < 400 * len(inside)
+    assert gdf.total_bounds[0] >= X0 + 100 and gdf.total_bounds[3] <= Y0 + 1900
+
+@pytest.fixture
+def stored_wfs_stub(wfs_stub, monkeypatch, tmp_path):
+    """wfs_stub with get_data_functions reading through a LayerStore in tmp_path"""
+    from layer_store import LayerStore
+    monkeypatch.setattr(get_data_functions, "layer_store", LayerStore(root=str(tmp_path / "store")))
+    return wfs_stub
+
+def test_prefetch_through_layer_store(stored_wfs_stub):
+    bbox = (X0, Y0, X0 + 2000, Y0 + 2000)
+    wfs_url = get_data_functions.WFS_URL
+
+    first = get_data_functions.prefetch_route_layers("A1", bbox)
+    requests_before = get_data_functions.client.stats()[wfs_url]["requests"]
+    second = get_data_functions.prefetch_route_layers("A1", bbox)
+
+    # Troncons and PR come from the store the second time; only the road is requested again
+    # (the bridges are also read from the store, and the WFS cache answers the road request)
+    assert get_data_functions.client.stats()[wfs_url]["requests"] == requests_before
+    PR = make_stub_layers()[PR_LAYER]
+    inside = PR[(PR["route"] == "A1") & PR.intersects(box(*get_data_functions.shrink_bbox(bbox)))]
+    for layers in (first, second):
+        assert sorted(layers["point_de_repere"]["cleabs"]) == sorted(inside["cleabs"])
+        assert list(layers["troncon_de_route"]["cleabs"]) == ["TRONROUT1"]
+
+def test_get_ponts_without_features_in_the_store(stored_wfs_stub):
+    road = gpd.GeoDataFrame(geometry=[LineString([(X0 + 20000, Y0), (X0 + 21000, Y0)])], crs=2154)
+
+    ponts = get_data_functions.get_ponts(None, "BDTOPO_V3:construction_surfacique", road)
+
+    assert ponts is not None and ponts.empty
+
+def test_cog_conversion(wms_stub, dem_path, tmp_path):
+    bbox = (X0 + 100, Y0 - 900, X0 + 900, Y0 - 100)
+
+    cog_path = get_data_functions.get_mnt(bbox, "ELEVATION.ELEVATIONGRIDCOVERAGE.HIGHRES", resolution=1.0, tile_size=400,
+                                          output_path=str(tmp_path / "mnt.tif"), cog=True)
+
+    assert cog_path == str(tmp_path / "mnt_cog.tif")
+    with rasterio.open(tmp_path / "mnt.tif") as src:
+        expected = src.read(1)
+    with rasterio.open(cog_path) as src:
+        assert src.tags(ns="IMAGE_STRUCTURE").get("LAYOUT") == "COG"
+        assert src.profile["tiled"] and src.block_shapes[0] == (512, 512)
+        assert src.compression.name == "deflate"
+        assert src.overviews(1) == [2]
+        assert src.dtypes[0] == "float32" and src.nodata == -99999.0
+        np.testing.assert_array_equal(src.read(1), expected)
+
+    # Skipped while the source is unchanged
+    modified = (tmp_path / "mnt_cog.tif").stat().st_mtime_ns
+    assert get_data_functions.convert_to_cog(str(tmp_path / "mnt.tif")) == cog_path
+    assert (tmp_path / "mnt_cog.tif").stat().st_mtime_ns == modified
@@ -0,0 +1,107 @@
+import json
+import os
+
+import geopandas as gpd
+from shapely.geometry import LineString, Point, box
+
+from layer_store import LayerStore
+
+FEATURES = gpd.GeoDataFrame(
+    {
+        "cleabs": ["PR1", "PR2", "PR3", "TRONCON1"],
+        "route": ["A1", "A1", "A6", "A1"]
+    },
+    geometry=[Point(1000, 1000), Point(6000, 1000), Point(1200, 1500), LineString([(4000, 4000), (6000, 6000)])],
+    crs="EPSG:2154"
+)
+
+class FakeWFS:
+    """fetch callable of LayerStore.get_features over FEATURES, recording its calls"""
+    def __init__(self, features=FEATURES):
+        self.features = features
+        self.calls = []
+
+    def __call__(self, filter, bbox):
+        self.calls.append((filter, tuple(bbox)))
+        features = self.features[self.features.intersects(box(*bbox))]
+        if filter:
+            attribute, value = filter.split("=")
+            features = features[features[attribute] == value.strip("'")]
+        return features.reset_index(drop=True)
+
+def test_missing_tiles_fetched_once(tmp_path):
+    store = LayerStore(root=str(tmp_path))
+    fetch = FakeWFS()
+
+    first = store.get_features("BDTOPO_V3:point_de_repere", None, (0, 0, 7000, 7000), fetch)
+    second = store.get_features("BDTOPO_V3:point_de_repere", None, (500, 500, 6500, 6500), fetch)
+
+    assert len(fetch.calls) == 4
+    assert sorted(first["cleabs"]) == sorted(FEATURES["cleabs"])
+    assert sorted(second["cleabs"]) == sorted(FEATURES["cleabs"])
+
+def test_bbox_and_attribute_filter_applied_on_read(tmp_path):
+    store = LayerStore(root=str(tmp_path))
+    fetch = FakeWFS()
+
+    features = store.get_features("BDTOPO_V3:point_de_repere", "route='A1'", (0, 0, 3000, 3000), fetch)
+
+    # Shared layers are fetched without filter, which is applied when reading the tiles
+    assert fetch.calls == [(None, (0, 0, 5000, 5000))]
+    assert list(features["cleabs"]) == ["PR1"]
+
+def test_filtered_layer_partition(tmp_path):
+    store = LayerStore(root=str(tmp_path))
+    fetch = FakeWFS()
+
+    features = store.get_features("BDTOPO_V3:troncon_de_route", "route='A6'", (0, 0, 3000, 3000), fetch)
+
+    assert fetch.calls == [("route='A6'", (0, 0, 5000, 5000))]
+    assert list(features["cleabs"]) == ["PR3"]
+
+def test_features_deduplicated_across_tiles(tmp_path):
+    store = LayerStore(root=str(tmp_path))
+
+    features = store.get_features("BDTOPO_V3:point_de_repere", None, (4000, 4000, 6000, 6000), FakeWFS())
+
+    assert list(features["cleabs"]) == ["TRONCON1"]
+    assert len([name for name in os.listdir(tmp_path / "point_de_repere" / "all") if name.endswith(".parquet")]) == 4
+
+def test_expired_tiles_refetched(tmp_path):
+    store = LayerStore(root=str(tmp_path), max_age_days=30)
+    fetch = FakeWFS()
+    store.get_features("BDTOPO_V3:point_de_repere", None, (0, 0, 4999, 4999), fetch)
+
+    coverage_path = tmp_path / "point_de_repere" / "all" / "_coverage.json"
+    coverage = json.loads(coverage_path.read_text())
+    coverage["0_0"]["fetched"] -= 40 * 24 * 3600
+    coverage_path.write_text(json.dumps(coverage))
+
+    # The features have disappeared from the server since the first fetch
+    fetch.features = FEATURES.iloc[:0]
+    features = store.get_features("BDTOPO_V3:point_de_repere", None, (0, 0, 4999, 4999), fetch)
+
+    assert len(fetch.calls) == 2
+    assert features.empty
+    assert not (tmp_path / "point_de_repere" / "all" / "tile_0_0.parquet").exists()
+
+def test_no_expiry(tmp_path):
+    store = LayerStore(root=str(tmp_path), max_age_days=None)
+    fetch = FakeWFS()
+    store.get_features("BDTOPO_V3:point_de_repere", None, (0, 0, 4999, 4999), fetch)
+
+    coverage_path = tmp_path / "point_de_repere" / "all" / "_coverage.json"
+    coverage = json.loads(coverage_path.read_text())
+    coverage["0_0"]["fetched"] -= 400 * 24 * 3600
+    coverage_path.write_text(json.dumps(coverage))
+    store.get_features("BDTOPO_V3:point_de_repere", None, (0, 0, 4999, 4999), fetch)
+
+    assert len(fetch.calls) == 1
+
+def test_failed_fetch(tmp_path):
+    store = LayerStore(root=str(tmp_path))
+
+    features = store.get_features("BDTOPO_V3:point_de_repere", None, (0, 0, 4999, 4999), lambda filter, bbox: None)
+
+    assert features is None
+    assert json.loads((tmp_path / "point_de_repere" / "all" / "_coverage.json").read_text()) == {}
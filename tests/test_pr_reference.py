@@ -0,0 +1,134 @@
+import geopandas as gpd
+import numpy as np
+import pytest
+from shapely.geometry import LineString, Point
+
+from pr_reference import PRReference
+
+def is_convertible_to_int(x):
+    try:
+        int(str(x))
+        return True
+    except ValueError:
+        return False
+
+def find_closest_PR(point, PR_points, buffer_dist=1500, n_nearest=2):
+    """
+    Rule of the former find_closest_PR of SegmentConstructor, one point at a time: among the PR with an integer
+    numero in a box of buffer_dist m around the point, the smallest number among the n_nearest closest
+    """
+    possible_matches = PR_points.cx[point.x - buffer_dist:point.x + buffer_dist, point.y - buffer_dist:point.y + buffer_dist]
+    possible_matches = possible_matches[possible_matches['numero'].apply(is_convertible_to_int)]
+    if possible_matches.empty:
+        return None
+    possible_matches = possible_matches.loc[possible_matches.distance(point).nsmallest(n_nearest).index]
+    candidates = sorted(((row, int(row['numero'])) for _, row in possible_matches.iterrows()), key=lambda candidate: candidate[1])
+    return candidates[0][0]
+
+def make_route(seed):
+    """Winding route of a few km with a PR every km or so on either side of it, some beyond its ends, and a PR bis"""
+    rng = np.random.default_rng(seed)
+    headings = np.cumsum(rng.normal(0, 0.15, 60))
+    steps = 120 * np.column_stack([np.cos(headings), np.sin(headings)])
+    line = LineString(np.cumsum(steps, axis=0) + [700000, 6600000])
+
+    measures = np.arange(-2500, line.length + 2500, 1000) + rng.uniform(-300, 300, int(np.ceil((line.length + 5000) / 1000)))
+    points = []
+    for measure in measures:
+        base = line.interpolate(np.clip(measure, 0, line.length))
+        extra = max(-measure, measure - line.length, 0)
+        points.append(Point(base.x + rng.normal(0, 25) + extra * rng.choice([-1, 1]), base.y + rng.normal(0, 25)))
+    numeros = [str(k) for k in range(len(points))]
+    numeros[3] = "3b"
+    PR_points = gpd.GeoDataFrame(
+        {
+            'numero': numeros,
+            'cote': rng.choice(['D', 'G'], len(points)),
+            'libelle': [f"PR{numero}" for numero in numeros]
+        },
+        geometry=points,
+        crs=2154
+    ).sample(frac=1, random_state=seed)
+    return line, PR_points
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("n_nearest", [2, 4])
+def test_reference_matches_find_closest_PR(seed, n_nearest):
+    line, PR_points = make_route(seed)
+    reference = PRReference(line, PR_points, n_nearest=n_nearest)
+    measures = np.random.default_rng(seed).uniform(0, line.length, 300)
+
+    positions, abscisses = reference.abscisses(measures)
+
+    for measure, position, abscisse in zip(measures, positions, abscisses):
+        expected = find_closest_PR(line.interpolate(measure), PR_points, n_nearest=n_nearest)
+        if expected is None:
+            assert position == -1 and np.isnan(abscisse)
+            continue
+        row = reference.table.iloc[position]
+        assert row['libelle'] == expected['libelle']
+        assert abscisse == pytest.approx(measure - line.project(expected.geometry))
+
+def test_non_integer_numero_is_excluded():
+    line, PR_points = make_route(0)
+    reference = PRReference(line, PR_points)
+    assert "3b" not in set(reference.table['numero'])
+    assert len(reference.table) == len(PR_points) - 1
+    assert np.all(np.diff(reference.table['measure']) >= 0)
+
+def test_no_PR_in_range():
+    line = LineString([(0, 0), (1000, 0)])
+    PR_points = gpd.GeoDataFrame({'numero': ['1', '2'], 'cote': ['D', 'D'], 'libelle': ['PR1', 'PR2']},
+                                 geometry=[Point(5000, 0), Point(6000, 0)], crs=2154)
+    reference = PRReference(line, PR_points)
+
+    positions, abscisses = reference.abscisses([0, 500, 1000])
+    assert list(positions) == [-1, -1, -1]
+    assert np.isnan(abscisses).all()
+    assert reference.reference(500) == (None, None)
+
+    # PR1 is 4000 m from the end of the line: found with a wider search box
+    row, abscisse = PRReference(line, PR_points, search_distance=4500).reference(1000)
+    assert row['libelle'] == 'PR1' and abscisse == 0
+
+def test_empty_table():
+    line = LineString([(0, 0), (1000, 0)])
+    PR_points = gpd.GeoDataFrame({'numero': ['1bis'], 'cote': ['D'], 'libelle': ['PR1bis']}, geometry=[Point(10, 0)], crs=2154)
+    reference = PRReference(line, PR_points)
+
+    positions, abscisses = reference.abscisses([0, 500])
+    assert list(positions) == [-1, -1]
+    assert np.isnan(abscisses).all()
+
+def test_dense_PR_beyond_the_search_box():
+    # PR every 5 m of a parallel road 3 km away, between the PR of the route every km
+    line = LineString([(0, 0), (10000, 0)])
+    far_x = np.arange(0, 10000, 5.0)
+    near_x = np.arange(500, 10000, 1000.0)
+    xs = np.concatenate([far_x, near_x])
+    ys = np.concatenate([np.full(len(far_x), 3000.0), np.full(len(near_x), 20.0)])
+    numeros = [str(k) for k in range(1000, 1000 + len(far_x))] + [str(k) for k in range(len(near_x))]
+    PR_points = gpd.GeoDataFrame({'numero': numeros, 'cote': ['D'] * len(xs), 'libelle': [f"PR{numero}" for numero in numeros]},
+                                 geometry=gpd.points_from_xy(xs, ys), crs=2154)
+    measures = np.random.default_rng(0).uniform(0, line.length, 500)
+
+    reference = PRReference(line, PR_points, max_candidates=10000)
+    positions, abscisses = reference.abscisses(measures)
+
+    for measure, position, abscisse in zip(measures, positions, abscisses):
+        expected = find_closest_PR(line.interpolate(measure), PR_points)
+        assert position >= 0 and int(expected['numero']) < 1000
+        assert reference.table.iloc[position]['libelle'] == expected['libelle']
+        assert abscisse == pytest.approx(measure - expected.geometry.x)
+
+def test_route_looping_back_within_the_search_box():
+    # Hairpin: PR1, on the way back 2.2 km farther along the line, is 210 m from the start of the route
+    line = LineString([(0, 0), (1000, 0), (1000, 200), (0, 200)])
+    PR_points = gpd.GeoDataFrame({'numero': ['1', '5'], 'cote': ['D', 'D'], 'libelle': ['PR1', 'PR5']},
+                                 geometry=[Point(0, 210), Point(990, 10)], crs=2154)
+
+    row, abscisse = PRReference(line, PR_points, search_distance=1200).reference(0)
+
+    # The former rule took the smallest number of the two PR in the box; PR1 is not a candidate by measure
+    assert find_closest_PR(Point(0, 0), PR_points, buffer_dist=1200)['libelle'] == 'PR1'
+    assert row['libelle'] == 'PR5' and abscisse == pytest.approx(-990)
@@ -0,0 +1,120 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+from shapely.geometry import LineString, MultiLineString, Point
+
+from segments_constructor import SegmentConstructor
+from stations import StationLine
+
+COMPARED_COLUMNS = ['classification', 'PR_start', 'PR_end', 'abcisse_start', 'abcisse_end', 'nom', 'route']
+
+def make_constructor(lines, seed=0, with_PR=True):
+    """
+    SegmentConstructor over a classified profile every meter of each line, by runs of 50 m of the same classification,
+    with a 10 m hole in the profiles of the first line and a PR every km; without WFS requests
+    """
+    rng = np.random.default_rng(seed)
+    frames = []
+    PR_points = []
+    for line in lines:
+        station_line = StationLine(line)
+        distances = np.arange(0, np.floor(line.length) + 1)
+        points = station_line.points(distances) + rng.normal(0, 0.2, (len(distances), 2))
+        classifications = np.repeat(rng.choice(['remblai', 'deblai', 'rasant'], size=len(distances) // 50 + 1), 50)[:len(distances)]
+        slopes_section = rng.uniform(0, 1, len(distances))
+        slopes_section[::7] = np.nan
+        frames.append(gpd.GeoDataFrame(
+            {
+                'classification': classifications,
+                'max_height_difference': rng.uniform(0, 5, len(distances)),
+                'slope_ouvrage_section': slopes_section,
+                'slope_ouvrage_total': rng.uniform(0, 1, len(distances))
+            },
+            geometry=gpd.points_from_xy(points[:, 0], points[:, 1]),
+            crs=2154
+        ))
+        PR_points.extend(Point(point) for point in station_line.points(np.arange(0, line.length, 1000)))
+    frames[0] = frames[0].drop(frames[0].index[700:710])
+    profiles = gpd.GeoDataFrame(pd.concat(frames, ignore_index=True), crs=2154)
+
+    numeros = [str(k) for k in range(len(PR_points))] if with_PR else []
+    PR_route = gpd.GeoDataFrame(
+        {'numero': numeros, 'cote': ['D'] * len(numeros), 'libelle': [f"PR{numero}D" for numero in numeros]},
+        geometry=PR_points if with_PR else [],
+        crs=2154
+    )
+
+    constructor = SegmentConstructor.__new__(SegmentConstructor)
+    constructor.classified_profiles = profiles
+    constructor.current_crs = profiles.crs
+    constructor.route_number = 'A1'
+    constructor.route = gpd.GeoDataFrame(geometry=[MultiLineString(lines)], crs=2154)
+    constructor.PR_route = PR_route
+    constructor.spatial_index = profiles.sindex
+    return constructor
+
+ROUTE = [LineString([(0, 0), (750, 50), (1500, 0)])]
+PARTS = [
+    LineString([(0, 0), (750, 50), (1500, 0)]),
+    LineString([(0, 500), (600, 500)]),
+    LineString([(0, 1000), (300, 1200), (900, 1000)])
+]
+
+def test_linear_referencing_matches_loop():
+    constructor = make_constructor(ROUTE)
+
+    loop = constructor.construct_segments()
+    linear = constructor.construct_segments(linear_referencing=True)
+
+    assert len(loop) == len(linear) > 20
+    for column in COMPARED_COLUMNS:
+        assert list(loop[column]) == list(linear[column]), column
+    # The loop counts the meters of the route, linear referencing the meters covered by the profiles
+    assert np.abs(loop['length'].to_numpy() - linear['length'].to_numpy()).max() <= 2
+    np.testing.assert_allclose(loop['hauteur_max'], linear['hauteur_max'], rtol=0.1)
+
+def test_workers_match_sequential():
+    constructor = make_constructor(PARTS, seed=1)
+
+    sequential = constructor.construct_segments(linear_referencing=True)
+    parallel = constructor.construct_segments(linear_referencing=True, workers=2)
+
+    assert len(sequential) == len(parallel)
+    assert sequential.geometry.geom_equals_exact(parallel.geometry, 1e-9).all()
+    for column in sequential.columns.drop('geometry'):
+        assert sequential[column].equals(parallel[column]), column
+
+def test_segment_statistics():
+    constructor = make_constructor(ROUTE)
+    profiles = constructor.classified_profiles
+    profiles['interpolated'] = False
+    profiles.loc[[0, 1], 'interpolated'] = True
+    profiles.loc[[2, 3], 'max_height_difference'] = [10.0, 20.0]
+    profiles.loc[[2, 3], 'slope_ouvrage_section'] = [np.nan, 0.5]
+    profiles.loc[[2, 3], 'slope_ouvrage_total'] = [0.25, 0.75]
+    profiles.loc[[4, 5], ['max_height_difference', 'slope_ouvrage_section', 'slope_ouvrage_total']] = np.nan
+
+    stats = constructor.segment_statistics(np.arange(6), [0, 0, 0, 0, 1, 1], 3)
+
+    # Interpolated profiles are not counted; the slope is the section slope, or the total slope without it
+    assert stats.loc[0, 'nb_profils'] == 2
+    assert stats.loc[0, 'hauteur_max'] == 20 and stats.loc[0, 'hauteur_moyenne'] == 15
+    assert stats.loc[0, 'pente_max'] == 0.5 and stats.loc[0, 'pente_moyenne'] == pytest.approx(0.375)
+    assert stats.loc[0, 'hauteur_p50'] == 15
+    # Segments without any value keep NaN aggregates and zero counts
+    assert stats.loc[1, 'nb_profils'] == 2 and stats.loc[1, 'nb_hauteurs'] == 0 and stats.loc[1, 'nb_pentes'] == 0
+    assert stats.loc[2, 'nb_profils'] == 0
+    for segment in (1, 2):
+        assert stats.loc[segment, ['hauteur_max', 'pente_max', 'hauteur_moyenne', 'pente_moyenne', 'hauteur_p90', 'pente_p90']].isna().all()
+
+@pytest.mark.parametrize("linear_referencing", [False, True])
+def test_segments_without_PR_skipped(linear_referencing, capsys):
+    constructor = make_constructor(ROUTE, with_PR=False)
+
+    segments = constructor.construct_segments(linear_referencing=linear_referencing)
+
+    assert segments.empty
+    output = capsys.readouterr().out
+    assert "Aucun point de repère trouvé" in output
+    assert "Erreur" not in output
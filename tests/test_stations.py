@@ -0,0 +1,50 @@
+import math
+
+import numpy as np
+import shapely
+from shapely.geometry import LineString
+
+from stations import StationLine, perpendicular_lines, perpendicular_transects
+
+def winding_line(seed=0, n_vertices=30):
+    rng = np.random.default_rng(seed)
+    steps = rng.normal(0, 40, (n_vertices, 2)) + [30, 5]
+    # A repeated vertex gives a zero-length segment
+    steps[5] = 0
+    return LineString(np.cumsum(steps, axis=0) + [700000, 6600000])
+
+def loop_perpendicular_line(distance, line):
+    """Perpendicular transect of the station loop of analyze_profile, one station at a time"""
+    if distance <= 15:
+        from_point, to_point = line.interpolate(distance), line.interpolate(distance + 10)
+    else:
+        from_point, to_point = line.interpolate(distance - 10), line.interpolate(distance)
+    angle = math.degrees(math.atan2(to_point.y - from_point.y, to_point.x - from_point.x))
+    centre = line.interpolate(distance)
+    dx = 60 * math.cos(math.radians(angle + 90))
+    dy = 60 * math.sin(math.radians(angle + 90))
+    return LineString([(centre.x - dx, centre.y - dy), (centre.x + dx, centre.y + dy)])
+
+def test_points_match_interpolate():
+    line = winding_line()
+    distances = np.concatenate([np.arange(0, math.floor(line.length) + 1), [-5.5, -line.length - 10, line.length + 10, 0.25]])
+
+    points = StationLine(line).points(distances)
+
+    expected = shapely.get_coordinates(shapely.line_interpolate_point(line, distances))
+    assert np.array_equal(points, expected)
+
+def test_transects_match_loop():
+    line = winding_line(seed=3)
+    distances = np.arange(0, math.floor(line.length) + 1, dtype="float64")
+
+    centres, starts, ends = perpendicular_transects(line, distances)
+    transects = perpendicular_lines(StationLine(line), distances)
+
+    expected = [loop_perpendicular_line(distance, line) for distance in distances]
+    expected_coords = np.array([shapely.get_coordinates(transect) for transect in expected])
+    np.testing.assert_allclose(starts, expected_coords[:, 0], rtol=0, atol=1e-9)
+    np.testing.assert_allclose(ends, expected_coords[:, 1], rtol=0, atol=1e-9)
+    np.testing.assert_allclose(shapely.get_coordinates(transects).reshape(-1, 2, 2), expected_coords, rtol=0, atol=1e-9)
+    assert np.array_equal(centres, shapely.get_coordinates(shapely.line_interpolate_point(line, distances)))
+    np.testing.assert_allclose(shapely.length(transects), 120)
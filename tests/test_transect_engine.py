@@ -0,0 +1,190 @@
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+from shapely.geometry import LineString
+
+from conftest import X0, Y0
+from dem_reader import MemmapDEM
+from segments_constructor import SegmentConstructor
+from transect_engine import LinearFit, band_mask, fit_lines, transect_coordinates
+
+NUMERIC_COLUMNS = [
+    'height_difference_nat_terrain', 'average_height_route', 'interpolated_height_nat_terrain_route', 'num_voies',
+    'largeur_route', 'max_height_difference', 'slope_ouvrage_total', 'slope_ouvrage_section', 'slope_ouvrage_middle'
+]
+
+def test_fit_lines_matches_polyfit():
+    rng = np.random.default_rng(0)
+    x = np.tile(np.arange(40, dtype="float64"), (50, 1))
+    y = 3 + 0.2 * x * rng.normal(1, 0.3, (50, 1)) + rng.normal(0, 0.5, x.shape)
+    valid = rng.random(x.shape) > 0.2
+
+    coefs, intercepts, r2 = fit_lines(x, y, valid)
+
+    for k in range(len(x)):
+        coef, intercept = np.polyfit(x[k][valid[k]], y[k][valid[k]], 1)
+        residuals = y[k][valid[k]] - (coef * x[k][valid[k]] + intercept)
+        expected_r2 = 1 - (residuals ** 2).sum() / ((y[k][valid[k]] - y[k][valid[k]].mean()) ** 2).sum()
+        assert coefs[k] == pytest.approx(coef)
+        assert intercepts[k] == pytest.approx(intercept)
+        assert r2[k] == pytest.approx(expected_r2)
+
+def test_fit_lines_degenerate_rows():
+    x = np.tile(np.arange(5, dtype="float64"), (4, 1))
+    y = np.array([[1.0] * 5, [1, 2, 3, 4, 5], [1, 2, 3, 4, 5], [1, 2, 3, 4, 5]])
+    valid = np.array([[True] * 5, [False] * 5, [True] + [False] * 4, [True] * 5])
+
+    coefs, intercepts, r2 = fit_lines(x, y, valid)
+
+    assert coefs[0] == 0 and intercepts[0] == 1 and r2[0] == 1
+    assert np.isnan(coefs[1]) and np.isnan(intercepts[1]) and np.isnan(r2[1])
+    assert coefs[2] == 0 and intercepts[2] == 1 and np.isnan(r2[2])
+    assert LinearFit(coefs[3], intercepts[3]).predict([10])[0, 0] == pytest.approx(11)
+
+def test_transect_coordinates_clamped_to_transect():
+    starts = np.array([[0.0, 0.0], [10.0, 10.0]])
+    ends = np.array([[0.0, 120.0], [10.0, 70.0]])
+
+    coords = transect_coordinates(starts, ends, np.array([0.0, 30.0, 90.0]))
+
+    np.testing.assert_allclose(coords[0], [[0, 0], [0, 30], [0, 90]])
+    np.testing.assert_allclose(coords[1], [[10, 10], [10, 40], [10, 70]])
+
+def test_band_mask_matches_arange():
+    positions = np.arange(0, 121, 0.5)
+    assert np.array_equal(positions[band_mask(positions, 12, 40)], np.arange(12, 41))
+    assert np.array_equal(positions[band_mask(positions, 12.5, 40)], np.arange(12.5, 40))
+    assert np.array_equal(positions[band_mask(positions, 5, 5)], [5.0])
+
+def test_vectorized_profile_matches_station_loop(make_analyzer):
+    loop_analyzer = make_analyzer()
+    loop_points, loop_calculation_points = loop_analyzer.analyze_profile()
+    vectorized_analyzer = make_analyzer()
+    vectorized_points, vectorized_calculation_points = vectorized_analyzer.analyze_profile(vectorized=True)
+
+    assert len(loop_points) == len(vectorized_points)
+    assert set(loop_points['classification']) == {'remblai', 'deblai', 'rasant'}
+    assert (loop_points['classification'] == vectorized_points['classification']).all()
+    assert (loop_points['num_route'] == vectorized_points['num_route']).all()
+    assert not vectorized_points['interpolated'].any()
+    assert loop_points.geometry.geom_equals_exact(vectorized_points.geometry, 1e-9).all()
+
+    for column in NUMERIC_COLUMNS:
+        np.testing.assert_allclose(
+            loop_points[column].astype(float), vectorized_points[column].astype(float),
+            rtol=1e-9, atol=1e-9, err_msg=column
+        )
+    assert loop_points.loc[loop_points['classification'] == 'rasant', 'slope_ouvrage_middle'].isna().all()
+
+    assert len(loop_calculation_points) == len(vectorized_calculation_points)
+    assert loop_calculation_points.geometry.geom_equals_exact(vectorized_calculation_points.geometry, 1e-9).all()
+    for column in ['elevation', 'slope', 'distance']:
+        np.testing.assert_allclose(
+            loop_calculation_points[column].astype(float), vectorized_calculation_points[column].astype(float),
+            rtol=1e-9, atol=1e-9, err_msg=column
+        )
+
+    loop_r2 = pd.DataFrame(loop_analyzer.r2_scores)
+    vectorized_r2 = pd.DataFrame(vectorized_analyzer.r2_scores)
+    assert len(loop_r2) == len(vectorized_r2) == len(loop_points)
+    np.testing.assert_allclose(loop_r2.to_numpy(dtype=float), vectorized_r2.to_numpy(dtype=float), rtol=1e-9, atol=1e-9)
+
+def test_parallel_chunks_match_sequential(make_analyzer, tmp_path):
+    sequential_points, _ = make_analyzer().analyze_profile(vectorized=True)
+    chunked_analyzer = make_analyzer()
+    chunked_analyzer.dem_cache_dir = str(tmp_path)
+    chunked_points, _ = chunked_analyzer.analyze_profile(vectorized=True, workers=2, chunk_length=150)
+
+    # The DEM read in memory is shared with the workers as a memory-mapped copy
+    assert chunked_analyzer.dem_mode == "memmap" and isinstance(chunked_analyzer.dem_source, MemmapDEM)
+    assert (tmp_path / "mnt.npy").exists()
+
+    assert (sequential_points['classification'] == chunked_points['classification']).all()
+    assert sequential_points.geometry.geom_equals_exact(chunked_points.geometry, 1e-9).all()
+    np.testing.assert_allclose(
+        sequential_points['height_difference_nat_terrain'].astype(float), chunked_points['height_difference_nat_terrain'].astype(float)
+    )
+
+def test_streaming_output_matches_in_memory(make_analyzer):
+    points, calculation_points = make_analyzer().analyze_profile(vectorized=True)
+    streaming_analyzer = make_analyzer()
+
+    output_file = streaming_analyzer.analyze_profile_streaming(chunk_length=150)
+
+    streamed_points = gpd.read_file(output_file, layer='points')
+    streamed_calculation_points = gpd.read_file(output_file, layer='calculation_points')
+    assert len(streamed_points) == len(points) and len(streamed_calculation_points) == len(calculation_points)
+    assert (streamed_points['classification'] == points['classification']).all()
+    assert streamed_points.geometry.geom_equals_exact(points.geometry, 1e-6).all()
+    for column in NUMERIC_COLUMNS:
+        np.testing.assert_allclose(streamed_points[column].astype(float), points[column].astype(float), rtol=1e-9, err_msg=column)
+    for column in ['elevation', 'slope', 'distance']:
+        np.testing.assert_allclose(streamed_calculation_points[column], calculation_points[column].astype(float), rtol=1e-9, err_msg=column)
+    r2_scores = pd.read_csv(os.path.join(streaming_analyzer.output_folder, "r2_scores_A1.csv"))
+    assert len(r2_scores) == len(points)
+    assert not streaming_analyzer.r2_scores
+
+@pytest.mark.parametrize("profile_type", ["deblai", "remblai"])
+def test_station_attributes_over_nodata(make_analyzer, profile_type):
+    analyzer = make_analyzer()
+    # Transect crossing the nodata hole of the DEM between 30 and 90 m
+    perpendicular_line = LineString([(X0 + 770, Y0 - 820), (X0 + 890, Y0 - 820)])
+    reg = LinearFit(0.1, 100.0)
+
+    calculate_attributes = analyzer.calculate_attributes_deblai if profile_type == "deblai" else analyzer.calculate_attributes_remblai
+    slope_total, slope_section, slope_middle, height_difference, calculation_points = calculate_attributes(perpendicular_line, reg, 0.1)
+
+    assert slope_total is None and height_difference is None
+    assert all(np.isfinite(point['elevation']) for point in calculation_points)
+
+def test_adaptive_spacing_flags_interpolated_stations(make_analyzer):
+    full_points, _ = make_analyzer().analyze_profile(vectorized=True)
+    adaptive_points, _ = make_analyzer().analyze_profile(vectorized=True, coarse_step=25)
+
+    assert len(adaptive_points) == len(full_points)
+    assert full_points.geometry.geom_equals_exact(adaptive_points.geometry, 1e-9).all()
+
+    interpolated = adaptive_points['interpolated']
+    assert interpolated.any() and not interpolated.all()
+    analyzed = ~interpolated
+    assert (adaptive_points.loc[analyzed, 'classification'] == full_points.loc[analyzed, 'classification']).all()
+    np.testing.assert_allclose(
+        adaptive_points.loc[analyzed, 'height_difference_nat_terrain'].astype(float),
+        full_points.loc[analyzed, 'height_difference_nat_terrain'].astype(float)
+    )
+    # Only rasant stations are interpolated: every remblai and deblai station, and its neighbours, is analyzed
+    ouvrage = (full_points['classification'] != 'rasant').to_numpy()
+    next_to_ouvrage = ouvrage | np.roll(ouvrage, 1) | np.roll(ouvrage, -1)
+    assert not interpolated[next_to_ouvrage].any()
+    assert (adaptive_points.loc[interpolated, 'classification'] == 'rasant').all()
+    for column in NUMERIC_COLUMNS:
+        np.testing.assert_allclose(
+            adaptive_points.loc[analyzed, column].astype(float), full_points.loc[analyzed, column].astype(float), rtol=1e-9, err_msg=column
+        )
+    for column in ['max_height_difference', 'slope_ouvrage_total', 'slope_ouvrage_section', 'slope_ouvrage_middle']:
+        assert adaptive_points.loc[interpolated, column].isna().all()
+
+def test_adaptive_spacing_segment_statistics_match_dense(make_analyzer):
+    full_points, _ = make_analyzer().analyze_profile(vectorized=True)
+    adaptive_points, _ = make_analyzer().analyze_profile(vectorized=True, coarse_step=25)
+
+    # Segments: the runs of stations of the same classification of the dense analysis
+    classifications = full_points['classification'].to_numpy()
+    segment_ids = np.concatenate([[0], np.cumsum(classifications[1:] != classifications[:-1])])
+    n_segments = segment_ids[-1] + 1
+    statistics = {}
+    for name, points in (("dense", full_points), ("adaptive", adaptive_points)):
+        constructor = SegmentConstructor.__new__(SegmentConstructor)
+        constructor.classified_profiles = points
+        statistics[name] = constructor.segment_statistics(np.arange(len(points)), segment_ids, n_segments)
+
+    ouvrage_segments = np.unique(segment_ids[classifications != 'rasant'])
+    assert len(ouvrage_segments) > 2
+    pd.testing.assert_frame_equal(statistics["adaptive"].loc[ouvrage_segments], statistics["dense"].loc[ouvrage_segments])
+    # Rasant segments have no ouvrage attributes either way; only their number of measured profiles differs
+    rasant_segments = np.setdiff1d(np.arange(n_segments), ouvrage_segments)
+    assert (statistics["adaptive"].loc[rasant_segments, 'nb_hauteurs'] == 0).all()
+    assert (statistics["adaptive"].loc[rasant_segments, 'nb_profils'] <= statistics["dense"].loc[rasant_segments, 'nb_profils']).all()
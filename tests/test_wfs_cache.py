@@ -0,0 +1,78 @@
+import os
+import threading
+
+import geopandas as gpd
+from shapely.geometry import Point
+
+from wfs_cache import WFSCache
+
+def make_gdf(n=1):
+    return gpd.GeoDataFrame({'numero': [str(k) for k in range(n)]}, geometry=[Point(k, k) for k in range(n)], crs=2154)
+
+def test_key_depends_on_endpoint():
+    cache = WFSCache(enabled=False)
+    args = ("BDTOPO_V3:point_de_repere", "route='A1'", (0, 0, 1000, 1000))
+
+    assert cache.make_key(*args, url="https://data.geopf.fr/wfs/ows") == cache.make_key(*args, url="https://data.geopf.fr/wfs/ows")
+    assert cache.make_key(*args, url="https://data.geopf.fr/wfs/ows") != cache.make_key(*args, url="http://127.0.0.1:8765/wfs")
+    assert cache.make_key(*args) != cache.make_key("BDTOPO_V3:point_de_repere", "route='A6'", (0, 0, 1000, 1000))
+
+def test_round_trip_and_counters(tmp_path):
+    cache = WFSCache(cache_dir=str(tmp_path))
+    key = cache.make_key("BDTOPO_V3:point_de_repere", "route='A1'", (0, 0, 1000, 1000))
+    gdf = make_gdf()
+
+    assert cache.get(key) is None
+    cache.put(key, gdf)
+
+    assert cache.get(key).equals(gdf)
+    assert cache.stats() == {"hits": 1, "misses": 1, "hit_rate": 0.5}
+    assert cache.get(cache.make_key("BDTOPO_V3:point_de_repere", "route='A6'", (0, 0, 1000, 1000))) is None
+
+def test_expired_entry_is_a_miss(tmp_path):
+    key = WFSCache().make_key("BDTOPO_V3:point_de_repere")
+    WFSCache(cache_dir=str(tmp_path)).put(key, make_gdf())
+
+    assert WFSCache(cache_dir=str(tmp_path), max_age_days=-1).get(key) is None
+    assert not os.listdir(tmp_path)
+
+def test_unreadable_entry_removed(tmp_path):
+    cache = WFSCache(cache_dir=str(tmp_path))
+    key = cache.make_key("BDTOPO_V3:point_de_repere")
+    (tmp_path / f"{key}.pkl").write_bytes(b"not a pickle")
+
+    assert cache.get(key) is None
+    assert not os.listdir(tmp_path)
+
+def test_eviction_keeps_the_cache_under_its_size(tmp_path):
+    cache = WFSCache(cache_dir=str(tmp_path), max_size_mb=0.01)
+    for k in range(20):
+        cache.put(cache.make_key("BDTOPO_V3:point_de_repere", f"route='A{k}'"), make_gdf(50))
+
+    sizes = [entry.stat().st_size for entry in tmp_path.iterdir()]
+    assert 0 < len(sizes) < 20
+    assert sum(sizes) <= cache.max_size_bytes
+
+def test_concurrent_puts_and_evictions(tmp_path):
+    # Two caches on the same directory, as two processes, written to by several threads each
+    caches = [WFSCache(cache_dir=str(tmp_path), max_size_mb=0.02) for _ in range(2)]
+    errors = []
+
+    def work(cache, thread_index):
+        try:
+            for k in range(30):
+                key = cache.make_key("BDTOPO_V3:point_de_repere", f"route='A{k % 7}'")
+                cache.put(key, make_gdf(20))
+                cache.get(key)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(caches[k % 2], k)) for k in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert sum(cache.hits + cache.misses for cache in caches) == 8 * 30
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
@@ -0,0 +1,247 @@
+import numpy as np
+
+# Perpendicular transects of ProfileAnalyzer: 2 x 60 m, sampled every meter (positions 0 to 120)
+TRANSECT_HALF_WIDTH = 60
+TRANSECT_POSITIONS = np.arange(0, 2 * TRANSECT_HALF_WIDTH + 1, dtype="float64")
+
+class LinearFit:
+    """
+    Line fitted on a profile (altitude = coef * distance + intercept).
+    Exposes the coef_, intercept_ and predict interface of the sklearn LinearRegression it replaces,
+    so that the attribute and visualization methods accept both.
+    """
+    def __init__(self, coef, intercept, r2=None):
+        self.coef_ = np.array([[coef]], dtype="float64")
+        self.intercept_ = np.array([intercept], dtype="float64")
+        self.r2 = r2
+
+    def predict(self, X):
+        X = np.asarray(X, dtype="float64").reshape(-1, 1)
+        return X @ self.coef_.T + self.intercept_
+
+def fit_lines(x, y, valid):
+    """
+    Least-squares line fit of every row of the (n_profiles, n_samples) arrays x and y, using only
+    the samples where valid is True.
+    Returns the coef, intercept and R² arrays (NaN for rows without valid samples). As with sklearn,
+    R² is NaN with a single sample, and 1 or 0 for a constant profile fitted exactly or not.
+    """
+    x = np.where(valid, x, 0.0)
+    y = np.where(valid, y, 0.0)
+    n = valid.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        x_mean = x.sum(axis=1) / n
+        y_mean = y.sum(axis=1) / n
+        x_centred = np.where(valid, x - x_mean[:, None], 0.0)
+        y_centred = np.where(valid, y - y_mean[:, None], 0.0)
+        sxx = (x_centred * x_centred).sum(axis=1)
+        sxy = (x_centred * y_centred).sum(axis=1)
+        coef = np.where(sxx > 0, sxy / sxx, 0.0)
+        intercept = y_mean - coef * x_mean
+
+        residuals = np.where(valid, y - (x * coef[:, None] + intercept[:, None]), 0.0)
+        ss_res = (residuals * residuals).sum(axis=1)
+        ss_tot = (y_centred * y_centred).sum(axis=1)
+        r2 = np.where(ss_tot > 0, 1 - ss_res / ss_tot, np.where(ss_res == 0, 1.0, 0.0))
+
+    coef[n == 0] = np.nan
+    intercept[n == 0] = np.nan
+    r2[n < 2] = np.nan
+    return coef, intercept, r2
+
+def transect_coordinates(starts, ends, positions=TRANSECT_POSITIONS):
+    """
+    Coordinates of the points at the given positions (distance from the start point) along every transect,
+    as an (N, n_positions, 2) array. positions is shared by all the transects (1-D) or given per transect
+    (N, n_positions). Positions are clamped to the transect, as LineString.interpolate does.
+    """
+    positions = np.asarray(positions, dtype="float64")
+    if positions.ndim == 1:
+        positions = positions[None, :]
+    deltas = ends - starts
+    lengths = np.sqrt(deltas[:, 0] * deltas[:, 0] + deltas[:, 1] * deltas[:, 1])
+    fractions = np.clip(positions, 0, lengths[:, None]) / lengths[:, None]
+    return starts[:, None, :] + fractions[:, :, None] * deltas[:, None, :]
+
+def sample_transects(dem_source, starts, ends, positions=TRANSECT_POSITIONS, method="nearest"):
+    """
+    Sample the DEM along every transect in a single call.
+    Returns the coordinates (N, n_positions, 2), the elevations (N, n_positions, NaN where invalid)
+    and the valid mask.
+    """
+    coords = transect_coordinates(starts, ends, positions)
+    values, valid = dem_source.sample(coords.reshape(-1, 2), method=method)
+    return coords, values.reshape(coords.shape[:2]), valid.reshape(coords.shape[:2])
+
+def band_mask(positions, start, end):
+    """Mask of the positions of a band [start, end], sampled every meter from start like np.arange(start, end + 1)"""
+    positions = np.asarray(positions, dtype="float64")
+    return (positions >= start) & (positions <= end) & ((positions - start) % 1 == 0)
+
+def band_mean(values, valid, mask):
+    """Mean of the valid values of a band on every transect (NaN without valid values)"""
+    in_band = valid & mask[None, :]
+    n = in_band.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(in_band, values, 0.0).sum(axis=1) / n
+
+def natural_terrain_fit(coords, values, valid, mask):
+    """
+    Line fit of the natural terrain on the positions of mask, with the distance measured from the start
+    of each transect as in calculate_natural_slope. Returns the coef, intercept and R² arrays.
+    """
+    distance = np.hypot(coords[:, :, 0] - coords[:, :1, 0], coords[:, :, 1] - coords[:, :1, 1])
+    in_band = valid & mask[None, :]
+    return fit_lines(distance, values, in_band)
+
+# Half-meter grid covering the slope toe/crest searches of calculate_attributes_deblai and calculate_attributes_remblai
+ATTRIBUTE_POSITIONS = np.arange(28, 62.5, 0.5)
+
+def _grid_index(positions):
+    """Index of positions of the half-meter grid in ATTRIBUTE_POSITIONS"""
+    return np.rint((np.asarray(positions) - ATTRIBUTE_POSITIONS[0]) / 0.5).astype("int64")
+
+def _slopes(coords_a, altitude_a, coords_b, altitude_b):
+    """Slope from point a to point b as calculate_slope: (altitude_b - altitude_a) / distance, NaN when an altitude is missing"""
+    dx = coords_b[..., 0] - coords_a[..., 0]
+    dy = coords_b[..., 1] - coords_a[..., 1]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (altitude_b - altitude_a) / np.sqrt(dx ** 2 + dy ** 2)
+
+def _pair_slopes(dem_source, starts, ends, positions_a, positions_b):
+    """Slopes between two positions given per transect, sampled in a single DEM read"""
+    coords, altitude, _ = sample_transects(dem_source, starts, ends, np.column_stack([positions_a, positions_b]))
+    return _slopes(coords[:, 0], altitude[:, 0], coords[:, 1], altitude[:, 1])
+
+def _sign_change_search(coords, altitude, coefs, intercepts, start_positions, stop=30, step=0.5):
+    """
+    Walk every transect from start_positions away from the route axis by step while the position is above stop,
+    as the loops of calculate_attributes_*: positions without elevation are skipped, and the walk stops at the
+    first position where the difference between the terrain and the natural terrain line changes sign
+    compared to the previous position with elevation.
+    coords and altitude are sampled on ATTRIBUTE_POSITIONS.
+    Returns the walked positions (N, n_steps) and their indexes in ATTRIBUTE_POSITIONS, the mask of the positions
+    kept as calculation points, the position where the walk ended and the altitude of the last walked position
+    (NaN when missing).
+    """
+    rows = np.arange(len(start_positions))[:, None]
+    steps = np.arange(int(round((ATTRIBUTE_POSITIONS[-1] - stop) / step)))
+    positions = start_positions[:, None] - step * steps[None, :]
+    walked = positions > stop
+    indexes = np.clip(_grid_index(positions), 0, len(ATTRIBUTE_POSITIONS) - 1)
+
+    position_altitude = altitude[rows, indexes]
+    evaluated = walked & ~np.isnan(position_altitude)
+    difference = position_altitude - (positions * coefs[:, None] + intercepts[:, None])
+
+    # Difference at the previous evaluated position of each step
+    last_evaluated = np.maximum.accumulate(np.where(evaluated, steps[None, :], -1), axis=1)
+    previous = np.concatenate([np.full((len(rows), 1), -1), last_evaluated[:, :-1]], axis=1)
+    previous_difference = difference[rows, np.maximum(previous, 0)]
+    with np.errstate(invalid="ignore"):
+        crossing = evaluated & (previous >= 0) & (previous_difference * difference <= 0)
+
+    found = crossing.any(axis=1)
+    last_step = np.where(found, np.argmax(crossing, axis=1), walked.sum(axis=1) - 1)
+    kept = evaluated & (steps[None, :] <= last_step[:, None])
+    end_positions = np.where(found, positions[rows[:, 0], np.maximum(last_step, 0)], np.minimum(start_positions, stop))
+    # Without any walked position, the altitude is the one at the start position
+    end_altitude = position_altitude[rows[:, 0], np.maximum(last_step, 0)]
+    return positions, indexes, kept, end_positions, end_altitude
+
+def _calculation_points(coords, altitude, positions, indexes, kept):
+    """Calculation points of the walks: station index, x, y, elevation, slope over the surrounding meter and distance"""
+    rows = np.arange(len(positions))[:, None]
+    step_slopes = _slopes(coords[rows, indexes + 1], altitude[rows, indexes + 1], coords[rows, indexes - 1], altitude[rows, indexes - 1])
+    station, step = np.nonzero(kept)
+    step_coords = coords[station, indexes[station, step]]
+    return {
+        "station": station,
+        "x": step_coords[:, 0],
+        "y": step_coords[:, 1],
+        "elevation": altitude[station, indexes[station, step]],
+        "slope": step_slopes[station, step],
+        "distance": positions[station, step]
+    }
+
+def _section_slopes(dem_source, starts, ends, dist_min, dist_max, distance):
+    """
+    Slopes of the ouvrage between 2 m inside its ends (section) and over 3 m around dist_min + distance / 2 (middle),
+    NaN when the ouvrage is not longer than 3 m
+    """
+    long_enough = distance > 3
+    slope_section = np.full(len(distance), np.nan)
+    slope_middle = np.full(len(distance), np.nan)
+    if long_enough.any():
+        selected = np.flatnonzero(long_enough)
+        middle = dist_min[selected] + distance[selected] / 2
+        slope_section[selected] = _pair_slopes(dem_source, starts[selected], ends[selected], dist_min[selected] + 2, dist_max[selected] - 2)
+        slope_middle[selected] = _pair_slopes(dem_source, starts[selected], ends[selected], middle - 1.5, middle + 1.5)
+    return slope_section, slope_middle
+
+def deblai_attributes(dem_source, starts, ends, coefs, intercepts):
+    """
+    Attributes of deblai profiles, for all the transects at once, as calculate_attributes_deblai:
+    the toe of the cutting is the lowest point between 60 and 46 m, and its top the first crossing of the
+    terrain with the natural terrain line walking outwards from the toe.
+    Returns the total, section and middle slopes and the height difference (NaN when missing), and the calculation points.
+    """
+    coords, altitude, _ = sample_transects(dem_source, starts, ends, ATTRIBUTE_POSITIONS)
+    rows = np.arange(len(coefs))
+
+    # Lowest point, the first one found walking from 60 m; 1000 m and 60 m without any lower elevation
+    candidate_positions = np.arange(60, 45, -1, dtype="float64")
+    candidates = altitude[:, _grid_index(candidate_positions)]
+    candidates = np.where(np.isnan(candidates), np.inf, candidates)
+    lowest = np.argmin(candidates, axis=1)
+    lower = candidates[rows, lowest] < 1000
+    alt_min = np.where(lower, candidates[rows, lowest], 1000.0)
+    dist_min = np.where(lower, candidate_positions[lowest], 60.0)
+
+    positions, indexes, kept, dist_max, alt_max = _sign_change_search(coords, altitude, coefs, intercepts, dist_min)
+    distance = np.abs(dist_min - dist_max)
+    height_difference = alt_max - alt_min
+    slope_ouvrage_total = height_difference / distance
+    slope_ouvrage_section, slope_ouvrage_middle = _section_slopes(dem_source, starts, ends, dist_min, dist_max, distance)
+
+    return slope_ouvrage_total, slope_ouvrage_section, slope_ouvrage_middle, height_difference, _calculation_points(coords, altitude, positions, indexes, kept)
+
+def remblai_attributes(dem_source, starts, ends, coefs, intercepts):
+    """
+    Attributes of remblai profiles, for all the transects at once, as calculate_attributes_remblai:
+    the crest of the embankment is where the slope first reaches 8 % walking outwards from 60 m, and
+    its toe the first crossing of the terrain with the natural terrain line beyond it.
+    Returns the total, section and middle slopes and the height difference (NaN when missing, or when the
+    height difference is above 50 m), and the calculation points.
+    A missing slope while looking for the crest is skipped.
+    """
+    coords, altitude, _ = sample_transects(dem_source, starts, ends, ATTRIBUTE_POSITIONS)
+    rows = np.arange(len(coefs))
+
+    # Crest: first position i from 60 m with a slope of at least 0.08 between i + 1 and i - 0.5
+    crest_positions = np.arange(60, 30, -0.5)
+    upper = _grid_index(crest_positions + 1)
+    lower = _grid_index(crest_positions - 0.5)
+    with np.errstate(invalid="ignore"):
+        steep = np.abs(_slopes(coords[:, upper], altitude[:, upper], coords[:, lower], altitude[:, lower])) >= 0.08
+    found = steep.any(axis=1)
+    crest = np.where(found, crest_positions[np.argmax(steep, axis=1)], 30.5)
+    alt_max = altitude[rows, _grid_index(crest + 1)]
+    dist_max = crest - 0.5
+
+    positions, indexes, kept, end_positions, alt_min = _sign_change_search(coords, altitude, coefs, intercepts, dist_max)
+    dist_min = end_positions + 0.5
+    distance = np.abs(dist_max - dist_min)
+    height_difference = alt_max - alt_min
+    with np.errstate(invalid="ignore"):
+        height_difference[height_difference > 50] = np.nan
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope_ouvrage_total = height_difference / distance
+    slope_ouvrage_section, slope_ouvrage_middle = _section_slopes(dem_source, starts, ends, dist_min, dist_max, distance)
+
+    # No ouvrage when the walk ends where it started
+    zero = distance == 0
+    for values in (slope_ouvrage_total, slope_ouvrage_section, slope_ouvrage_middle, height_difference):
+        values[zero] = np.nan
+
+    return slope_ouvrage_total, slope_ouvrage_section, slope_ouvrage_middle, height_difference, _calculation_points(coords, altitude, positions, indexes, kept)
@@ -0,0 +1,146 @@
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+
+class WFSCache:
+    """
+    Content-addressed on-disk cache for WFS GetFeature responses.
+    Entries are keyed on (WFS endpoint, TYPENAMES, CQL_FILTER, bbox, SRSNAME) and store the parsed GeoDataFrame,
+    so a cache hit skips both the network round trip and the GeoJSON parsing.
+    The cache is shared by the threads of the concurrent downloads: the counters and the eviction are
+    protected by a lock, and an entry removed by another thread is treated as a miss.
+    """
+    def __init__(self, cache_dir=".wfs_cache", max_size_mb=500, max_age_days=30, cache_only=False, enabled=True):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_mb * 1024 * 1024
+        self.max_age_seconds = max_age_days * 24 * 3600 if max_age_days is not None else None
+        self.cache_only = cache_only  # Offline mode: never go to the network, a miss returns None
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def make_key(self, type_of_data, cql_filter=None, bbox=None, srsname="EPSG:2154", url=None):
+        """
+        Build the cache key of a request from its TYPENAMES, CQL_FILTER, bbox and SRSNAME, and the URL of the
+        WFS it is sent to, so that responses of another endpoint (e.g. a local stub) are never returned
+        """
+        bbox_values = [round(float(v), 3) for v in bbox] if bbox is not None else None
+        payload = json.dumps([url, type_of_data, cql_filter, bbox_values, srsname])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.pkl")
+
+    def get(self, key):
+        """Return the cached GeoDataFrame for a key, or None on a miss or an expired entry"""
+        if not self.enabled:
+            return None
+
+        path = self._entry_path(key)
+        try:
+            with open(path, "rb") as f:
+                entry = pickle.load(f)
+        except FileNotFoundError:
+            self._count(hit=False)
+            return None
+        except Exception as e:
+            print(f"Entrée de cache illisible, suppression: {path} ({e})")
+            self._remove(path)
+            self._count(hit=False)
+            return None
+
+        if self.max_age_seconds is not None and time.time() - entry["created"] > self.max_age_seconds:
+            self._remove(path)
+            self._count(hit=False)
+            return None
+
+        # Update the access time so that size-based eviction removes the least recently used entries first
+        try:
+            os.utime(path, None)
+        except FileNotFoundError:
+            pass
+        self._count(hit=True)
+        return entry["gdf"]
+
+    def put(self, key, gdf, params=None):
+        """Store a GeoDataFrame in the cache, then evict old entries if the cache is too large"""
+        if not self.enabled or gdf is None:
+            return
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._entry_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        entry = {"created": time.time(), "params": params, "gdf": gdf}
+        with open(tmp_path, "wb") as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+        self.evict()
+
+    def evict(self):
+        """Remove expired entries, then the least recently used ones until the cache fits in max_size_mb"""
+        with self._lock:
+            try:
+                file_names = os.listdir(self.cache_dir)
+            except FileNotFoundError:
+                return
+
+            entries = []
+            now = time.time()
+            for file_name in file_names:
+                if not file_name.endswith(".pkl"):
+                    continue
+                path = os.path.join(self.cache_dir, file_name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    # Removed by another process since the listing
+                    continue
+                # mtime is the creation time unless the entry has been read since, which only makes it younger
+                if self.max_age_seconds is not None and now - stat.st_mtime > self.max_age_seconds:
+                    self._remove(path)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+            total_size = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total_size <= self.max_size_bytes:
+                    break
+                self._remove(path)
+                total_size -= size
+
+    def clear(self):
+        """Remove every entry of the cache"""
+        if not os.path.isdir(self.cache_dir):
+            return
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.endswith(".pkl"):
+                self._remove(os.path.join(self.cache_dir, file_name))
+
+    def stats(self):
+        """Return the hit/miss counters of the cache"""
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0.0
+        }
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass